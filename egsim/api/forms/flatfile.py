@@ -1,4 +1,6 @@
 """Base Form for to model-to-data operations i.e. flatfile handling"""
+from collections.abc import Hashable
+from os.path import getmtime
 
 import pandas as pd
 from django.core.files.uploadedfile import TemporaryUploadedFile
@@ -51,6 +53,12 @@ class FlatfileForm(EgsimBaseForm):
         'selexpr': ('flatfile-query', 'data-query'),
         'flatfile': ('flatfile', 'data')
     }
+    # Whether predefined flatfiles are read in `clean` (True). If False,
+    # `cleaned_data['flatfile']` is the flatfile name, and subclasses are responsible
+    # to call `read_predefined_flatfile` (e.g., only if no data is cached for the
+    # flatfile, see `flatfile_key`):
+    read_predefined_flatfile_in_clean = True
+
     flatfile = CharField(
         required=False,
         help_text="The flatfile (pre- or user-defined) containing observed ground "
@@ -64,6 +72,8 @@ class FlatfileForm(EgsimBaseForm):
 
     def __init__(self, data, files=None, **kwargs):
         self._uploaded_flatfile_form = None
+        self._predefined_flatfile = None
+        self._flatfile_key = None
         if files is not None:
             self._uploaded_flatfile_form = _UploadedFlatfile(files=files)
         super().__init__(data=data, **kwargs)
@@ -128,23 +138,50 @@ class FlatfileForm(EgsimBaseForm):
             if flatfile_db_obj is None:
                 self.add_error("flatfile", self.ErrMsg.invalid_choice)
                 return cleaned_data
-            # cleaned_data["flatfile"] is a models.Flatfile instance:
-            dataframe = flatfile_db_obj.read_from_filepath()
-        else:  # uploaded (user-defined) flatfile
-            try:
-                # u_flatfile is a Django TemporaryUploadedFile or InMemoryUploadedFile
-                # (the former if file size > configurable threshold
-                # (https://stackoverflow.com/a/10758350):
-                dataframe = read_flatfile(u_flatfile)
-            except IncompatibleColumnError as ice:
-                self.add_error(
-                    'flatfile', f'column names conflict {str(ice)}'
-                )
-                return cleaned_data
-            except FlatfileError as err:
-                self.add_error("flatfile", str(err))
-                return cleaned_data  # no need to further process
+            self._predefined_flatfile = flatfile_db_obj
+            self._flatfile_key = (
+                flatfile_db_obj.name,
+                getmtime(flatfile_db_obj.filepath),
+                cleaned_data.get('selexpr', None) or ''
+            )
+            if self.read_predefined_flatfile_in_clean:
+                self.read_predefined_flatfile()
+            return cleaned_data
+
+        # uploaded (user-defined) flatfile:
+        try:
+            # u_flatfile is a Django TemporaryUploadedFile or InMemoryUploadedFile
+            # (the former if file size > configurable threshold
+            # (https://stackoverflow.com/a/10758350):
+            dataframe = read_flatfile(u_flatfile)
+        except IncompatibleColumnError as ice:
+            self.add_error(
+                'flatfile', f'column names conflict {str(ice)}'
+            )
+            return cleaned_data
+        except FlatfileError as err:
+            self.add_error("flatfile", str(err))
+            return cleaned_data  # no need to further process
+
+        self._set_flatfile(dataframe)
+        return cleaned_data
 
+    def read_predefined_flatfile(self) -> pd.DataFrame | None:
+        """
+        Read the predefined flatfile of this form (see `predefined_flatfile`),
+        apply the data selection expression, if given, and set the resulting
+        DataFrame as `self.cleaned_data['flatfile']`. Return the DataFrame, or None
+        if the selection expression is invalid (in this case, a form error is added)
+        """
+        return self._set_flatfile(self._predefined_flatfile.read_from_filepath())
+
+    def _set_flatfile(self, dataframe: pd.DataFrame) -> pd.DataFrame | None:
+        """
+        Apply the data selection expression, if given, to `dataframe` and set the
+        result as `self.cleaned_data['flatfile']`. Return the DataFrame, or None
+        if the selection expression is invalid (in this case, a form error is added)
+        """
+        cleaned_data = self.cleaned_data
         # replace the flatfile parameter with the pandas dataframe:
         cleaned_data['flatfile'] = dataframe
 
@@ -156,8 +193,29 @@ class FlatfileForm(EgsimBaseForm):
             except FlatfileQueryError as exc:
                 # add_error removes also the field from self.cleaned_data:
                 self.add_error(key, str(exc))
+                return None
 
-        return cleaned_data
+        return cleaned_data['flatfile']
+
+    @property
+    def predefined_flatfile(self) -> models.Flatfile | None:
+        """
+        Return the predefined flatfile (`models.Flatfile`) of this form, or None
+        (e.g., uploaded flatfile, or invalid form)
+        """
+        return self._predefined_flatfile if not self.errors else None
+
+    @property
+    def flatfile_key(self) -> Hashable | None:
+        """
+        Return a key identifying the flatfile of this form (i.e., after validation,
+        `self.cleaned_data['flatfile']`) and that can be used to cache data computed
+        from it. The key is a tuple (flatfile name, file modification time, selection
+        expression) for predefined flatfiles, None in any other case (e.g.,
+        uploaded flatfile, or invalid form). The key is available before reading
+        the flatfile (see `read_predefined_flatfile_in_clean`)
+        """
+        return self._flatfile_key if not self.errors else None
 
 
 class FlatfileValidationForm(APIForm, FlatfileForm):
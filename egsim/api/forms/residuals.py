@@ -1,14 +1,32 @@
 """
 Django Forms for eGSIM model-to-data comparison (residuals computation)
 """
+from collections.abc import Iterator
+
 import pandas as pd
-from django.forms import BooleanField
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.forms import BooleanField, ChoiceField, FloatField, IntegerField
 
-from egsim.smtk.residuals import get_residuals, Clabel
-from egsim.smtk.ranking import get_measures_of_fit
+from egsim.smtk.cache import LRUCache
+from egsim.smtk.residuals import (
+    get_residuals,
+    iter_residuals,
+    prepare_flatfile,
+    get_required_ground_motion_property_names,
+    SaSpectrum,
+    Clabel
+)
+from egsim.smtk.ranking import get_measures_of_fit, get_measures_of_fit_bootstrap
 from egsim.api.forms import APIForm
 from egsim.api.forms import GsimImtForm
 from egsim.api.forms.flatfile import FlatfileForm
+from egsim.api.forms.scenarios import ArrayField
+
+
+# Cache of the predefined flatfiles prepared for residuals computation, mapped to
+# the flatfile key and the required columns (see `ResidualsForm._prepared_flatfile`):
+prepared_flatfiles = LRUCache(settings.EGSIM_PREPARED_FLATFILES_CACHE_SIZE)
 
 
 class ResidualsForm(GsimImtForm, FlatfileForm, APIForm):
@@ -34,6 +52,29 @@ class ResidualsForm(GsimImtForm, FlatfileForm, APIForm):
                   'median, loglikelihood, EDR). With ranking, the parameters '
                   'likelihood and normalize are set to true by default'
     )
+    bootstrap = IntegerField(
+        initial=0,
+        min_value=0,
+        max_value=1000,
+        help_text='Model ranking only: the number of bootstrap samples used to '
+                  'compute the 95% confidence interval of each measure of fit '
+                  '(events are resampled with replacement, with a fixed random '
+                  'seed for reproducible results). 0 (the default): no confidence '
+                  'interval'
+    )
+    edr_bandwidth = ArrayField(
+        FloatField(initial=0.01),
+        help_text='Model ranking only: the bandwidth(s) used in the EDR computation '
+                  '(Kale and Akkar 2013. https://doi.org/10.1785/0120120134). '
+                  'With several bandwidths and/or multipliers, EDR measures are '
+                  'returned for each (bandwidth, multiplier) pair, with the '
+                  'parameters appended to the measure name'
+    )
+    edr_multiplier = ArrayField(
+        FloatField(initial=3.0, min_value=0),
+        help_text='Model ranking only: the multiplier(s) of the standard deviation '
+                  'used in the EDR computation (see edr_bandwidth for details)'
+    )
     # multi_header has no initial value because its default will vary: here is
     # `CLabel.sep` (see `output`), but this will change in subclasses:
     multi_header = BooleanField(
@@ -44,9 +85,53 @@ class ResidualsForm(GsimImtForm, FlatfileForm, APIForm):
         initial=False
     )
 
+    dtype = ChoiceField(
+        initial='float64',
+        choices=[
+            ('float64', 'float64 (double precision)'),
+            ('float32', 'float32 (single precision: half memory and data size)')
+        ],
+        help_text='The floating point precision of the returned values. Models are '
+                  'always computed in double precision'
+    )
+
     # Custom API param names (see doc of `EgsimBaseForm._field2params` for details):
     _field2params = {}
 
+    # predefined flatfiles are read in `clean` only if not cached:
+    read_predefined_flatfile_in_clean = False
+
+    def __init__(self, data, files=None, **kwargs):
+        self._cached_flatfile = None  # the prepared flatfile, if found in cache
+        super().__init__(data, files, **kwargs)
+
+    def clean_edr_bandwidth(self) -> list[float]:
+        """Check that all EDR bandwidths are positive"""
+        value = self.cleaned_data['edr_bandwidth']
+        if any(v <= 0 for v in value):
+            raise ValidationError('values must be positive')
+        return value
+
+    def clean(self):
+        """
+        Call `super.clean()` and look up the cache of prepared flatfiles (see
+        `_prepared_flatfile`) for predefined flatfiles. If not found, read the
+        flatfile (if not already read in `super.clean()`). Note that cached flatfiles
+        skip the flatfile reading and data selection (`cleaned_data['flatfile']` is
+        then the flatfile name)
+        """
+        cleaned_data = super().clean()
+        key = self._prepared_flatfile_key()
+        if key is not None:
+            self._cached_flatfile = prepared_flatfiles.get(key)
+        if (
+            self.flatfile_key is not None and
+            self._cached_flatfile is None and
+            not self.read_predefined_flatfile_in_clean
+        ):
+            self.read_predefined_flatfile()
+        return cleaned_data
+
     def output(self) -> pd.DataFrame:
         """
         Compute and return the output from the input data (`self.cleaned_data`).
@@ -57,18 +142,130 @@ class ResidualsForm(GsimImtForm, FlatfileForm, APIForm):
         :return: any Python object (e.g., a JSON-serializable dict)
         """
         cleaned_data = self.cleaned_data
-        gsims, imts = cleaned_data["gsim"], cleaned_data["imt"]
+        residuals = get_residuals(**self._residuals_kwargs())
+        if cleaned_data['ranking']:
+            edr_kwargs = self._edr_kwargs()
+            if cleaned_data['bootstrap']:
+                return get_measures_of_fit_bootstrap(
+                    cleaned_data["gsim"], cleaned_data["imt"], residuals,
+                    num_samples=cleaned_data['bootstrap'],
+                    workers=settings.EGSIM_RESIDUALS_WORKERS,
+                    seed=0,
+                    **edr_kwargs
+                )
+            return get_measures_of_fit(
+                cleaned_data["gsim"], cleaned_data["imt"], residuals, **edr_kwargs
+            )
+        return residuals
+
+    def _edr_kwargs(self) -> dict:
+        """
+        Return the EDR arguments of the measures of fit from `self.cleaned_data`:
+        single values are passed as scalars, so that the EDR measure names are not
+        suffixed with the EDR parameters (see `get_measures_of_fit`)
+        """
+        bandwidths = self.cleaned_data['edr_bandwidth']
+        multipliers = self.cleaned_data['edr_multiplier']
+        if len(bandwidths) == len(multipliers) == 1:
+            return dict(edr_bandwidth=bandwidths[0], edr_multiplier=multipliers[0])
+        return dict(edr_bandwidth=bandwidths, edr_multiplier=multipliers)
+
+    def output_chunks(self, max_records: int | None) -> Iterator[pd.DataFrame]:
+        """
+        Same as `self.output()` but return an iterator of DataFrames (chunks)
+        with at most `max_records` rows each (records are grouped by event, see
+        `iter_residuals` for details). When ranking is requested, the output
+        is a single chunk (the model ranking table). Inputs are validated and any
+        error is raised before returning
+        """
+        if self.cleaned_data['ranking']:
+            return iter([self.output()])
+        return iter_residuals(
+            **self._residuals_kwargs(), max_records=max_records
+        )
+
+    def _residuals_kwargs(self) -> dict:
+        """Return the arguments for computing residuals from `self.cleaned_data`"""
+        cleaned_data = self.cleaned_data
         is_ranking = cleaned_data['ranking']
         header_sep = None if cleaned_data.get('multi_header') else Clabel.sep
-        residuals = get_residuals(
-            cleaned_data["gsim"],
-            cleaned_data["imt"],
-            cleaned_data['flatfile'],
+        flatfile, prepared = self._prepared_flatfile()
+        return dict(
+            gsims=cleaned_data["gsim"],
+            imts=cleaned_data["imt"],
+            flatfile=flatfile,
+            prepared=prepared,
+            expected=self._stored_expected_motions(),
             likelihood=True if is_ranking else cleaned_data['likelihood'],
             mean=is_ranking,
             normalise=True if is_ranking else cleaned_data['normalize'],
-            header_sep=None if is_ranking else header_sep
+            header_sep=None if is_ranking else header_sep,
+            workers=settings.EGSIM_RESIDUALS_WORKERS,
+            dtype=cleaned_data['dtype']
         )
-        if is_ranking:
-            return get_measures_of_fit(gsims, imts, residuals)
-        return residuals
+
+    def _prepared_flatfile(self) -> tuple[pd.DataFrame, bool]:
+        """
+        Return the tuple (flatfile, prepared) from `self.cleaned_data`. For predefined
+        flatfiles, `flatfile` is prepared for residuals computation (see
+        `prepare_flatfile`) and cached, so that requests with the same flatfile, data
+        selection, intensity measures and models required properties will skip
+        the flatfile reading, data selection and preparation (see `clean`).
+        Otherwise, `flatfile` is returned as it is (`prepared=False`)
+        """
+        if self._cached_flatfile is not None:  # found in `clean`
+            return self._cached_flatfile, True
+        cleaned_data = self.cleaned_data
+        flatfile = cleaned_data['flatfile']
+        key = self._prepared_flatfile_key()
+        if key is None:
+            return flatfile, False
+        gsims, imts = cleaned_data["gsim"], cleaned_data["imt"]
+        flatfile_r = prepare_flatfile(flatfile, gsims, imts, self._stored_sa_spectrum())
+        prepared_flatfiles.put(key, flatfile_r)
+        return flatfile_r, True
+
+    def _prepared_flatfile_key(self) -> tuple | None:
+        """
+        Return the key of the prepared flatfile of this form in `prepared_flatfiles`,
+        i.e. the tuple (flatfile key, models required properties, intensity
+        measures), or None (uploaded flatfile, invalid form, or disabled cache)
+        """
+        flatfile_key = self.flatfile_key
+        if flatfile_key is None or prepared_flatfiles.max_size <= 0:
+            return None
+        gsims, imts = self.cleaned_data["gsim"], self.cleaned_data["imt"]
+        return (
+            flatfile_key,
+            frozenset(get_required_ground_motion_property_names(gsims.values())),
+            tuple(imts)
+        )
+
+    def _stored_sa_spectrum(self) -> SaSpectrum | None:
+        """
+        Return the precomputed SA spectrum for the predefined flatfile of this
+        form (see command `egsim-expected-motions`), or None. The spectrum is
+        cached (see `prepared_flatfiles`)
+        """
+        flatfile_db_obj = self.predefined_flatfile
+        if flatfile_db_obj is None:
+            return None
+        key = (self.flatfile_key[:2], 'sa_spectrum')  # (name, mtime), 'sa_spectrum'
+        sa_spectrum = prepared_flatfiles.get(key)
+        if sa_spectrum is None:
+            sa_spectrum = flatfile_db_obj.read_sa_spectrum()
+            if sa_spectrum is not None:
+                prepared_flatfiles.put(key, sa_spectrum)
+        return sa_spectrum
+
+    def _stored_expected_motions(self) -> pd.DataFrame | None:
+        """
+        Return the precomputed expected motions of the requested models for the
+        predefined flatfile of this form (see command `egsim-expected-motions`), or
+        None (uploaded flatfile or no stored model). Models not found in the
+        returned DataFrame will be computed
+        """
+        flatfile_db_obj = self.predefined_flatfile
+        if flatfile_db_obj is None:
+            return None
+        return flatfile_db_obj.read_expected_motions(self.cleaned_data['gsim'])
@@ -1,18 +1,33 @@
 """Django Forms for eGSIM model-to-model comparison"""
 
+from collections.abc import Iterator
 from itertools import cycle
 
 import pandas as pd
 from openquake.hazardlib.geo import Point
 from openquake.hazardlib.scalerel import get_available_magnitude_scalerel
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.forms.fields import BooleanField, FloatField, ChoiceField, Field
 
 from egsim.api.forms import APIForm, GsimImtForm
-from egsim.smtk import get_ground_motion_from_scenarios
-from egsim.smtk.scenarios import RuptureProperties, SiteProperties, Clabel
+from egsim.smtk import (
+    get_ground_motion_from_scenarios,
+    iter_ground_motion_from_scenarios,
+    get_ground_motion_from_batch_scenarios,
+    get_ground_motion_on_grid
+)
+from egsim.smtk.cache import LRUCache
+from egsim.smtk.scenarios import (
+    RuptureProperties, SiteProperties, Clabel, grid_coordinates
+)
 
 
+# Cache of the scenario context objects (ruptures and sites) built for predictions
+# computation, mapped to the magnitude and the scenario geometry (see
+# `egsim.smtk.scenarios.build_contexts`):
+scenario_contexts = LRUCache(settings.EGSIM_SCENARIO_CONTEXTS_CACHE_SIZE)
+
 
 class ArrayField(Field):
     """
@@ -39,8 +54,10 @@ class ArrayField(Field):
 
     def clean(self, value):
         cleaned_data = []
-        if not value and self.required:
-            raise ValidationError(APIForm.ErrMsg.required)
+        if value in self.empty_values:
+            if self.required:
+                raise ValidationError(APIForm.ErrMsg.required)
+            return []
         if not isinstance(value, (list, tuple)):
             value = [value]
         size = len(self.base_fields)
@@ -77,6 +94,8 @@ class PredictionsForm(GsimImtForm, APIForm):
         'initial_point': ('initial-point', 'initial_point'),
         'hypocenter_location': ('hypocenter-location', 'hypocenter_location',),
         'line_azimuth': ('line-azimuth', 'line_azimuth'),
+        'grid_bbox': ('grid-bbox', 'grid_bbox'),
+        'grid_resolution': ('grid-resolution', 'grid_resolution'),
     }
 
     # RUPTURE PARAMS:
@@ -88,9 +107,10 @@ class PredictionsForm(GsimImtForm, APIForm):
     )
     distance = ArrayField(
         FloatField(),
-        required=True,
+        required=False,
         help_text='Distances (km). '
-                  'Each distance defines a Site of the user-defined Scenario'
+                  'Each distance defines a Site of the user-defined Scenario. '
+                  'Required unless grid-bbox is given'
     )
     aspect = FloatField(
         min_value=0., initial=1.0, help_text='Rupture Length / Width ≥ 0 and ≤ 1'
@@ -190,6 +210,45 @@ class PredictionsForm(GsimImtForm, APIForm):
                   'imt+" "+type+" "+model'
     )
 
+    dtype = ChoiceField(
+        initial='float64',
+        choices=[
+            ('float64', 'float64 (double precision)'),
+            ('float32', 'float32 (single precision: half memory and data size)')
+        ],
+        help_text='The floating point precision of the returned values. Models are '
+                  'always computed in double precision'
+    )
+
+    scenarios = Field(
+        required=False,
+        help_text='Batch predictions (JSON only): list of objects each defining a '
+                  'scenario by overriding the rupture and site parameters of this '
+                  'request (e.g. [{"dip": 30}, {"dip": 60, "vs30": 300}]). The '
+                  'returned table has the rows of all scenarios, and the additional '
+                  'input column "scenario_id" (the scenario position in the list)'
+    )
+
+    # MAP MODE:
+    grid_bbox = ArrayField(
+        FloatField(min_value=-180, max_value=180),
+        FloatField(min_value=-90, max_value=90),
+        FloatField(min_value=-180, max_value=180),
+        FloatField(min_value=-90, max_value=90),
+        required=False,
+        help_text='Map mode: the bounding box (min longitude, min latitude, max '
+                  'longitude, max latitude) of a regular grid of Sites, replacing '
+                  'the Sites along a line (distance and line-azimuth are ignored). '
+                  'The returned table has one row per magnitude and grid node, '
+                  'sorted by magnitude, latitude and longitude, with the node '
+                  'coordinates in the input columns station_longitude and '
+                  'station_latitude'
+    )
+    grid_resolution = FloatField(
+        initial=0.1,
+        help_text='Map mode only: the grid step, in degrees (see grid-bbox)'
+    )
+
     site_fieldnames: tuple[str, ...]  # populated after class init (see below)
 
     rupture_fieldnames: tuple[str, ...]  # populated after class init (see below)
@@ -227,6 +286,76 @@ class PredictionsForm(GsimImtForm, APIForm):
         except Exception as exc:  # noqa
             raise ValidationError(self.ErrMsg.invalid)
 
+    def clean_grid_resolution(self) -> float:
+        """Check that the grid resolution is positive"""
+        value = self.cleaned_data['grid_resolution']
+        if value <= 0:
+            raise ValidationError('value must be positive')
+        return value
+
+    def clean_scenarios(self) -> list[tuple[RuptureProperties, SiteProperties]]:
+        """
+        Clean the "scenarios" field by converting each given scenario into the
+        tuple (RuptureProperties, SiteProperties). Rupture and site parameters not
+        given in a scenario take the value of this form (see `ScenarioForm`)
+        """
+        value = self.cleaned_data['scenarios']
+        if not value:
+            return []
+        if not isinstance(value, list) or \
+                not all(isinstance(v, dict) for v in value):
+            raise ValidationError('expected a list of objects')
+        fieldnames = self.rupture_fieldnames + self.site_fieldnames
+        param2field = {p: f for f in fieldnames for p in self.param_names_of(f)}
+        data = {f: self.data[f] for f in fieldnames if f in self.data}
+        scenarios = []
+        for i, params in enumerate(value):
+            invalid = sorted(p for p in params if p not in param2field)
+            if not invalid:
+                form = ScenarioForm(
+                    data | {param2field[p]: v for p, v in params.items()}
+                )
+                if form.is_valid():
+                    scenarios.append(form.scenario_properties())
+                    continue
+                invalid = sorted(form.param_name_of(f) for f in form.errors)
+            raise ValidationError(
+                f'scenario {i}: invalid parameter(s) {", ".join(invalid)}'
+            )
+        return scenarios
+
+    def clean(self):
+        """
+        Perform a final validation checking the Sites definition: either distances
+        or a grid (map mode) of at most `settings.EGSIM_PREDICTIONS_MAX_GRID_SITES`
+        nodes in total (i.e., for all magnitudes)
+        """
+        cleaned_data = super().clean()
+        bbox, res = 'grid_bbox', 'grid_resolution'
+        if not cleaned_data.get(bbox):
+            if not self.has_error('distance') and not cleaned_data.get('distance'):
+                self.add_error('distance', self.ErrMsg.required)
+            return cleaned_data
+        if cleaned_data.get('scenarios'):
+            self.add_error(
+                'scenarios', f'not supported with {self.param_name_of(bbox)}'
+            )
+        if not self.has_error(res):
+            try:
+                lons, lats = grid_coordinates(cleaned_data[bbox], cleaned_data[res])
+            except ValueError:
+                self.add_error(bbox, self.ErrMsg.invalid)
+                return cleaned_data
+            max_sites = settings.EGSIM_PREDICTIONS_MAX_GRID_SITES
+            num_sites = len(lons) * len(lats) * len(cleaned_data.get('magnitude', []))
+            if num_sites > max_sites:
+                self.add_error(
+                    res, f'too many grid nodes ({num_sites} for all magnitudes, '
+                         f'max {max_sites}): increase the value or reduce '
+                         f'{self.param_name_of(bbox)} or the number of magnitudes'
+                )
+        return cleaned_data
+
     def output(self) -> pd.DataFrame:
         """
         Compute and return the output from the input data (`self.cleaned_data`).
@@ -234,6 +363,58 @@ class PredictionsForm(GsimImtForm, APIForm):
 
         :return: any Python object (e.g., a JSON-serializable dict)
         """
+        if self.cleaned_data['grid_bbox']:
+            return self._grid_output()
+        scenarios = self.cleaned_data['scenarios']
+        if scenarios:
+            return get_ground_motion_from_batch_scenarios(
+                **self._predictions_kwargs(), scenarios=scenarios
+            )
+        rup, site = self.scenario_properties()
+        return get_ground_motion_from_scenarios(
+            **self._predictions_kwargs(), rupture_properties=rup, site_properties=site
+        )
+
+    def output_chunks(self, max_records: int | None) -> Iterator[pd.DataFrame]:
+        """
+        Same as `self.output()` but return an iterator of DataFrames (chunks)
+        with at most `max_records` rows each (rows are grouped by magnitude, see
+        `iter_ground_motion_from_scenarios` for details). With batch scenarios or
+        in map mode, the output is a single chunk. Inputs are validated and any
+        error is raised before returning
+        """
+        if self.cleaned_data['scenarios'] or self.cleaned_data['grid_bbox']:
+            return iter([self.output()])
+        rup, site = self.scenario_properties()
+        return iter_ground_motion_from_scenarios(
+            **self._predictions_kwargs(), rupture_properties=rup, site_properties=site,
+            max_records=max_records
+        )
+
+    def _grid_output(self) -> pd.DataFrame:
+        """
+        Compute and return the predictions on the grid of Sites given in
+        `self.cleaned_data` (map mode, see `get_ground_motion_on_grid`)
+        """
+        cleaned_data = self.cleaned_data
+        kwargs = self._predictions_kwargs()
+        # remove arguments of line Sites only:
+        kwargs.pop('distances')
+        kwargs.pop('contexts_cache')
+        rup, site = self.scenario_properties()
+        return get_ground_motion_on_grid(
+            **kwargs,
+            bbox=tuple(cleaned_data['grid_bbox']),
+            resolution=cleaned_data['grid_resolution'],
+            rupture_properties=rup,
+            site_properties=site
+        )
+
+    def scenario_properties(self) -> tuple[RuptureProperties, SiteProperties]:
+        """
+        Return the tuple (RuptureProperties, SiteProperties) from
+        `self.cleaned_data`
+        """
         cleaned_data = self.cleaned_data
         rup = RuptureProperties(**{
             p: cleaned_data[p]
@@ -245,15 +426,25 @@ class PredictionsForm(GsimImtForm, APIForm):
             self.site_fieldnames
             if p in cleaned_data
         })
+        return rup, site
+
+    def _predictions_kwargs(self) -> dict:
+        """
+        Return the arguments for computing predictions from `self.cleaned_data`,
+        except the scenario(s) properties
+        """
+        cleaned_data = self.cleaned_data
         header_sep = None if cleaned_data.get('multi_header') else Clabel.sep
-        return get_ground_motion_from_scenarios(
-            cleaned_data['gsim'],
-            cleaned_data['imt'],
-            cleaned_data['magnitude'],
-            cleaned_data['distance'],
-            rupture_properties=rup,
-            site_properties=site,
-            header_sep=header_sep
+        return dict(
+            gsims=cleaned_data['gsim'],
+            imts=cleaned_data['imt'],
+            magnitudes=cleaned_data['magnitude'],
+            distances=cleaned_data['distance'],
+            header_sep=header_sep,
+            dtype=cleaned_data['dtype'],
+            contexts_cache=scenario_contexts,
+            workers=settings.EGSIM_PREDICTIONS_WORKERS,
+            use_threads=settings.EGSIM_PREDICTIONS_USE_THREADS
         )
 
 
@@ -264,3 +455,19 @@ PredictionsForm.rupture_fieldnames = tuple(sorted(
 PredictionsForm.site_fieldnames = tuple(sorted(
     set(SiteProperties.__annotations__) & set(PredictionsForm.base_fields)
 ))
+
+
+class ScenarioForm(PredictionsForm):
+    """
+    Form validating the rupture and site parameters of a single scenario of batch
+    predictions (see `PredictionsForm.scenarios`)
+    """
+
+    # remove all fields except rupture and site parameters:
+    gsim = latitude = longitude = regionalization = imt = None
+    magnitude = distance = multi_header = dtype = scenarios = None
+    grid_bbox = grid_resolution = None
+
+    def clean(self):
+        # skip the models and imts validation of the superclass:
+        return self.cleaned_data
@@ -0,0 +1,129 @@
+"""
+eGSIM management command to precompute the expected motions (and SA spectrum) of
+flatfiles
+"""
+
+import warnings
+from os.path import isfile, getmtime
+
+import pandas as pd
+from django.core.management import BaseCommand, CommandError
+
+from egsim.smtk.registry import (
+    Clabel,
+    SmtkError,
+    sa_period,
+    intensity_measures_defined_for
+)
+from egsim.smtk.residuals import (
+    SaSpectrum,
+    prepare_flatfile,
+    FlatfileContext,
+    get_expected_motions
+)
+from egsim.smtk.validation import (
+    harmonize_input_gsims,
+    harmonize_input_imts,
+    validate_imt_sa_limits
+)
+from egsim.smtk.flatfile import column_type, ColumnType
+from egsim.api import models
+
+
+class Command(BaseCommand):
+
+    help = """Precompute the expected motions (models mean and standard deviations) 
+    of the predefined flatfiles, for each model and intensity measure found in 
+    the flatfile columns, and the flatfile SA spectrum (for interpolating SA at
+    any period). The stored values are used when computing residuals, 
+    instead of evaluating the models (or the SA spectrum) on each request
+    """
+
+    def add_arguments(self, parser):
+        """
+        Implement here specific command options (this method is called
+        automatically by the superclass)
+
+        :param parser: :class:`argparse.ArgumentParser` instance
+        """
+        parser.add_argument(
+            '--flatfile', nargs='*', default=None,
+            help='the flatfile name(s). Default: all predefined flatfiles'
+        )
+        parser.add_argument(
+            '--model', nargs='*', default=None,
+            help='the model name(s). Default: all models'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command"""
+
+        flatfiles = models.Flatfile.objects.all()
+        if options.get('flatfile'):
+            flatfiles = flatfiles.filter(name__in=options['flatfile'])
+        gsim_names = options.get('model') or list(
+            models.Gsim.objects.values_list('name', flat=True)
+        )
+        if not flatfiles:
+            raise CommandError('No flatfile found')
+        for flatfile_db_obj in flatfiles:
+            self.stdout.write(f'Computing expected motions of {str(flatfile_db_obj)}')
+            flatfile = flatfile_db_obj.read_from_filepath()
+            self.write_sa_spectrum(flatfile, flatfile_db_obj.sa_spectrum_filepath)
+            filepath = flatfile_db_obj.expected_motions_filepath
+            # append to (and replace the models of) any file of a previous run,
+            # unless it is outdated (i.e., older than the flatfile):
+            mode = 'w'
+            if isfile(filepath) and getmtime(filepath) >= getmtime(
+                    flatfile_db_obj.filepath):
+                mode = 'a'
+            ok = 0
+            with pd.HDFStore(filepath, mode=mode) as store:
+                for name in gsim_names:
+                    ok += self.write_expected_motions(store, flatfile, name)
+            self.stdout.write(self.style.SUCCESS(
+                f'Models saved: {ok}, discarded: {len(gsim_names) - ok} '
+                f'(file: {filepath})'
+            ))
+
+    def write_sa_spectrum(self, flatfile: pd.DataFrame, filepath: str) -> bool:
+        """Write the SA spectrum of the given flatfile to the given HDF file"""
+
+        try:
+            sa_spectrum = SaSpectrum.from_flatfile(flatfile)
+        except SmtkError as exc:
+            self.stdout.write(f"  Discarding SA spectrum: {str(exc)}")
+            return False
+        sa_spectrum.to_dataframe().to_hdf(filepath, key='sa_spectrum', mode='w')
+        self.stdout.write(f'  SA spectrum saved (file: {filepath})')
+        return True
+
+    def write_expected_motions(
+        self, store: pd.HDFStore, flatfile: pd.DataFrame, name: str
+    ) -> bool:
+        """Write the expected motions of the given model to the HDF store"""
+
+        prefix = 'Discarding'
+        try:
+            gsims = harmonize_input_gsims([name])
+            model_imts = intensity_measures_defined_for(gsims[name])
+            imts = [
+                c for c in flatfile.columns
+                if column_type(c) == ColumnType.intensity
+                and (c if sa_period(c) is None else 'SA') in model_imts
+            ]
+            imts = validate_imt_sa_limits(gsims[name], harmonize_input_imts(imts))
+            if not imts:
+                self.stdout.write(f"  {prefix} {name}. No intensity measure defined")
+                return False
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                flatfile_r = prepare_flatfile(flatfile, gsims, imts)
+                context = FlatfileContext(flatfile_r)
+                expected = get_expected_motions(gsims, imts, context)
+        except SmtkError as exc:
+            self.stdout.write(f"  {prefix} {name}: {str(exc)}")
+            return False
+        expected.columns = [Clabel.sep.join(c[:2]) for c in expected.columns]
+        store.put(name, expected.sort_index())
+        return True
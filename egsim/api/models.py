@@ -1,6 +1,7 @@
 """DB Models for the web API and Django APP"""
 
 from __future__ import annotations
+from collections.abc import Iterable
 from typing import Any, Self
 
 from django.db.models import (
@@ -145,6 +146,71 @@ class Flatfile(MediaFile, Reference):
         from pandas import read_hdf
         return read_hdf(self.filepath, **kwargs)
 
+    @property
+    def expected_motions_filepath(self) -> str:
+        """
+        Return the path of the HDF file with the precomputed expected motions of
+        this flatfile (see command `egsim-expected-motions`). The file stores, for
+        each model, a table of all flatfile records (rows) and
+        columns "<imt> <label>" (e.g. "PGA mean"). The file might not exist
+        """
+        from os.path import splitext
+        return splitext(self.filepath)[0] + '.expected_motions.hdf'
+
+    @property
+    def sa_spectrum_filepath(self) -> str:
+        """
+        Return the path of the HDF file with the precomputed SA spectrum of this
+        flatfile (see command `egsim-expected-motions`). The file might not exist
+        """
+        from os.path import splitext
+        return splitext(self.filepath)[0] + '.sa_spectrum.hdf'
+
+    def read_sa_spectrum(self) -> Any:
+        """
+        Return the precomputed SA spectrum of this flatfile as
+        `egsim.smtk.residuals.SaSpectrum` object, or None if not precomputed
+        """
+        from os.path import isfile, getmtime
+        from pandas import read_hdf
+        from egsim.smtk.residuals import SaSpectrum
+
+        filepath = self.sa_spectrum_filepath
+        # return None also if the flatfile has been modified after the computation:
+        if not isfile(filepath) or getmtime(filepath) < getmtime(self.filepath):
+            return None
+        return SaSpectrum.from_dataframe(read_hdf(filepath))
+
+    def read_expected_motions(self, models: Iterable[str]) -> Any:
+        """
+        Return the precomputed expected motions of the given models as pandas
+        DataFrame with columns (imt, label, model) (see
+        `egsim.smtk.residuals.get_expected_motions`), or None if no model has been
+        precomputed
+        """
+        from os.path import isfile, getmtime
+        from pandas import HDFStore, concat, MultiIndex
+        from egsim.smtk.registry import Clabel
+
+        filepath = self.expected_motions_filepath
+        # return None also if the flatfile has been modified after the computation:
+        if not isfile(filepath) or getmtime(filepath) < getmtime(self.filepath):
+            return None
+        frames = []
+        with HDFStore(filepath, mode='r') as store:
+            keys = set(store.keys())
+            for model in models:
+                if f'/{model}' not in keys:
+                    continue
+                dfr = store.get(model)
+                dfr.columns = MultiIndex.from_tuples(
+                    tuple(c.split(Clabel.sep)) + (model,) for c in dfr.columns
+                )
+                frames.append(dfr)
+        if not frames:
+            return None
+        return concat(frames, axis=1)
+
 
 class Regionalization(MediaFile, Reference):
     """
@@ -1,20 +1,24 @@
 """Module with the views for the web API (no GUI)"""
 
 from __future__ import annotations
-from collections.abc import Callable, Iterable
+from collections.abc import Callable, Iterable, Iterator
 from datetime import date, datetime
+import os
 import re
-from io import StringIO, BytesIO
+import tempfile
+from io import StringIO, BytesIO, FileIO
 from typing import Type, IO, Any
 from urllib.parse import quote as urlquote
 
 import yaml
 import pandas as pd
+from django.conf import settings
 from django.http import (
     JsonResponse,
     HttpRequest,
     QueryDict,
     FileResponse,
+    StreamingHttpResponse,
     HttpResponseBase
 )
 from django.http.response import HttpResponse
@@ -327,13 +331,52 @@ class SmtkView(APIFormView):
         content.seek(0)  # for safety
         return FileResponse(content, content_type=MimeType.hdf, status=200)
 
+    @staticmethod
+    def response_csv_chunks(chunks: Iterator[pd.DataFrame]) -> StreamingHttpResponse:
+        """
+        Return CSV-data response streaming the given DataFrames (chunks). Note:
+        errors raised while computing chunks other than the first one can not be
+        returned as error response (the response has already started): in this
+        case, the CSV data is truncated and ends with a line with the error message
+        (see `write_dfs_to_csv_chunks`)
+        """
+        # compute the first chunk now, so that any error is raised here:
+        first_chunk = next(chunks)
+        return StreamingHttpResponse(
+            write_dfs_to_csv_chunks(first_chunk, chunks),
+            content_type=MimeType.csv,
+            status=200
+        )
+
+    @staticmethod
+    def response_hdf_chunks(chunks: Iterator[pd.DataFrame]) -> FileResponse:
+        """
+        Return HDF-data response from the given DataFrames (chunks), written one
+        after the other to a temporary HDF file which is deleted after the response
+        is sent (HDF can not be streamed, but the chunks are never all in memory)
+        """
+        content = write_dfs_to_hdf_file({'egsim': chunks})
+        return FileResponse(content, content_type=MimeType.hdf, status=200)
+
 
 class PredictionsView(SmtkView):
-    """SmtkView subclass for predictions computation"""
+    """
+    SmtkView subclass for predictions computation. CSV and HDF responses are built
+    from predictions computed in chunks of at most
+    `settings.EGSIM_PREDICTIONS_CHUNK_SIZE` records, so that the contexts and
+    values of all scenarios are never stored in memory (CSV chunks are streamed,
+    HDF chunks written to a temporary file)
+    """
 
     formclass = PredictionsForm
 
     responses = SmtkView.responses | {
+        'hdf': lambda form: SmtkView.response_hdf_chunks(
+            form.output_chunks(settings.EGSIM_PREDICTIONS_CHUNK_SIZE)
+        ),
+        'csv': lambda form: SmtkView.response_csv_chunks(
+            form.output_chunks(settings.EGSIM_PREDICTIONS_CHUNK_SIZE)
+        ),
         'json': lambda form: JsonResponse(
             dataframe2dict(form.output(), as_json=True, drop_empty_levels=True),
             status=200
@@ -342,11 +385,22 @@ class PredictionsView(SmtkView):
 
 
 class ResidualsView(SmtkView):
-    """SmtkView subclass for residuals computation"""
+    """
+    SmtkView subclass for residuals computation. CSV and HDF responses are built
+    from residuals computed in chunks of at most `settings.EGSIM_RESIDUALS_CHUNK_SIZE`
+    records, so that the whole residuals table is never stored in memory (CSV
+    chunks are streamed, HDF chunks written to a temporary file)
+    """
 
     formclass = ResidualsForm
 
     responses = SmtkView.responses | {
+        'hdf': lambda form: SmtkView.response_hdf_chunks(
+            form.output_chunks(settings.EGSIM_RESIDUALS_CHUNK_SIZE)
+        ),
+        'csv': lambda form: SmtkView.response_csv_chunks(
+            form.output_chunks(settings.EGSIM_RESIDUALS_CHUNK_SIZE)
+        ),
         'json': lambda form: JsonResponse(
             dataframe2dict(
                 form.output(),
@@ -382,6 +436,46 @@ def write_df_to_hdf_stream(frames: dict[str, pd.DataFrame], **kwargs) -> BytesIO
         return BytesIO(out._handle.get_file_image())  # noqa
 
 
+def write_dfs_to_hdf_file(
+    frames: dict[str, Iterable[pd.DataFrame]],
+    **kwargs
+) -> FileIO:
+    """
+    Write iterables of pandas DataFrames (chunks) to a temporary HDF file. The
+    chunks of each `frames` value must have the same columns and are appended one
+    after the other under the same key. Return the file opened in read mode: the
+    file will be deleted when closed
+
+    :param kwargs: additional arguments to be passed to pandas `HDFStore`
+    """
+    if any(k == 'table' for k in frames.keys()):
+        raise ValueError('Key "table" invalid (https://stackoverflow.com/a/70467886)')
+    fd, path = tempfile.mkstemp(suffix='.hdf')
+    os.close(fd)
+    try:
+        with pd.HDFStore(path, mode="w", **kwargs) as out:
+            for key, dfrs in frames.items():
+                for dfr in dfrs:
+                    out.append(key, dfr, format='table')
+        return _TemporaryFile(path)
+    except Exception:
+        os.remove(path)
+        raise
+
+
+class _TemporaryFile(FileIO):
+    """File opened in read mode and deleted when closed"""
+
+    def __init__(self, path: str):
+        super().__init__(path, 'rb')
+
+    def close(self):
+        closed = self.closed
+        super().close()
+        if not closed:
+            os.remove(self.name)
+
+
 def read_df_from_hdf_stream(stream: bytes | IO, **kwargs) -> pd.DataFrame:
     """
     Read pandas DataFrame from an HDF BytesIO or bytes sequence
@@ -409,6 +503,33 @@ def write_df_to_csv_stream(data: pd.DataFrame, **csv_kwargs) -> BytesIO:
     return content
 
 
+def write_dfs_to_csv_chunks(
+    *frames: pd.DataFrame | Iterable[pd.DataFrame], **csv_kwargs
+) -> Iterator[bytes]:
+    """
+    Write the given pandas DataFrame(s) or iterables of DataFrames (chunks) with the
+    same columns as CSV, yielding the CSV bytes of each DataFrame. The header is
+    written with the first DataFrame only. Exceptions raised while iterating over
+    the chunks are not re-raised (the bytes yielded so far might have already been
+    sent in a streaming response): the last bytes yielded are then a CSV line with
+    the error message, which notifies that the data is incomplete
+    """
+    header = csv_kwargs.pop('header', True)
+    try:
+        for dfrs in frames:
+            for dfr in ([dfrs] if isinstance(dfrs, pd.DataFrame) else dfrs):
+                yield write_df_to_csv_stream(
+                    dfr, header=header, **csv_kwargs
+                ).getvalue()
+                header = False
+    except Exception as exc:
+        yield (
+            f'"Server error ({exc.__class__.__name__}): '
+            f'{str(exc).strip().replace(chr(34), chr(39))}. '
+            f'The data above is incomplete"\n'
+        ).encode('utf8')
+
+
 def read_df_from_csv_stream(stream: bytes | IO, **kwargs) -> pd.DataFrame:
     """
     Read pandas DataFrame from a CSV BytesIO or bytes sequence
@@ -250,6 +250,9 @@ class ResidualsVisualizeForm(ResidualsForm):
                   'parameter likelihood (True: LH values, else: residuals Z values)'
     )
 
+    # the flatfile columns are needed in `clean`:
+    read_predefined_flatfile_in_clean = True
+
     def clean(self):
         cleaned_data = super().clean()
         if (
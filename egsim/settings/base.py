@@ -160,3 +160,54 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 0  # for ref, 2621440 (2Mb) is the default in Djan
 # The maximum size in bytes (EXCLUDING THE FILE UPLOAD SIZE) that a request body may be
 # before a SuspiciousOperation (RequestDataTooBig) is raised:
 DATA_UPLOAD_MAX_MEMORY_SIZE: 5242880  # 5Mb (2621440 = 2Mb is the default in Django 5.1)
+
+# ==============================================================================
+# eGSIM custom settings
+# ==============================================================================
+
+# The number of processes used to compute the models predictions in parallel when
+# computing residuals (see `egsim.smtk.residuals.get_residuals`, argument `workers`).
+# None or 1 (the default): compute all models sequentially in the request process.
+# Note that a new pool of processes is started at each request, so parallelism is
+# worth only for requests long enough to pay off the pool startup cost
+EGSIM_RESIDUALS_WORKERS: int | None = None
+
+# The number of threads or processes used to compute the models predictions in
+# parallel when computing predictions from scenarios (see
+# `egsim.smtk.scenarios.get_ground_motion_from_scenarios`, argument `workers`).
+# None or 1 (the default): compute all models sequentially in the request process
+EGSIM_PREDICTIONS_WORKERS: int | None = None
+
+# Whether to compute the models predictions from scenarios in parallel using threads
+# (True, the default) or processes (False). Ignored if EGSIM_PREDICTIONS_WORKERS is
+# None or 1. Each thread computes a model on its own copy of the scenarios contexts,
+# a new pool of processes is started at each request (see EGSIM_RESIDUALS_WORKERS)
+EGSIM_PREDICTIONS_USE_THREADS: bool = True
+
+# The maximum number of records (rows) per chunk when computing residuals as CSV or HDF
+# (records are grouped by whole events, see `egsim.smtk.residuals.iter_residuals`).
+# None (the default): compute all records at once, as a single chunk
+EGSIM_RESIDUALS_CHUNK_SIZE: int | None = None
+
+# The maximum number of records (rows) per chunk when computing predictions as CSV or
+# HDF (records are grouped by magnitude, see
+# `egsim.smtk.scenarios.iter_ground_motion_from_scenarios`). None (the default):
+# compute all records at once, as a single chunk
+EGSIM_PREDICTIONS_CHUNK_SIZE: int | None = None
+
+# The maximum number of grid nodes (Sites) when computing predictions on a geographic
+# grid (map mode, see `egsim.smtk.scenarios.get_ground_motion_on_grid`), summed over
+# all requested magnitudes (i.e., the number of output rows). Requests with more
+# nodes are rejected
+EGSIM_PREDICTIONS_MAX_GRID_SITES: int = 250000
+
+# The maximum memory size (in bytes) of the predefined flatfiles prepared for residuals
+# computation and cached in each process (see `egsim.api.forms.residuals`). When
+# exceeded, the least recently used flatfiles are removed. 0: disable the cache
+EGSIM_PREPARED_FLATFILES_CACHE_SIZE: int = 512 * 1024 * 1024  # 512 Mb
+
+# The maximum memory size (in bytes) of the scenario context objects (ruptures and
+# sites) cached in each process for predictions computation (see
+# `egsim.api.forms.scenarios`). When exceeded, the least recently used contexts are
+# removed. 0: disable the cache
+EGSIM_SCENARIO_CONTEXTS_CACHE_SIZE: int = 64 * 1024 * 1024  # 64 Mb
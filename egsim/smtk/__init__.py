@@ -1,11 +1,16 @@
 """Root module for the strong motion modeler toolkit (smtk) sub-package of eGSIM"""
 
 from .scenarios import (
-    get_ground_motion_from_scenarios, RuptureProperties, SiteProperties
+    get_ground_motion_from_scenarios,
+    iter_ground_motion_from_scenarios,
+    get_ground_motion_from_batch_scenarios,
+    get_ground_motion_on_grid,
+    RuptureProperties,
+    SiteProperties
 )
 from .flatfile import read_flatfile
-from .residuals import get_residuals
-from .ranking import get_measures_of_fit
+from .residuals import get_residuals, iter_residuals, add_residuals
+from .ranking import get_measures_of_fit, get_measures_of_fit_from_chunks
 
 from .registry import (
     gsim_names,
@@ -0,0 +1,108 @@
+"""In-process caches of computed data"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+class LRUCache:
+    """
+    Least Recently Used (LRU) cache with a memory size bound: when the total size
+    of the stored values exceeds `max_size` (in bytes), the least recently used
+    values are removed (evicted). Cached values should be treated as read-only.
+    This class is thread-safe and keeps track of hits, misses and evictions (see
+    `self.stats`) for monitoring the cache effectiveness
+    """
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] | None = None):
+        """
+        Initialize a new LRUCache
+
+        :param max_size: the maximum size of the cached values, in bytes. Values
+            bigger than `max_size` are not stored. Non-positive values disable the
+            cache (no value stored)
+        :param sizeof: function returning the size in bytes of a cached value.
+            None (the default) will use `nbytes` defined in this module
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof or nbytes
+        self._data: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None) -> Any:
+        """
+        Return the value mapped to the given key, or `default` if the key is not
+        found. A found key is marked as the most recently used
+        """
+        with self._lock:
+            item = self._data.get(key, None)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """
+        Store the given value mapped to `key`, evicting the least recently used
+        values if needed. Return True if the value has been stored, False otherwise
+        (i.e., the value size is greater than `self.max_size`)
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[1]
+            if self.max_size <= 0 or size > self.max_size:
+                return False
+            while self._data and self.size + size > self.max_size:
+                self.size -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+            self._data[key] = (value, size)
+            self.size += size
+            return True
+
+    def clear(self):
+        """Clear this cache, removing all stored values and resetting the stats"""
+        with self._lock:
+            self._data.clear()
+            self.size = self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Return the stats of this cache as dict"""
+        return {
+            'items': len(self),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+def nbytes(value: Any) -> int:
+    """
+    Return the size in bytes of the given value, or of all values if `value` is a
+    tuple or list. pandas objects, numpy arrays and any object with an `nbytes`
+    attribute are supported, any other object has size 0
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    return int(getattr(value, 'nbytes', 0))
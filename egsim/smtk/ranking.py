@@ -2,15 +2,20 @@
 Collection of function to extract fit measures from residuals for model ranking
 """
 
-from collections.abc import Iterable
-from math import ceil
+from __future__ import annotations  # https://peps.python.org/pep-0563/
+
+import warnings
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, sqrt, pi
 
 import numpy as np
 import pandas as pd
-from scipy.stats import norm
+from scipy.special import ndtr
 
 from .flatfile import ColumnType
 from .registry import Clabel
+from .residuals import get_event_id_column_names
 
 
 def get_measures_of_fit(
@@ -18,8 +23,8 @@ def get_measures_of_fit(
     imts: Iterable[str],
     residuals: pd.DataFrame,
     as_dataframe=True,
-    edr_bandwidth=0.01,
-    edr_multiplier=3.0
+    edr_bandwidth: float | Sequence[float] = 0.01,
+    edr_multiplier: float | Sequence[float] = 3.0
 ) -> pd.DataFrame | dict:
     """
     Retrieve several Measures of fit from the given residuals, models and imts
@@ -32,13 +37,76 @@ def get_measures_of_fit(
         the default), or dict
     :param edr_bandwidth: bandwidth to use in EDR values computation (default 0.01)
     :param edr_multiplier: multiplier to use in EDR values computation (default 3.0)
+        If this parameter or `edr_bandwidth` is a sequence of values, the EDR
+        measures are computed for each (bandwidth, multiplier) pair (see
+        `get_residuals_edr_sweep`)
 
     :return: a Pandas dataframe (columns: measures of fit, rows: model names) or
         dict[str, dict[str, float]] (measures of fit names mapped to a dict where model
         names are mapped to their measure of fit value
     """
-    # legacy code: if the dataframe is not a multiindex, create it, assuming
-    # Clabel.sep is the separator:
+    residuals = _with_multiindex_columns(residuals)
+    gsims, imts = list(gsims), list(imts)
+    # read all needed residuals columns once:
+    values, positions = _get_values(residuals, _all_columns(gsims, imts))
+    result = _get_measures_of_fit(
+        gsims, imts, values, positions, edr_bandwidth, edr_multiplier
+    )
+    if as_dataframe:
+        return pd.DataFrame(result, dtype=float)
+    return result
+
+
+def _get_measures_of_fit(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int],
+    edr_bandwidth: float | Sequence[float],
+    edr_multiplier: float | Sequence[float]
+) -> dict[str, dict[str, float]]:
+    """
+    Same as `get_measures_of_fit` with the residuals given as 2D array of
+    values and columns positions (see `_get_values`). Return a dict
+    """
+    if np.ndim(edr_bandwidth) or np.ndim(edr_multiplier):
+        edr_values = _get_residuals_edr_sweep(
+            gsims, imts, values, positions, np.atleast_1d(edr_bandwidth),
+            np.atleast_1d(edr_multiplier)
+        )
+    else:
+        edr_values = _get_residuals_edr_values(
+            gsims, imts, values, positions, edr_bandwidth, edr_multiplier
+        )
+    return _collect_measures(gsims, [
+        _get_residuals_stats(gsims, imts, values, positions),
+        _get_residuals_likelihood_stats(gsims, imts, values, positions),
+        _get_residuals_loglikelihood(gsims, imts, values, positions),
+        edr_values,
+    ])
+
+
+def _collect_measures(
+    gsims: list[str], measures: Iterable[dict[str, dict[str, float]]]
+) -> dict[str, dict[str, float]]:
+    """
+    Collect all given measures of fit (dicts of measure names mapped to a dict of
+    model names and values) in a single dict, with all models in each measure
+    """
+    result = {}
+    for res in measures:
+        for fit_measure, models in res.items():
+            result[fit_measure] = {}
+            for gsim in gsims:
+                result[fit_measure][gsim] = models.get(gsim, None)
+    return result
+
+
+def _with_multiindex_columns(residuals: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return `residuals` if its columns are a MultiIndex, or a copy of it with
+    multiindex columns, assuming Clabel.sep is the separator (legacy code)
+    """
     if not isinstance(residuals.columns, pd.MultiIndex):
         cols = [tuple(c.split(Clabel.sep)) for c in residuals.columns]
         if all(len(c) == 3 for c in cols):
@@ -49,22 +117,69 @@ def get_measures_of_fit(
                 'The passed DataFrame does not seem to be issued '
                 'from residuals computation'
             )
+    return residuals
 
-    result = {}
-    for res in [
-        get_residuals_stats(gsims, imts, residuals),
-        get_residuals_likelihood_stats(gsims, imts, residuals),
-        get_residuals_loglikelihood(gsims, imts, residuals),
-        get_residuals_edr_values(gsims, imts, residuals, edr_bandwidth, edr_multiplier),
-    ]:
-        for fit_measure, models in res.items():
-            result[fit_measure] = {}
-            for gsim in gsims:
-                result[fit_measure][gsim] = models.get(gsim, None)
 
-    if as_dataframe:
-        return pd.DataFrame(result, dtype=float)
-    return result
+def _get_values(
+    residuals: pd.DataFrame, columns: Iterable[tuple[str, str, str]]
+) -> tuple[np.ndarray, dict[tuple[str, str, str], int]]:
+    """
+    Return the values of the given residuals columns as 2D numpy array of floats
+    (one column per residuals column found), and the dict mapping each found
+    column to its position in the array. Columns not found in `residuals` are
+    skipped
+    """
+    found = [c for c in dict.fromkeys(columns) if c in residuals.columns]
+    if not found:
+        return np.empty((len(residuals), 0)), {}
+    return residuals[found].to_numpy(dtype=float), {c: i for i, c in enumerate(found)}
+
+
+def _get_columns(
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int],
+    columns: list[tuple[str, str, str]]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the 2D array of the given columns (as returned from `_get_values`)
+    and the 1D boolean array denoting the given columns found in `positions`.
+    The returned array has only the found columns
+    """
+    found = np.array([c in positions for c in columns], dtype=bool)
+    return values[:, [positions[c] for c in columns if c in positions]], found
+
+
+def _all_columns(gsims: list[str], imts: list[str]) -> list[tuple[str, str, str]]:
+    """Return all residuals columns needed to compute the measures of fit"""
+    return (
+        _stats_columns(gsims, imts) + _likelihood_columns(gsims, imts) +
+        _edr_columns(gsims, imts)
+    )
+
+
+def _stats_columns(gsims: list[str], imts: list[str]) -> list[tuple[str, str, str]]:
+    return [
+        (imt, res_type, gsim) for gsim in gsims for imt in imts
+        for res_type in (Clabel.total_res, Clabel.inter_ev_res, Clabel.intra_ev_res)
+    ]
+
+
+def _likelihood_columns(
+    gsims: list[str], imts: list[str]
+) -> list[tuple[str, str, str]]:
+    return [
+        (imt, lh_type, gsim) for gsim in gsims for imt in imts
+        for lh_type in (Clabel.total_lh, Clabel.inter_ev_lh, Clabel.intra_ev_lh)
+    ]
+
+
+def _edr_columns(gsims: list[str], imts: list[str]) -> list[tuple[str, str, str]]:
+    return [
+        (Clabel.input, ColumnType.intensity.value, imt) for imt in imts
+    ] + [
+        (imt, label, gsim) for gsim in gsims for imt in imts
+        for label in (Clabel.total_res, Clabel.mean)
+    ]
 
 
 def get_residuals_stats(
@@ -78,22 +193,63 @@ def get_residuals_stats(
     :param residuals: the result of :ref:`get_residuals` where the residuals of the
         given model(s) and imt(s) are computed
     """
+    gsims, imts = list(gsims), list(imts)
+    return _get_residuals_stats(
+        gsims, imts, *_get_values(residuals, _stats_columns(gsims, imts))
+    )
+
+
+def _get_residuals_stats(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int]
+) -> dict[str, dict[str, float]]:
+    columns = _stats_columns(gsims, imts)
+    means = np.full(len(columns), np.nan)
+    stds = np.full(len(columns), np.nan)
+    col_values, found = _get_columns(values, positions, columns)
+    if found.any():
+        means[found], stds[found] = _mean_std(*_get_moments(col_values))
+    return _format_stats(columns, means, stds)
+
+
+def _get_moments(
+    values: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return the moments of each column of `values` (2D array) skipping NaNs, as
+    tuple of 1D arrays: (count, sum, sum of squared deviations from the mean,
+    whether the column has finite values)
+    """
+    nans = np.isnan(values)
+    count = (~nans).sum(axis=0)
+    total = np.where(nans, 0., values).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sq_dev = np.where(nans, 0., values - total / count) ** 2
+    return count, total, sq_dev.sum(axis=0), np.isfinite(values).any(axis=0)
+
+
+def _mean_std(
+    count: np.ndarray, total: np.ndarray, m2: np.ndarray, has_finite: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return mean and standard deviation (ddof=0) from the given moments (see
+    `_get_moments`). Columns with no finite value have NaN mean and std
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        std = np.sqrt(m2 / count)
+    return np.where(has_finite, mean, np.nan), np.where(has_finite, std, np.nan)
+
+
+def _format_stats(
+    columns: list[tuple[str, str, str]], means: np.ndarray, stds: np.ndarray
+) -> dict[str, dict[str, float]]:
     result = {}
-    for gsim in gsims:
-        for imt in imts:
-            for res_type in (
-                    Clabel.total_res, Clabel.inter_ev_res, Clabel.intra_ev_res
-            ):
-                mean, std = np.nan, np.nan
-                col = (imt, res_type, gsim)
-                values = residuals.get(col)
-                if values is not None:
-                    values = values[np.isfinite(values)]
-                    if len(values):
-                        mean = residuals[col].mean()
-                        std = residuals[col].std(ddof=0)
-                result.setdefault(f"{imt} {res_type} mean", {})[gsim] = mean
-                result.setdefault(f"{imt} {res_type} stddev", {})[gsim] = std
+    for (imt, res_type, gsim), mean, std in zip(columns, means, stds):
+        result.setdefault(f"{imt} {res_type} mean", {})[gsim] = mean
+        result.setdefault(f"{imt} {res_type} stddev", {})[gsim] = std
 
     return result
 
@@ -110,17 +266,36 @@ def get_residuals_likelihood_stats(
     :param residuals: the result of :ref:`get_residuals` where the likelihood values
         of the given model(s) and imt(s) are computed
     """
+    gsims, imts = list(gsims), list(imts)
+    return _get_residuals_likelihood_stats(
+        gsims, imts, *_get_values(residuals, _likelihood_columns(gsims, imts))
+    )
+
+
+def _get_residuals_likelihood_stats(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int]
+) -> dict[str, dict[str, float]]:
+    columns = _likelihood_columns(gsims, imts)
+    medians = np.full(len(columns), np.nan)
+    iqrs = np.full(len(columns), np.nan)
+    col_values, found = _get_columns(values, positions, columns)
+    if found.any():
+        p25, median, p75 = np.nanpercentile(col_values, [25, 50, 75], axis=0)
+        medians[found] = median
+        iqrs[found] = p75 - p25
+    return _format_likelihood_stats(columns, medians, iqrs)
+
+
+def _format_likelihood_stats(
+    columns: list[tuple[str, str, str]], medians: np.ndarray, iqrs: np.ndarray
+) -> dict[str, dict[str, float]]:
     result = {}
-    for gsim in gsims:
-        for imt in imts:
-            for lh_type in (Clabel.total_lh, Clabel.inter_ev_lh, Clabel.intra_ev_lh):
-                median, iqr = np.nan, np.nan
-                col = (imt, lh_type, gsim)
-                if residuals.get(col) is not None:
-                    p25, median, p75 = np.nanpercentile(residuals[col], [25, 50, 75])
-                    iqr = p75 - p25
-                result.setdefault(f"{imt} {lh_type} median", {})[gsim] = median
-                result.setdefault(f"{imt} {lh_type} iqr", {})[gsim] = iqr
+    for (imt, lh_type, gsim), median, iqr in zip(columns, medians, iqrs):
+        result.setdefault(f"{imt} {lh_type} median", {})[gsim] = median
+        result.setdefault(f"{imt} {lh_type} iqr", {})[gsim] = iqr
 
     return result
 
@@ -140,26 +315,59 @@ def get_residuals_loglikelihood(
     :param residuals: the result of :ref:`get_residuals` where the residuals of the
         given model(s) and imt(s) are computed
     """
+    gsims, imts = list(gsims), list(imts)
+    return _get_residuals_loglikelihood(
+        gsims, imts, *_get_values(residuals, _loglikelihood_columns(gsims, imts))
+    )
+
+
+def _get_residuals_loglikelihood(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int]
+) -> dict[str, dict[str, float]]:
+    columns = _loglikelihood_columns(gsims, imts)
+    # sum and count of the finite log-likelihoods of each column (0 if not found):
+    sums = np.zeros(len(columns))
+    counts = np.zeros(len(columns), dtype=int)
+    col_values, found = _get_columns(values, positions, columns)
+    if found.any():
+        sums[found], counts[found] = _get_loglikelihood_sums(col_values)
+    return _format_loglikelihood(gsims, imts, sums, counts)
+
+
+def _loglikelihood_columns(
+    gsims: list[str], imts: list[str]
+) -> list[tuple[str, str, str]]:
+    return [(imt, Clabel.total_res, gsim) for gsim in gsims for imt in imts]
+
+
+def _get_loglikelihood_sums(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the sum and the number of the finite log-likelihoods of each column
+    of `values` (2D array of total residuals)
+    """
+    # log2 of the standard normal PDF (same as `norm.pdf(values, 0., 1.0)`,
+    # but without the scipy overhead):
+    asll = np.log2(np.exp(-values ** 2 / 2.0) / sqrt(2 * pi))
+    finite = np.isfinite(asll)
+    return np.where(finite, asll, 0.).sum(axis=0), finite.sum(axis=0)
+
+
+def _format_loglikelihood(
+    gsims: list[str], imts: list[str], sums: np.ndarray, counts: np.ndarray
+) -> dict[str, dict[str, float]]:
+    sums = sums.reshape(len(gsims), len(imts))
+    counts = counts.reshape(len(gsims), len(imts))
+
     result = {}
-    imts = list(imts)
-    for gsim in gsims:
-        aslls = []
-        for imt in imts:
-            col = (imt, Clabel.total_res, gsim)
-            values = residuals.get(col, [])
-            asll = np.log2(norm.pdf(values, 0., 1.0))
-            llh = np.nan
-            finite = np.isfinite(asll)
-            if finite.any():
-                # concatenate all model assl(s) (see end of loop):
-                aslls = np.hstack([aslls, asll])
-                llh = -(1.0 / len(asll[finite])) * np.sum(asll[finite])
+    for gsim, g_sums, g_counts in zip(gsims, sums, counts):
+        for imt, llh_sum, count in zip(imts, g_sums, g_counts):
+            llh = -(1.0 / count) * llh_sum if count else np.nan
             result.setdefault(f'{imt} loglikelihood', {})[gsim] = llh
-
-        all_llh = np.nan
-        finite = np.isfinite(aslls)
-        if finite.any():
-            all_llh = -(1.0 / len(aslls[finite])) * np.sum(aslls[finite])
+        count = g_counts.sum()
+        all_llh = -(1.0 / count) * g_sums.sum() if count else np.nan
         result.setdefault('All_IMT loglikelihood', {})[gsim] = all_llh
 
     return result
@@ -188,9 +396,24 @@ def get_residuals_edr_values(
     :param float multiplier: "Multiplier of standard deviation (equation 8 of Kale
         and Akkar)
     """
+    gsims, imts = list(gsims), list(imts)
+    return _get_residuals_edr_values(
+        gsims, imts, *_get_values(residuals, _edr_columns(gsims, imts)),
+        bandwidth, multiplier
+    )
+
+
+def _get_residuals_edr_values(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int],
+    bandwidth: float,
+    multiplier: float
+) -> dict[str, dict[str, float]]:
     result = {}
     for gsim in gsims:
-        obs, expected, stddev = _get_edr_gsim_information(gsim, imts, residuals)
+        obs, expected, stddev = _get_edr_inputs(gsim, imts, values, positions)
         results = get_edr(obs, expected, stddev, bandwidth, multiplier)
         result.setdefault("mde_norm", {})[gsim] = float(results[0])
         result.setdefault("sqrt_kappa", {})[gsim] = float(results[1])
@@ -198,6 +421,64 @@ def get_residuals_edr_values(
     return result
 
 
+def get_residuals_edr_sweep(
+    gsims: Iterable[str],
+    imts: Iterable[str],
+    residuals: pd.DataFrame,
+    bandwidths: Sequence[float],
+    multipliers: Sequence[float]
+) -> dict[str, dict[str, float]]:
+    """
+    Same as `get_residuals_edr_values` but computes the EDR values for each
+    (bandwidth, multiplier) pair of the given values. The EDR inputs and kappa
+    are computed once per model, and all multipliers of a bandwidth share the
+    same distance bins (see `get_edr_sweep`). The returned measure names are
+    suffixed with the EDR parameters (see `edr_sweep_measure_name`)
+
+    :param gsims: the ground motion models (iterable of str)
+    :param imts: the intensity measure types (iterable of str)
+    :param residuals: a pandas DataFrame resulting from :ref:`get_residuals`
+    :param bandwidths: the discretisation widths
+    :param multipliers: the multipliers of standard deviation (equation 8 of Kale
+        and Akkar)
+    """
+    gsims, imts = list(gsims), list(imts)
+    return _get_residuals_edr_sweep(
+        gsims, imts, *_get_values(residuals, _edr_columns(gsims, imts)),
+        bandwidths, multipliers
+    )
+
+
+def _get_residuals_edr_sweep(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int],
+    bandwidths: Sequence[float],
+    multipliers: Sequence[float]
+) -> dict[str, dict[str, float]]:
+    result = {}
+    for gsim in gsims:
+        obs, expected, stddev = _get_edr_inputs(gsim, imts, values, positions)
+        results = get_edr_sweep(obs, expected, stddev, bandwidths, multipliers)
+        for i, bandwidth in enumerate(bandwidths):
+            for j, multiplier in enumerate(multipliers):
+                for name, value in zip(("mde_norm", "sqrt_kappa", "edr"),
+                                       results[i, j]):
+                    name = edr_sweep_measure_name(name, bandwidth, multiplier)
+                    result.setdefault(name, {})[gsim] = float(value)
+    return result
+
+
+def edr_sweep_measure_name(name: str, bandwidth: float, multiplier: float) -> str:
+    """
+    Return the name of the EDR measure `name` ("mde_norm", "sqrt_kappa" or "edr")
+    computed with the given bandwidth and multiplier (converted to float, so that
+    e.g. 3 and 3.0 give the same name)
+    """
+    return f'{name} bandwidth={float(bandwidth)} multiplier={float(multiplier)}'
+
+
 def _get_edr_gsim_information(
     gsim: str,
     imts: Iterable[str],
@@ -207,23 +488,39 @@ def _get_edr_gsim_information(
     Extract the observed ground motions, expected and total standard
     deviation for the given model `gsim` (aggregating over all IMTs)
     """
-    obs = np.array([], dtype=float)
-    expected = np.array([], dtype=float)
-    stddev = np.array([], dtype=float)
+    imts = list(imts)
+    return _get_edr_inputs(
+        gsim, imts, *_get_values(residuals, _edr_columns([gsim], imts))
+    )
+
 
+def _get_edr_inputs(
+    gsim: str,
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as `_get_edr_gsim_information` with the residuals given as 2D array of
+    values and columns positions (see `_get_values`)
+    """
+    obs_cols, expected_cols, stddev_cols = [], [], []
     for imt in imts:
-        col = (imt, Clabel.total_res, gsim)
-        _stddev = residuals.get(col)
-        col = (Clabel.input, ColumnType.intensity.value, imt)
-        _obs = np.log(residuals.get(col))
-        col = (imt, Clabel.mean, gsim)
-        _expected = residuals.get(col)
-        if _stddev is None or _obs is None or _expected is None:
+        stddev_col = (imt, Clabel.total_res, gsim)
+        obs_col = (Clabel.input, ColumnType.intensity.value, imt)
+        expected_col = (imt, Clabel.mean, gsim)
+        if (
+            stddev_col not in positions or obs_col not in positions or
+            expected_col not in positions
+        ):
             continue
-        obs = np.hstack([obs, _obs])
-        expected = np.hstack([expected, _expected])
-        stddev = np.hstack([stddev, _stddev])
-
+        obs_cols.append(positions[obs_col])
+        expected_cols.append(positions[expected_col])
+        stddev_cols.append(positions[stddev_col])
+    # concatenate the columns of all imts (imt by imt):
+    obs = np.log(values[:, obs_cols].ravel(order='F'))
+    expected = values[:, expected_cols].ravel(order='F')
+    stddev = values[:, stddev_cols].ravel(order='F')
     return obs, expected, stddev
 
 
@@ -244,27 +541,122 @@ def get_edr(
     elif not finite.all():
         obs, expected, stddev = obs[finite], expected[finite], stddev[finite]
     nvals = len(obs)
-    min_d = bandwidth / 2.
     kappa = _get_edr_kappa(obs, expected)
-    mu_d = obs - expected
+    mu_d = np.asarray(obs - expected, dtype=float)
+    stddev = np.asarray(stddev, dtype=float)
     d1c = np.fabs(obs - (expected - (multiplier * stddev)))
     d2c = np.fabs(obs - (expected + (multiplier * stddev)))
-    dc_max = ceil(np.max(np.array([np.max(d1c), np.max(d2c)])))
-    num_d = len(np.arange(min_d, dc_max, bandwidth))
+    num_d = _edr_num_bins(np.max(np.array([np.max(d1c), np.max(d2c)])), bandwidth)
     mde = np.zeros(nvals)
-    for iloc in range(0, num_d):
-        d_val = (min_d + (float(iloc) * bandwidth)) * np.ones(nvals)
-        d_1 = d_val - min_d
-        d_2 = d_val + min_d
-        p_1 = norm.cdf((d_1 - mu_d) / stddev) - norm.cdf((-d_1 - mu_d) / stddev)
-        p_2 = norm.cdf((d_2 - mu_d) / stddev) - norm.cdf((-d_2 - mu_d) / stddev)
-        mde += (p_2 - p_1) * d_val
+    for mde_bins in _yield_edr_mde_bins(mu_d, stddev, bandwidth, num_d):
+        mde += mde_bins.sum(axis=0)
     inv_n = 1.0 / float(nvals)
     mde_norm = np.sqrt(inv_n * np.sum(mde ** 2.))
     edr = np.sqrt(kappa * inv_n * np.sum(mde ** 2.))
     return float(mde_norm), float(np.sqrt(kappa)), float(edr)
 
 
+def get_edr_sweep(
+    obs: np.ndarray | pd.Series,
+    expected: np.ndarray | pd.Series,
+    stddev: np.ndarray | pd.Series,
+    bandwidths: Sequence[float],
+    multipliers: Sequence[float]
+) -> np.ndarray:
+    """
+    Same as `get_edr` for each (bandwidth, multiplier) pair of the given values.
+    Return a 3D array of shape `(len(bandwidths), len(multipliers), 3)` where
+    the element `[i, j]` is the tuple (mde_norm, sqrt_kappa, edr) computed with
+    `bandwidths[i]` and `multipliers[j]`.
+    The multiplier sets only the number of distance bins, so for each bandwidth
+    the MDE is computed once on the bins of the greatest multiplier and
+    accumulated bin by bin (see `_get_edr_mde_sq_sums`)
+    """
+    result = np.full((len(bandwidths), len(multipliers), 3), np.nan)
+    finite = np.isfinite(obs) & np.isfinite(expected) & np.isfinite(stddev)
+    if not finite.any():
+        return result
+    elif not finite.all():
+        obs, expected, stddev = obs[finite], expected[finite], stddev[finite]
+    nvals = len(obs)
+    kappa = _get_edr_kappa(obs, expected)
+    mu_d = np.asarray(obs - expected, dtype=float)
+    stddev = np.asarray(stddev, dtype=float)
+    dc_max = [
+        max(np.max(np.fabs(obs - (expected - (multiplier * stddev)))),
+            np.max(np.fabs(obs - (expected + (multiplier * stddev)))))
+        for multiplier in multipliers
+    ]
+    inv_n = 1.0 / float(nvals)
+    result[:, :, 1] = np.sqrt(kappa)
+    for i, bandwidth in enumerate(bandwidths):
+        num_ds = [_edr_num_bins(d, bandwidth) for d in dc_max]
+        # prepend 0 (sum of squared MDE with no bin):
+        sq_sums = np.append(
+            0., _get_edr_mde_sq_sums(mu_d, stddev, bandwidth, max(num_ds))
+        )[num_ds]
+        result[i, :, 0] = np.sqrt(inv_n * sq_sums)
+        result[i, :, 2] = np.sqrt(kappa * inv_n * sq_sums)
+    return result
+
+
+def _edr_num_bins(dc_max: float, bandwidth: float) -> int:
+    """Return the number of distance bins used in the EDR computation"""
+    return len(np.arange(bandwidth / 2., ceil(dc_max), bandwidth))
+
+
+# max number of elements of the temporary 2D arrays used in `get_edr`:
+_EDR_BLOCK_SIZE = 2 ** 20
+
+
+def _yield_edr_mde_bins(
+    mu_d: np.ndarray, stddev: np.ndarray, bandwidth: float, num_d: int
+) -> Iterator[np.ndarray]:
+    """
+    Yield the MDE terms of each distance bin and value (see `get_edr`) as 2D
+    arrays (one row per bin, one column per value) of consecutive bins, with at
+    most `_EDR_BLOCK_SIZE` elements each
+    """
+    min_d = bandwidth / 2.
+    # bin centers (same values as `min_d + iloc * bandwidth` for each bin `iloc`):
+    d_vals = min_d + np.arange(num_d, dtype=float) * bandwidth
+    # bin edges (the upper edge of a bin is the lower edge of the next one):
+    edges = np.append(d_vals - min_d, d_vals[-1:] + min_d)
+    block_rows = max(1, _EDR_BLOCK_SIZE // max(len(mu_d), 1))
+    for start in range(0, num_d, block_rows):
+        end = min(start + block_rows, num_d)
+        # probabilities at the block edges (one row per edge):
+        p_e = _edr_cdf_diff(edges[start: end + 1, None], mu_d, stddev)
+        p_bins = p_e[1:] - p_e[:-1]  # p_2 - p_1, one row per bin
+        p_bins *= d_vals[start: end, None]
+        yield p_bins
+
+
+def _get_edr_mde_sq_sums(
+    mu_d: np.ndarray, stddev: np.ndarray, bandwidth: float, num_d: int
+) -> np.ndarray:
+    """
+    Return the array `S` of length `num_d` where `S[n-1]` is the sum of the squared
+    MDE of all values computed with `n` distance bins (see `get_edr`)
+    """
+    mde = np.zeros(len(mu_d))
+    sq_sums = []
+    for mde_bins in _yield_edr_mde_bins(mu_d, stddev, bandwidth, num_d):
+        cum_mde = np.cumsum(mde_bins, axis=0)
+        cum_mde += mde
+        sq_sums.append((cum_mde ** 2).sum(axis=1))
+        mde = cum_mde[-1]
+    return np.concatenate(sq_sums) if sq_sums else np.zeros(0)
+
+
+def _edr_cdf_diff(d: np.ndarray, mu_d: np.ndarray, stddev: np.ndarray) -> np.ndarray:
+    """
+    Return `norm.cdf((d - mu_d) / stddev) - norm.cdf((-d - mu_d) / stddev)` with
+    `d` a column vector (broadcast to `mu_d` and `stddev` as 2D array)
+    """
+    return ndtr((d - mu_d) / stddev) - ndtr((-d - mu_d) / stddev)
+
+
 def _get_edr_kappa(
     obs: np.ndarray | pd.Series, expected: np.ndarray | pd.Series
 ) -> np.floating:
@@ -279,3 +671,503 @@ def _get_edr_kappa(
     de_orig = np.sum((obs - expected) ** 2.)
     de_corr = np.sum((obs - y_c) ** 2.)
     return de_orig / de_corr
+
+
+# Online (streaming) measures of fit:
+
+
+class MeasuresOfFitAccumulator:
+    """
+    Accumulator of the measures of fit of residuals given in chunks (e.g., the
+    output of `iter_residuals`), so that the whole residuals table never needs to
+    be stored in memory. Accumulators can be merged, e.g. when chunks are processed
+    by different workers. Usage:
+    ```
+    acc = MeasuresOfFitAccumulator(gsims, imts)
+    for chunk in iter_residuals(gsims, imts, flatfile, likelihood=True, mean=True,
+                                max_records=10000):
+        acc.update(chunk)
+    measures_of_fit = acc.result()
+    ```
+    The result is the same as `get_measures_of_fit` on the concatenated chunks, with
+    the exception of the likelihood median and IQR, which are computed from
+    histograms of `lh_bins` bins in [0, 1] (absolute error at most 1 / `lh_bins`
+    for the median and 2 / `lh_bins` for the IQR).
+    Other measures are computed from mergeable statistics: mean and variance
+    (Welford / Chan et al. algorithm), log-likelihood sums and, for EDR, the
+    cumulative sums of the squared MDE per number of distance bins, and the
+    moments needed for the correction factor kappa
+    """
+
+    def __init__(
+        self,
+        gsims: Iterable[str],
+        imts: Iterable[str],
+        edr_bandwidth=0.01,
+        edr_multiplier=3.0,
+        lh_bins=4096
+    ):
+        """
+        Initialize a new accumulator
+
+        :param gsims: the ground motion models (iterable of str)
+        :param imts: the intensity measure types (iterable of str)
+        :param edr_bandwidth: bandwidth to use in EDR values computation
+        :param edr_multiplier: multiplier to use in EDR values computation
+        :param lh_bins: the number of bins used to compute the likelihood
+            quantiles (median and IQR)
+        """
+        self.gsims, self.imts = list(gsims), list(imts)
+        self.edr_bandwidth = edr_bandwidth
+        self.edr_multiplier = edr_multiplier
+        self.lh_bins = lh_bins
+        n_stats = len(_stats_columns(self.gsims, self.imts))
+        # residuals moments (count, sum, sum of squared deviations, has finite):
+        self._moments = (
+            np.zeros(n_stats, dtype=int),
+            np.zeros(n_stats),
+            np.zeros(n_stats),
+            np.zeros(n_stats, dtype=bool)
+        )
+        # likelihood histograms (one row per column):
+        self._lh_counts = np.zeros(
+            (len(_likelihood_columns(self.gsims, self.imts)), lh_bins), dtype=int
+        )
+        # log-likelihood sums and counts:
+        n_llh = len(_loglikelihood_columns(self.gsims, self.imts))
+        self._llh = np.zeros(n_llh), np.zeros(n_llh, dtype=int)
+        # EDR statistics, per model:
+        self._edr = {g: _EdrStats() for g in self.gsims}
+
+    def update(self, residuals: pd.DataFrame) -> MeasuresOfFitAccumulator:
+        """
+        Update this object with the given residuals chunk (see `iter_residuals`).
+        Return this object
+        """
+        residuals = _with_multiindex_columns(residuals)
+        gsims, imts = self.gsims, self.imts
+        values, positions = _get_values(residuals, _all_columns(gsims, imts))
+        # residuals moments:
+        col_values, found = _get_columns(
+            values, positions, _stats_columns(gsims, imts)
+        )
+        if found.any():
+            moments = tuple(np.zeros_like(m) for m in self._moments)
+            for m, m_found in zip(moments, _get_moments(col_values)):
+                m[found] = m_found
+            self._moments = _merge_moments(self._moments, moments)
+        # likelihood histograms:
+        col_values, found = _get_columns(
+            values, positions, _likelihood_columns(gsims, imts)
+        )
+        if found.any():
+            self._lh_counts[found] += _get_histograms(col_values, self.lh_bins)
+        # log-likelihood sums:
+        col_values, found = _get_columns(
+            values, positions, _loglikelihood_columns(gsims, imts)
+        )
+        if found.any():
+            sums, counts = _get_loglikelihood_sums(col_values)
+            self._llh[0][found] += sums
+            self._llh[1][found] += counts
+        # EDR:
+        for gsim in gsims:
+            self._edr[gsim].update(
+                *_get_edr_inputs(gsim, imts, values, positions),
+                self.edr_bandwidth,
+                self.edr_multiplier
+            )
+        return self
+
+    def merge(self, other: MeasuresOfFitAccumulator) -> MeasuresOfFitAccumulator:
+        """
+        Merge the given accumulator into this object and return this object. The
+        two accumulators must have been created with the same arguments
+        """
+        if (
+            self.gsims != other.gsims or self.imts != other.imts or
+            self.edr_bandwidth != other.edr_bandwidth or
+            self.edr_multiplier != other.edr_multiplier or
+            self.lh_bins != other.lh_bins
+        ):
+            raise ValueError('Accumulators created with different arguments')
+        self._moments = _merge_moments(self._moments, other._moments)
+        self._lh_counts += other._lh_counts
+        self._llh[0][:] += other._llh[0]
+        self._llh[1][:] += other._llh[1]
+        for gsim in self.gsims:
+            self._edr[gsim].merge(other._edr[gsim])
+        return self
+
+    def result(self, as_dataframe=True) -> pd.DataFrame | dict:
+        """
+        Return the measures of fit of all residuals accumulated so far. See
+        `get_measures_of_fit` for details
+        """
+        gsims, imts = self.gsims, self.imts
+        p25, median, p75 = _histogram_percentiles(self._lh_counts, [25, 50, 75])
+        edr_values = {g: self._edr[g].result(self.edr_bandwidth) for g in gsims}
+        result = _collect_measures(gsims, [
+            _format_stats(
+                _stats_columns(gsims, imts), *_mean_std(*self._moments)
+            ),
+            _format_likelihood_stats(
+                _likelihood_columns(gsims, imts), median, p75 - p25
+            ),
+            _format_loglikelihood(gsims, imts, *self._llh),
+            {
+                name: {g: v[i] for g, v in edr_values.items()}
+                for i, name in enumerate(['mde_norm', 'sqrt_kappa', 'edr'])
+            }
+        ])
+        if as_dataframe:
+            return pd.DataFrame(result, dtype=float)
+        return result
+
+
+def _merge_moments(
+    moments1: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    moments2: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge the given moments (see `_get_moments`) with the parallel algorithm of
+    Chan et al. (1979) and return the merged moments
+    """
+    count1, total1, m2_1, finite1 = moments1
+    count2, total2, m2_2, finite2 = moments2
+    count = count1 + count2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = total2 / count2 - total1 / count1
+        m2 = m2_1 + m2_2 + delta ** 2 * count1 * count2 / count
+    # if any count is zero, take the other moment as it is:
+    m2 = np.where(count1 == 0, m2_2, np.where(count2 == 0, m2_1, m2))
+    return count, total1 + total2, m2, finite1 | finite2
+
+
+def _get_histograms(values: np.ndarray, bins: int) -> np.ndarray:
+    """
+    Return the histograms (2D array, one row per column of `values`) of the
+    values in [0, 1] (e.g. likelihoods) in `bins` equally spaced bins. NaNs are
+    skipped
+    """
+    n_rows, n_cols = values.shape
+    valid = ~np.isnan(values)
+    bin_idx = np.clip((values[valid] * bins).astype(int), 0, bins - 1)
+    col_idx = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))[valid]
+    return np.bincount(
+        col_idx * bins + bin_idx, minlength=n_cols * bins
+    ).reshape(n_cols, bins)
+
+
+def _histogram_percentiles(counts: np.ndarray, q: list[float]) -> np.ndarray:
+    """
+    Return the percentiles of the histograms of values in [0, 1] (2D array, one
+    histogram per row, see `_get_histograms`) as 2D array of shape
+    `(len(q), len(counts))`. Values are assumed uniformly distributed within each
+    bin and percentiles are linearly interpolated as in `numpy.percentile`.
+    Empty histograms have NaN percentiles
+    """
+    n_hist, bins = counts.shape
+    result = np.full((len(q), n_hist), np.nan)
+    cum_counts = np.cumsum(counts, axis=1)
+    for h_idx in np.flatnonzero(cum_counts[:, -1] if bins else []):
+        cum_count = cum_counts[h_idx]
+        n = cum_count[-1]
+
+        def value(k):  # estimated value of the k-th (0-based) sorted value
+            b = np.searchsorted(cum_count, k, side='right')
+            prev = cum_count[b - 1] if b > 0 else 0
+            return (b + (k - prev + 0.5) / (cum_count[b] - prev)) / bins
+
+        for q_idx, q_val in enumerate(q):
+            pos = (n - 1) * q_val / 100.
+            lo, hi = int(np.floor(pos)), int(np.ceil(pos))
+            v_lo = value(lo)
+            result[q_idx, h_idx] = v_lo + (pos - lo) * (value(hi) - v_lo)
+    return result
+
+
+class _EdrStats:
+    """
+    Mergeable statistics of a model for computing the EDR from residuals given
+    in chunks (see `MeasuresOfFitAccumulator` and `get_edr`)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.dc_max = -np.inf  # max of `d1c` and `d2c` (see `get_edr`)
+        # moments of (obs, expected) for kappa (means, centered co-moments):
+        self.mean_obs = self.mean_exp = 0.
+        self.c_oo = self.c_ee = self.c_oe = 0.
+        # sum of the squared MDE of the records, per number of bins:
+        self.mde_sq_sums = np.zeros(0)
+
+    def update(
+        self,
+        obs: np.ndarray,
+        expected: np.ndarray,
+        stddev: np.ndarray,
+        bandwidth: float,
+        multiplier: float
+    ):
+        """Update this object with the given values (see `get_edr`)"""
+        finite = np.isfinite(obs) & np.isfinite(expected) & np.isfinite(stddev)
+        obs, expected, stddev = obs[finite], expected[finite], stddev[finite]
+        if not len(obs):
+            return
+        other = _EdrStats()
+        other.count = len(obs)
+        other.dc_max = max(
+            np.max(np.fabs(obs - (expected - (multiplier * stddev)))),
+            np.max(np.fabs(obs - (expected + (multiplier * stddev))))
+        )
+        other.mean_obs, other.mean_exp = np.mean(obs), np.mean(expected)
+        obs_dev, exp_dev = obs - other.mean_obs, expected - other.mean_exp
+        other.c_oo = np.sum(obs_dev ** 2)
+        other.c_ee = np.sum(exp_dev ** 2)
+        other.c_oe = np.sum(obs_dev * exp_dev)
+        # compute the MDE up to the bin where it does not change anymore for
+        # any record (i.e., beyond 10 standard deviations from the mean. Note:
+        # `stddev` might be negative, see `_get_edr_gsim_information`):
+        mu_d = obs - expected
+        num_bins = max(
+            _edr_num_bins(other.dc_max, bandwidth),
+            _edr_num_bins(np.max(np.fabs(mu_d) + 10 * np.fabs(stddev)), bandwidth)
+        )
+        other.mde_sq_sums = _get_edr_mde_sq_sums(mu_d, stddev, bandwidth, num_bins)
+        self.merge(other)
+
+    def merge(self, other: _EdrStats):
+        """Merge the given object into this one"""
+        if not other.count:
+            return
+        if not self.count:
+            self.__dict__.update(other.__dict__)
+            return
+        count = self.count + other.count
+        d_obs = other.mean_obs - self.mean_obs
+        d_exp = other.mean_exp - self.mean_exp
+        factor = self.count * other.count / count
+        self.c_oo += other.c_oo + d_obs ** 2 * factor
+        self.c_ee += other.c_ee + d_exp ** 2 * factor
+        self.c_oe += other.c_oe + d_obs * d_exp * factor
+        self.mean_obs += d_obs * other.count / count
+        self.mean_exp += d_exp * other.count / count
+        self.count = count
+        self.dc_max = max(self.dc_max, other.dc_max)
+        # MDE sums are constant beyond their length, so pad with the last value:
+        sums1, sums2 = self.mde_sq_sums, other.mde_sq_sums
+        size = max(len(sums1), len(sums2))
+        self.mde_sq_sums = (
+            np.pad(sums1, (0, size - len(sums1)), mode='edge') +
+            np.pad(sums2, (0, size - len(sums2)), mode='edge')
+        )
+
+    def result(self, bandwidth: float) -> tuple[float, float, float]:
+        """Return the tuple (mde_norm, sqrt_kappa, edr), see `get_edr`"""
+        if not self.count:
+            return np.nan, np.nan, np.nan
+        num_bins = _edr_num_bins(self.dc_max, bandwidth)
+        mde_sq_sum = 0.
+        if num_bins and len(self.mde_sq_sums):
+            mde_sq_sum = self.mde_sq_sums[min(num_bins, len(self.mde_sq_sums)) - 1]
+        # kappa (see `_get_edr_kappa`) from the moments:
+        de_orig = (
+            self.c_oo - 2 * self.c_oe + self.c_ee +
+            self.count * (self.mean_obs - self.mean_exp) ** 2
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            de_corr = self.c_ee - self.c_oe ** 2 / np.float64(self.c_oo)
+            kappa = de_orig / de_corr
+        inv_n = 1.0 / float(self.count)
+        mde_norm = np.sqrt(inv_n * mde_sq_sum)
+        edr = np.sqrt(kappa * inv_n * mde_sq_sum)
+        return float(mde_norm), float(np.sqrt(kappa)), float(edr)
+
+
+def get_measures_of_fit_from_chunks(
+    gsims: Iterable[str],
+    imts: Iterable[str],
+    residuals_chunks: Iterable[pd.DataFrame],
+    as_dataframe=True,
+    edr_bandwidth=0.01,
+    edr_multiplier=3.0,
+    lh_bins=4096
+) -> pd.DataFrame | dict:
+    """
+    Same as `get_measures_of_fit` but with the residuals given in chunks (e.g.,
+    the output of `iter_residuals`). See `MeasuresOfFitAccumulator` for details
+    """
+    acc = MeasuresOfFitAccumulator(
+        gsims, imts, edr_bandwidth, edr_multiplier, lh_bins
+    )
+    for chunk in residuals_chunks:
+        acc.update(chunk)
+    return acc.result(as_dataframe)
+
+
+# Bootstrap confidence intervals:
+
+
+def get_measures_of_fit_bootstrap(
+    gsims: Iterable[str],
+    imts: Iterable[str],
+    residuals: pd.DataFrame,
+    num_samples=1000,
+    confidence=0.95,
+    events: np.ndarray | None = None,
+    workers: int | None = None,
+    seed: int | None = None,
+    edr_bandwidth=0.01,
+    edr_multiplier=3.0
+) -> pd.DataFrame:
+    """
+    Same as `get_measures_of_fit`, with the bootstrap confidence interval of each
+    measure of fit. The bootstrap distributions are computed by resampling the
+    events of `residuals` with replacement `num_samples` times (all records of a
+    sampled event are taken), and computing the measures of fit of each sample
+    from the given residuals (models are not computed again).
+
+    :param num_samples: the number of bootstrap samples (positive integer)
+    :param confidence: the confidence level of the intervals, in (0, 1)
+    :param events: numpy array of integers denoting the event of each row of
+        `residuals`, or None (the default): infer the events from the input
+        columns of `residuals`
+    :param workers: the number of processes used to compute the samples in
+        parallel. None (the default) or any value lower than 2 computes all
+        samples sequentially in this process
+    :param seed: the random seed, for reproducible results. Results do not
+        depend on `workers`
+
+    For all other parameters, see `get_measures_of_fit`
+
+    :return: a Pandas dataframe (columns: measures of fit, rows: model names)
+        where each measure of fit M is followed by the columns
+        "M ci_lower" and "M ci_upper" (the confidence interval bounds)
+    """
+    if num_samples < 1:
+        raise ValueError('The number of bootstrap samples must be positive')
+    residuals = _with_multiindex_columns(residuals)
+    gsims, imts = list(gsims), list(imts)
+    if events is None:
+        events = get_event_codes(residuals)
+    values, positions = _get_values(residuals, _all_columns(gsims, imts))
+    measures = pd.DataFrame(
+        _get_measures_of_fit(
+            gsims, imts, values, positions, edr_bandwidth, edr_multiplier
+        ),
+        dtype=float
+    )
+    # resample events, i.e. the rows sorted by event (grouped):
+    _, inverse, counts = np.unique(events, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind='stable')
+    args = (gsims, imts, values[order], positions, counts, edr_bandwidth,
+            edr_multiplier)
+    seeds = np.random.SeedSequence(seed).spawn(num_samples)
+    if workers is not None and workers > 1 and num_samples > 1:
+        chunksize = max(1, num_samples // (workers * 4))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_bootstrap_worker,
+            initargs=args
+        ) as executor:
+            samples = list(executor.map(
+                _bootstrap_task,
+                (seeds[i: i + chunksize] for i in range(0, num_samples, chunksize))
+            ))
+    else:
+        samples = [_bootstrap_samples(seeds, *args)]
+    # samples: array of shape (num_samples, len(gsims), num_measures):
+    samples = np.concatenate(samples, axis=0)
+    alpha = 100 * (1 - confidence) / 2
+    with warnings.catch_warnings():  # skip "All-NaN slice encountered"
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        ci_lower, ci_upper = np.nanpercentile(samples, [alpha, 100 - alpha], axis=0)
+    columns = {}
+    for idx, measure in enumerate(measures.columns):
+        columns[measure] = measures[measure]
+        columns[f'{measure} ci_lower'] = ci_lower[:, idx]
+        columns[f'{measure} ci_upper'] = ci_upper[:, idx]
+    return pd.DataFrame(columns, index=measures.index, dtype=float)
+
+
+def get_event_codes(residuals: pd.DataFrame) -> np.ndarray:
+    """
+    Return the event codes (numpy array of integers starting from 0) of the
+    rows of `residuals`, inferred from its input columns (see `get_residuals`)
+    """
+    residuals = _with_multiindex_columns(residuals)
+    is_input = residuals.columns.get_level_values(0) == Clabel.input
+    flatfile = residuals.loc[:, is_input]
+    flatfile.columns = flatfile.columns.get_level_values(2)
+    ev_id_cols = get_event_id_column_names(flatfile)
+    return flatfile.groupby(
+        ev_id_cols[0] if len(ev_id_cols) == 1 else ev_id_cols,
+        observed=True, sort=True, dropna=False
+    ).ngroup().to_numpy()
+
+
+# worker process data for bootstrap computations (see `_init_bootstrap_worker`):
+_worker_bootstrap_args: tuple | None = None
+
+
+def _init_bootstrap_worker(
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int],
+    counts: np.ndarray,
+    edr_bandwidth: float,
+    edr_multiplier: float
+):
+    """
+    Store the given arguments in the current worker process (see
+    `_bootstrap_samples` for details)
+    """
+    global _worker_bootstrap_args
+    _worker_bootstrap_args = (
+        gsims, imts, values, positions, counts, edr_bandwidth, edr_multiplier
+    )
+
+
+def _bootstrap_task(seeds: list[np.random.SeedSequence]) -> np.ndarray:
+    """
+    Compute the bootstrap samples of the given seeds in a worker process (see
+    `_init_bootstrap_worker` and `_bootstrap_samples`)
+    """
+    return _bootstrap_samples(seeds, *_worker_bootstrap_args)
+
+
+def _bootstrap_samples(
+    seeds: list[np.random.SeedSequence],
+    gsims: list[str],
+    imts: list[str],
+    values: np.ndarray,
+    positions: dict[tuple[str, str, str], int],
+    counts: np.ndarray,
+    edr_bandwidth: float,
+    edr_multiplier: float
+) -> np.ndarray:
+    """
+    Compute the measures of fit of the bootstrap samples, one per seed, and return
+    them as array of shape (len(seeds), len(gsims), num_measures). `values` must be
+    sorted by event, and `counts` is the number of records (rows of `values`) of
+    each event
+    """
+    starts = np.cumsum(counts) - counts
+    result = []
+    for seed in seeds:
+        sampled = np.random.default_rng(seed).integers(0, len(counts), len(counts))
+        # rows of the sampled events:
+        lens = counts[sampled]
+        rows = np.repeat(starts[sampled] - np.cumsum(lens) + lens, lens)
+        rows += np.arange(len(rows))
+        measures = _get_measures_of_fit(
+            gsims, imts, values[rows], positions, edr_bandwidth, edr_multiplier
+        )
+        result.append([
+            [np.nan if v is None else v for v in m.values()]
+            for m in measures.values()
+        ])
+    # result shape: (len(seeds), num_measures, len(gsims)). Return transposed:
+    return np.transpose(np.array(result, dtype=float), (0, 2, 1))
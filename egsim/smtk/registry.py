@@ -1,5 +1,6 @@
 """Registry with helper functions to access OpenQuake entities and properties"""
 
+from functools import lru_cache
 from typing import Iterable, Callable
 import re
 import numpy as np
@@ -121,6 +122,18 @@ def sa_period(obj: float | str | IMT) -> float | None:
 
     :arg: str or `IMT` instance, such as "SA(1.0)" or `imt.SA(1.0)`
     """
+    if isinstance(obj, str):
+        # strings (e.g. flatfile column names) are parsed once and cached:
+        return _sa_period_from_str(obj)
+    return _sa_period(obj)
+
+
+@lru_cache(maxsize=4096)
+def _sa_period_from_str(obj: str) -> float | None:
+    return _sa_period(obj)
+
+
+def _sa_period(obj: float | str | IMT) -> float | None:
     try:
         imt_inst = imt(obj)
         if not imt_name(imt_inst).startswith('SA('):
@@ -222,5 +235,6 @@ class Clabel:
     intra_ev_lh = intra_ev_res.replace("_residual", "_likelihood")
     mag = "mag"
     rrup = 'rrup'
+    scenario_id = 'scenario_id'
     uncategorized_input = 'uncategorized'
     sep = " "  # the default separator for single-row column header
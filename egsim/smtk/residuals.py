@@ -4,17 +4,18 @@ from __future__ import annotations  # https://peps.python.org/pep-0563/
 
 from itertools import product
 
-from collections.abc import Iterable, Container, Collection
+from collections.abc import Iterable, Iterator, Container, Collection, Sequence
 from pandas import Index
 from math import sqrt
 
 import numpy as np
+from numpy.lib.recfunctions import repack_fields
 import pandas as pd
-from scipy.interpolate import interp1d
 from scipy.special import erf
 from openquake.hazardlib.gsim.base import GMPE
 from openquake.hazardlib import imt, const
-from openquake.hazardlib.contexts import RuptureContext
+from openquake.baselib.general import RecordBuilder
+from openquake.hazardlib.contexts import RuptureContext, ContextMaker
 from openquake.hazardlib.scalerel import PeerMSR
 
 from .flatfile import (
@@ -33,7 +34,8 @@ from .validation import (
     init_context_maker,
     harmonize_input_imts,
     validate_imt_sa_limits,
-    get_ground_motion_values
+    get_ground_motion_values,
+    get_ground_motion_values_parallel
 )
 from .registry import (Clabel, sa_period, ground_motion_properties_required_by)
 from .converters import vs30_to_z1pt0_cy14, vs30_to_z2pt5_cb14
@@ -46,7 +48,11 @@ def get_residuals(
     likelihood=False,
     normalise=True,
     mean=False,
-    header_sep: str | None = Clabel.sep
+    header_sep: str | None = Clabel.sep,
+    workers: int | None = None,
+    prepared=False,
+    expected: pd.DataFrame | None = None,
+    dtype: str | np.dtype | None = None
 ) -> pd.DataFrame:
     """
     Calculate the residuals from a given flatfile gsim(s) and imt(s)
@@ -70,30 +76,260 @@ def get_residuals(
         to "" or None to return a multi-level column header composed of the first 3
         dataframe rows (e.g. ("PGA", "median", "BindiEtAl2014Rjb"). See
         "MultiIndex / advanced indexing" in the pandas doc for details)
-
-    :return: pandas DataFrame
+    :param workers: int or None (the default): the number of processes used to
+        compute the models predictions in parallel (one task per model). None or
+        any value lower than 2 computes all models sequentially in this process
+    :param prepared: boolean (default False) telling if `flatfile` is the output
+        of `prepare_flatfile` with the given models and imts (e.g., stored from a
+        previous computation), in which case it is used as it is and not modified
+    :param expected: pandas DataFrame or None (the default): the precomputed
+        expected motions of some or all models, with the same rows (records) as
+        `flatfile` or more, and columns in the form (imt, label, model) (see
+        `get_expected_motions`). The models with the expected motions of all
+        required intensity measures in `expected` will not be computed
+    :param dtype: the numpy float data type of the residuals, likelihoods and
+        models mean (e.g. "float32"), or None (the default: float64). Model
+        predictions, residuals and likelihoods are always computed in double
+        precision, and only stored in `dtype`: with "float32", the memory usage of the output is almost
+        halved, and values have an absolute error (with respect to float64
+        outputs) in the order of 1e-6, i.e. negligible for residual analysis
+
+    :return: pandas DataFrame. The ratio of records whose model predictions were
+        copied from a record with the same model inputs (0: no duplicate) is set in
+        the DataFrame `attrs['dedup_ratio']` (see `get_expected_motions`)
     """
     # 1. prepare models and imts:
     gsims = harmonize_input_gsims(gsims)
     imts = harmonize_input_imts(imts)
     validate_inputs(gsims, imts)
     # 2. prepare flatfile:
-    flatfile_r = prepare_flatfile(flatfile, gsims, imts)
+    flatfile_r = flatfile if prepared else prepare_flatfile(flatfile, gsims, imts)
     # 3. compute residuals:
+    return _get_residuals(
+        gsims, imts, flatfile_r, likelihood, normalise, mean, header_sep, workers,
+        expected, dtype
+    )
+
+
+def iter_residuals(
+    gsims: Iterable[str | GMPE],
+    imts: Iterable[str | imt.IMT],
+    flatfile: pd.DataFrame,
+    likelihood=False,
+    normalise=True,
+    mean=False,
+    header_sep: str | None = Clabel.sep,
+    workers: int | None = None,
+    prepared=False,
+    expected: pd.DataFrame | None = None,
+    dtype: str | np.dtype | None = None,
+    max_records: int | None = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Same as `get_residuals`, but yield the residuals in chunks (pandas DataFrames)
+    of at most `max_records` rows each, so that the whole residuals table
+    never needs to be stored in memory. Records are grouped by whole events (i.e.,
+    a chunk never splits an event, so that inter-event residuals are correct),
+    thus a chunk might have more than `max_records` rows only if a single event
+    does. All chunks have the same columns, and their concatenation is
+    equal to the output of `get_residuals`, with the exception of string columns
+    of `flatfile`, which are converted to categorical when the flatfile is split
+    into several chunks (so that all chunks have the same dtypes). Note that inputs
+    are validated (and any error raised) before the first chunk is yielded
+
+    :param max_records: int or None (the default): the maximum number of
+        records (rows) per chunk. None or non-positive values yield a single chunk
+
+    For all other parameters, see `get_residuals`
+    """
+    # 1. prepare models and imts:
+    gsims = harmonize_input_gsims(gsims)
+    imts = harmonize_input_imts(imts)
+    validate_inputs(gsims, imts)
+    # 2. prepare flatfile:
+    flatfile_r = flatfile if prepared else prepare_flatfile(flatfile, gsims, imts)
+    if max_records and 0 < max_records < len(flatfile_r):
+        str_cols = flatfile_r.select_dtypes(include=['object', 'string']).columns
+        if len(str_cols):
+            flatfile_r = flatfile_r.astype({c: 'category' for c in str_cols})
+    # 3. compute residuals (lazily):
+    return (
+        _get_residuals(
+            gsims, imts, chunk, likelihood, normalise, mean, header_sep, workers,
+            expected, dtype
+        )
+        for chunk in yield_event_chunks(flatfile_r, max_records)
+    )
+
+
+def yield_event_chunks(
+    flatfile: pd.DataFrame, max_records: int | None
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield chunks (sub-DataFrames) of the given flatfile with all records of one or
+    more events, and at most `max_records` rows (unless a single event has more
+    records). None or non-positive `max_records` yield the flatfile unchanged
+    """
+    if not max_records or max_records <= 0 or len(flatfile) <= max_records:
+        yield flatfile
+        return
+    ev_id_cols = get_event_id_column_names(flatfile)
+    ev_indices = flatfile.groupby(
+        ev_id_cols[0] if len(ev_id_cols) == 1 else ev_id_cols,
+        observed=True
+    ).indices  # dict of event id -> numpy array of integer positions
+    chunk, size = [], 0
+    for indices in ev_indices.values():
+        if chunk and size + len(indices) > max_records:
+            yield flatfile.iloc[np.concatenate(chunk)]
+            chunk, size = [], 0
+        chunk.append(indices)
+        size += len(indices)
+    if chunk:
+        yield flatfile.iloc[np.concatenate(chunk)]
+
+
+def _get_residuals(
+    gsims: dict[str, GMPE],
+    imts: dict[str, imt.IMT],
+    flatfile_r: pd.DataFrame,
+    likelihood: bool,
+    normalise: bool,
+    mean: bool,
+    header_sep: str | None,
+    workers: int | None,
+    expected: pd.DataFrame | None,
+    dtype: str | np.dtype | None
+) -> pd.DataFrame:
+    """
+    Compute the residuals from the already validated inputs and prepared flatfile
+    (see `get_residuals` for details)
+    """
+    # compute in double precision (likelihoods included), cast to `dtype` at the end:
     residuals = get_residuals_from_validated_inputs(
-        gsims, imts, flatfile_r, normalise=normalise, return_mean=mean
+        gsims, imts, flatfile_r, normalise=normalise, return_mean=mean,
+        workers=workers, expected=expected
     )
-    labels = [Clabel.total_res, Clabel.inter_ev_res, Clabel.intra_ev_res]
-    if mean:
-        labels += [Clabel.mean]
+    # Note: residuals columns are already sorted by (imt, label, gsim)
+    attrs = dict(residuals.attrs)
     if likelihood:
         residuals = get_residuals_likelihood(residuals)
-        labels += [Clabel.total_lh, Clabel.inter_ev_lh, Clabel.intra_ev_lh]
+        residuals = _sort_residuals_columns(residuals, imts, gsims)
+    if dtype is not None:
+        residuals = residuals.astype(dtype, copy=False)
+    residuals = _concat_input_columns(residuals, flatfile_r, header_sep)
+    residuals.attrs = attrs
+    return residuals
+
+
+def add_residuals(
+    residuals: pd.DataFrame,
+    gsims: Iterable[str | GMPE],
+    imts: Iterable[str | imt.IMT] | None = None,
+    likelihood=False,
+    normalise=True,
+    mean=False,
+    header_sep: str | None = Clabel.sep,
+    workers: int | None = None,
+    dtype: str | np.dtype | None = None
+) -> pd.DataFrame:
+    """
+    Return a copy of the given residuals with the residuals of the given models
+    added. Only the (imt, model) columns not found in `residuals` are computed,
+    using the input columns embedded in `residuals` (the flatfile is not needed and
+    prepared only for the missing ground motion properties and intensity
+    measures, if any, raising in case they can not be inferred from the other
+    input columns). E.g.:
+    ```
+    residuals = get_residuals(gsims, imts, flatfile)
+    residuals = add_residuals(residuals, new_gsims)
+    ```
+
+    :param residuals: pandas DataFrame, output of `get_residuals` with the same
+        `header_sep` given here
+    :param imts: iterable of strings or ``imt.IMT`` instances, or None (the
+        default): the intensity measures to compute. None will use all intensity
+        measures found in `residuals`
+
+    For all other parameters, see `get_residuals`. Note that `likelihood`,
+    `normalise` and `mean` should be the same used to compute `residuals`
+
+    :return: pandas DataFrame
+    """
+    columns = residuals.columns
+    if not isinstance(columns, pd.MultiIndex):
+        columns = pd.MultiIndex.from_tuples(c.split(header_sep, 2) for c in columns)
+    is_input = columns.get_level_values(0) == Clabel.input
+    flatfile = residuals.loc[:, is_input].set_axis(
+        columns[is_input].get_level_values(2), axis=1
+    )
+    old_residuals = residuals.loc[:, ~is_input].set_axis(columns[~is_input], axis=1)
+    computed = set(
+        zip(old_residuals.columns.get_level_values(0),
+            old_residuals.columns.get_level_values(2))
+    )
+    # 1. prepare models and imts:
+    gsims = harmonize_input_gsims(gsims)
+    imts = harmonize_input_imts(
+        old_residuals.columns.get_level_values(0).unique() if imts is None else imts
+    )
+    validate_inputs(gsims, imts)
+    # 2. group models by the intensity measures to compute:
+    missing: dict[tuple[str, ...], list[str]] = {}
+    for gsim_name, gsim in gsims.items():
+        imt_names = tuple(
+            i for i in validate_imt_sa_limits(gsim, imts)
+            if (i, gsim_name) not in computed
+        )
+        if imt_names:
+            missing.setdefault(imt_names, []).append(gsim_name)
+    # 3. compute residuals:
+    new_residuals = [old_residuals]
+    for imt_names, gsim_names in missing.items():
+        m_gsims = {g: gsims[g] for g in gsim_names}
+        m_imts = {i: imts[i] for i in imt_names}
+        flatfile_r = prepare_flatfile(flatfile, m_gsims, m_imts)
+        # add new input columns (if any):
+        new_cols = [c for c in flatfile_r.columns if c not in flatfile.columns]
+        if new_cols:
+            flatfile = pd.concat([flatfile, flatfile_r[new_cols]], axis=1)
+        m_residuals = get_residuals_from_validated_inputs(
+            m_gsims, m_imts, flatfile_r, normalise=normalise, return_mean=mean,
+            workers=workers
+        )
+        if likelihood:
+            m_residuals = get_residuals_likelihood(m_residuals)
+        if dtype is not None:
+            m_residuals = m_residuals.astype(dtype, copy=False)
+        new_residuals.append(m_residuals)
+    residuals = pd.concat(new_residuals, axis=1)
+    all_imts = harmonize_input_imts(set(residuals.columns.get_level_values(0)))
+    all_gsims = sorted(set(residuals.columns.get_level_values(2)))
+    residuals = _sort_residuals_columns(residuals, all_imts, all_gsims)
+    return _concat_input_columns(residuals, flatfile, header_sep)
+
+
+def _sort_residuals_columns(
+    residuals: pd.DataFrame, imts: Iterable[str], gsims: Iterable[str]
+) -> pd.DataFrame:
+    """Sort the residuals columns by (imt, label, gsim)"""
+    labels = [
+        Clabel.total_res, Clabel.inter_ev_res, Clabel.intra_ev_res, Clabel.mean,
+        Clabel.total_lh, Clabel.inter_ev_lh, Clabel.intra_ev_lh
+    ]
     # sort columns (kind of reindex, more verbose for safety):
     original_cols = set(residuals.columns)
     sorted_cols = product(imts, labels, gsims)
-    residuals = residuals[[c for c in sorted_cols if c in original_cols]]
-    # concat:
+    return residuals[[c for c in sorted_cols if c in original_cols]]
+
+
+def _concat_input_columns(
+    residuals: pd.DataFrame, flatfile_r: pd.DataFrame, header_sep: str | None
+) -> pd.DataFrame:
+    """
+    Concatenate the residuals and the input data (flatfile) columns, returning
+    a new DataFrame with the columns header built according to `header_sep`
+    """
     col_mapping = {}
     for c in flatfile_r.columns:
         c_type = column_type(c)
@@ -102,7 +338,7 @@ def get_residuals(
             c_type.value if c_type else Clabel.uncategorized_input,
             c
         )
-    flatfile_r.rename(columns=col_mapping, inplace=True)
+    flatfile_r = flatfile_r.rename(columns=col_mapping)
     # sort columns:
     flatfile_r.sort_index(axis=1, inplace=True)
     # concat residuals and observations
@@ -117,13 +353,19 @@ def get_residuals(
 def prepare_flatfile(
     flatfile: pd.DataFrame,
     gsims: dict[str, GMPE],
-    imts: dict[str, imt.IMT]
+    imts: dict[str, imt.IMT],
+    sa_spectrum: SaSpectrum | None = None
 ) -> pd.DataFrame:
     """
     Return a version of flatfile ready for residuals computation with
     the given gsims and imts
+
+    :param sa_spectrum: the SA spectrum of the flatfile records, used to
+        interpolate SA periods not found in the flatfile (see `get_required_sa`)
     """
-    flatfile_r = get_flatfile_for_residual_analysis(flatfile, gsims.values(), imts)
+    flatfile_r = get_flatfile_for_residual_analysis(
+        flatfile, gsims.values(), imts, sa_spectrum
+    )
     # copy event columns (raises if columns not found):
     ev_cols = get_event_id_column_names(flatfile)
     flatfile_r[ev_cols] = flatfile[ev_cols]
@@ -143,24 +385,71 @@ def get_residuals_from_validated_inputs(
     imts: dict[str, imt.IMT],
     flatfile: pd.DataFrame,
     normalise=True,
-    return_mean=False
+    return_mean=False,
+    workers: int | None = None,
+    expected: pd.DataFrame | None = None,
+    dtype: str | np.dtype | None = None
 ) -> pd.DataFrame:
-    residuals = []
     # compute the observations (compute the log for all once here):
     observed = get_observed_motions(flatfile, imts, True)
-    for context in yield_event_contexts(flatfile):
-        # Get the expected ground motions by event
-        expected = get_expected_motions(gsims, imts, context)
-        # Get residuals:
-        res = get_residuals_from_expected_and_observed_motions(
-            expected,
-            observed.loc[expected.index, :],
-            normalise=normalise,
-            return_mean=return_mean
+    context = FlatfileContext(flatfile)
+    if expected is not None:
+        # take the precomputed expected motions, if any (rows ordered as `context`)
+        expected, gsims = get_stored_expected_motions(
+            expected, gsims, imts, context.sids
         )
-        residuals.append(res)
-    # concat preserving index (last arg. is False by default but set anyway for safety):
-    return pd.concat(residuals, axis='index', ignore_index=False)
+    if gsims:
+        # Get the expected ground motions of all events at once (one model call
+        # per model, rows ordered as `context`). Keep double precision, the
+        # residuals are computed from these values:
+        computed = get_expected_motions(gsims, imts, context, workers=workers)
+        expected = computed if expected is None else pd.concat(
+            [expected, computed], axis=1
+        )
+    # event codes (one per row) used to compute the random effects:
+    events = context.events
+    residuals = get_residuals_from_expected_and_observed_motions(
+        expected,
+        observed.loc[expected.index, :],
+        normalise=normalise,
+        return_mean=return_mean,
+        events=events,
+        dtype=dtype
+    )
+    # ratio of deduplicated records (0 if all expected motions were stored):
+    residuals.attrs['dedup_ratio'] = computed.attrs['dedup_ratio'] if gsims else 0.
+    return residuals
+
+
+def get_stored_expected_motions(
+    expected: pd.DataFrame,
+    gsims: dict[str, GMPE],
+    imts: dict[str, imt.IMT],
+    sids: Index
+) -> tuple[pd.DataFrame | None, dict[str, GMPE]]:
+    """
+    Return the tuple (stored, missing) from the given precomputed expected motions,
+    where `stored` is the DataFrame of the expected motions of the given
+    records (`sids`) and all models with all required intensity measures in
+    `expected` (or None if no such model is found), and `missing` is the dict of
+    the remaining models, whose expected motions need to be computed
+
+    :param expected: the precomputed expected motions with columns in the form
+        (imt, label, model) and including the given `sids` in the index
+    """
+    columns = set(expected.columns)
+    stored, missing = [], {}
+    for gsim_name, gsim in gsims.items():
+        imts_ok = validate_imt_sa_limits(gsim, imts)
+        if imts_ok and all((i, Clabel.mean, gsim_name) in columns for i in imts_ok):
+            stored.extend(
+                c for c in expected.columns if c[0] in imts_ok and c[2] == gsim_name
+            )
+        else:
+            missing[gsim_name] = gsim
+    if not stored:
+        return None, missing
+    return expected.loc[sids, stored], missing
 
 
 def get_observed_motions(flatfile: pd.DataFrame, imts: Container[str], log=True):
@@ -236,26 +525,186 @@ class EventContext(RuptureContext):
         return values
 
 
+class FlatfileContext:
+    """
+    Context of all events of a flatfile, building the OpenQuake context recarray
+    of all records in one shot from the flatfile columns (see `self.recarray`).
+    Records are grouped by event, in the same order of `yield_event_contexts`, and
+    the per-column arrays (sorted by event) are cached, so that each flatfile column
+    is read at most once. This is the efficient alternative to
+    `cmaker.recarray(list(yield_event_contexts(flatfile)))`
+    """
+
+    def __init__(self, flatfile: pd.DataFrame):
+        if not pd.api.types.is_integer_dtype(flatfile.index.dtype):
+            raise ValueError('flatfile index must be made of integers')
+        if EventContext.rupture_params is None:
+            EventContext.rupture_params = column_names(type='rupture')
+        ev_id_cols = get_event_id_column_names(flatfile)
+        # group number of each record (NaN: no event, as in `yield_event_contexts`):
+        codes = flatfile.groupby(
+            ev_id_cols[0] if len(ev_id_cols) == 1 else ev_id_cols,
+            observed=True,
+            sort=True
+        ).ngroup().to_numpy()
+        order = np.argsort(codes, kind='stable')  # NaNs (if any) last
+        order = order[codes[order] >= 0]
+        self._flatfile = flatfile
+        # positions of the records sorted by event (None: flatfile already sorted):
+        self._order = None if (
+            len(order) == len(flatfile) and (np.diff(order) == 1).all()
+        ) else order
+        # event code (0, 1, ..., N-1) of each record:
+        self.events = codes[order].astype(int)
+        # position of the first record of each event:
+        self._first = np.flatnonzero(np.diff(self.events, prepend=-1))
+        self._columns: dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        """Return the number of records of this object"""
+        return len(self.events)
+
+    @property
+    def num_events(self) -> int:
+        """Return the number of events of this object"""
+        return len(self._first)
+
+    @property
+    def sids(self) -> Index:
+        """
+        Return the ids of the records of this context (see `EventContext.sids`),
+        in the same order of the context recarray
+        """
+        if self._order is None:
+            return self._flatfile.index
+        return self._flatfile.index[self._order]
+
+    @property
+    def mag(self) -> np.ndarray:
+        """Return the magnitudes of the events of this object, one per event"""
+        return self.column('mag')[self._first]
+
+    def column(self, column_name: str) -> np.ndarray:
+        """
+        Return the values of the given flatfile column sorted by event (rupture
+        parameters are set from the first record of each event, as in
+        `EventContext`). The array is cached and should be treated as read-only.
+        Raises MissingColumnError if the column is not found
+        """
+        values = self._columns.get(column_name, None)
+        if values is None:
+            try:
+                values = self._flatfile[column_name].to_numpy()
+            except KeyError:
+                raise MissingColumnError(column_name)
+            if self._order is not None:
+                values = values[self._order]
+            if column_name in EventContext.rupture_params:
+                values = values[self._first][self.events]
+            self._columns[column_name] = values
+        return values
+
+    def recarray(self, cmaker: ContextMaker) -> np.recarray:
+        """
+        Return the context recarray of all records of this object, for the given
+        ContextMaker. The returned array is equal to
+        `cmaker.recarray(list(yield_event_contexts(flatfile)))`
+        """
+        dd = cmaker.defaultdict.copy()
+        dd['probs_occur'] = np.zeros(0)
+        ra = RecordBuilder(**dd).zeros(len(self))
+        for par in dd:
+            if par in ('probs_occur', 'sids', 'rup_id', 'src_id'):
+                continue  # set below or 0 (as in a new `RuptureContext`)
+            if par == 'clon_clat':
+                ra['clon'] = self._column_or_nan('clon')
+                ra['clat'] = self._column_or_nan('clat')
+            else:
+                ra[par] = self._column_or_nan(par)
+        if cmaker.minimum_distance:
+            for name in cmaker.REQUIRES_DISTANCES:
+                values = ra[name]
+                values[values < cmaker.minimum_distance] = cmaker.minimum_distance
+        ra['sids'] = self.sids
+        return ra
+
+    def _column_or_nan(self, column_name: str) -> np.ndarray | float:
+        try:
+            return self.column(column_name)
+        except MissingColumnError:
+            return np.nan
+
+
 def get_expected_motions(
     gsims: dict[str, GMPE],
     imts: dict[str, imt.IMT],
-    ctx: EventContext
+    ctx: EventContext | Sequence[EventContext] | FlatfileContext,
+    workers: int | None = None,
+    dedup=True,
+    dtype: str | np.dtype | None = None
 ) -> pd.DataFrame:
     """
-    Calculate the expected ground motions from the context
+    Calculate the expected ground motions from the given context(s). When several
+    contexts are given, they are merged into a single recarray and each model is
+    computed once for all of them. For all events of a flatfile, pass a
+    `FlatfileContext`, which builds the merged recarray more efficiently
+
+    :param workers: the number of processes used to compute the models in
+        parallel. None (the default) or any value lower than 2 computes all models
+        sequentially in this process
+    :param dedup: boolean (default True) compute the models only on the
+        records with distinct model inputs (ground motion properties), and copy
+        the results to all duplicated records. The ratio of duplicated records
+        (0: no duplicate) is set in the returned DataFrame
+        `attrs['dedup_ratio']` (see `get_unique_contexts`)
+    :param dtype: the numpy float data type of the returned values, or None (the
+        default: float64). Models are always computed in double precision
+
+    :return: a DataFrame with the context(s) records as rows, in the same order
+        of the input
     """
     data = []
     columns = []
-    cmaker = init_context_maker(gsims, imts, [ctx.mag])
+    # pass magnitudes in order of appearance, so that in case of model errors the
+    # invalid magnitude reported is the first found in `ctx`:
+    if isinstance(ctx, FlatfileContext):
+        cmaker = init_context_maker(gsims, imts, dict.fromkeys(ctx.mag))
+        ctx_recarray = ctx.recarray(cmaker)
+        index = ctx.sids
+    else:
+        ctxs = [ctx] if isinstance(ctx, EventContext) else list(ctx)
+        cmaker = init_context_maker(gsims, imts, dict.fromkeys(c.mag for c in ctxs))
+        ctx_recarray = cmaker.recarray(ctxs)
+        index = ctxs[0].sids.append([c.sids for c in ctxs[1:]])
+    num_records = len(ctx_recarray)
+    inverse = None
+    if dedup:
+        ctx_recarray, inverse = get_unique_contexts(ctx_recarray)
+    gsims_imts = {}
     for gsim_name, gsim in gsims.items():
         # validate SA periods:
         imts_ok = validate_imt_sa_limits(gsim, imts)
-        if not imts_ok:
-            continue
-        imt_names, imt_vals = list(imts_ok.keys()), list(imts_ok.values())
-        mean, total, inter, intra = get_ground_motion_values(
-                gsim, imt_vals, cmaker.recarray([ctx]), model_name=gsim_name
+        if imts_ok:
+            gsims_imts[gsim_name] = imts_ok
+    if workers is not None and workers > 1 and len(gsims_imts) > 1:
+        gm_values = get_ground_motion_values_parallel(
+            {g: (gsims[g], list(i.values())) for g, i in gsims_imts.items()},
+            ctx_recarray,
+            workers
         )
+    else:
+        gm_values = (
+            get_ground_motion_values(
+                gsims[g], list(i.values()), ctx_recarray, model_name=g
+            )
+            for g, i in gsims_imts.items()
+        )
+    for (gsim_name, imts_ok), values in zip(gsims_imts.items(), gm_values):
+        gsim = gsims[gsim_name]
+        imt_names = list(imts_ok.keys())
+        if inverse is not None:  # copy values to duplicated records:
+            values = [v[inverse] for v in values]
+        mean, total, inter, intra = values
         # assign data to our tmp lists:
         columns.extend(product(imt_names, [Clabel.mean], [gsim_name]))
         data.append(mean)
@@ -270,18 +719,57 @@ def get_expected_motions(
             columns.extend((i, Clabel.intra_ev_std, gsim_name) for i in imt_names)
             data.append(intra)
 
-    return pd.DataFrame(
+    expected = pd.DataFrame(
         columns=pd.MultiIndex.from_tuples(columns),
-        data=np.hstack(data),
-        index=ctx.sids
+        data=np.hstack(data).astype(dtype or float, copy=False),
+        index=index
+    )
+    expected.attrs['dedup_ratio'] = (
+        1 - len(ctx_recarray) / num_records if num_records else 0.
     )
+    return expected
+
+
+# context recarray fields that are record identifiers, not model inputs:
+_CTX_ID_FIELDS = ('sids', 'rup_id', 'src_id')
+
+
+def get_unique_contexts(ctx: np.recarray) -> tuple[np.recarray, np.ndarray | None]:
+    """
+    Return the tuple (unique_ctx, inverse) where `unique_ctx` is the context
+    recarray with only the records having distinct model inputs (i.e., the same
+    values for all fields except the records identifiers, such as "sids"), and
+    `inverse` is the array of indices such that `unique_ctx[inverse]` has the same
+    model inputs of `ctx`. If all records are distinct, return `(ctx, None)`
+
+    :param ctx: a context recarray (e.g. output of `ContextMaker.recarray`)
+    """
+    fields = [
+        f for f in ctx.dtype.names
+        if f not in _CTX_ID_FIELDS and ctx.dtype[f].shape == ()
+    ]
+    if len(ctx) < 2 or not fields:
+        return ctx, None
+    # compare records bytes (so that NaNs are considered equal):
+    records = repack_fields(np.asarray(ctx[fields]))
+    records = records.view(np.dtype((np.void, records.dtype.itemsize)))
+    _, indices, inverse = np.unique(records, return_index=True, return_inverse=True)
+    if len(indices) == len(ctx):
+        return ctx, None
+    # keep unique records in order of appearance (`indices` sorted):
+    order = np.argsort(indices)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return ctx[indices[order]], rank[inverse.reshape(-1)]
 
 
 def get_residuals_from_expected_and_observed_motions(
     expected: pd.DataFrame,
     observed: pd.DataFrame,
     normalise=True,
-    return_mean=False
+    return_mean=False,
+    events: np.ndarray | None = None,
+    dtype: str | np.dtype | None = None
 ) -> pd.DataFrame:
     """
     Calculate the residual terms, returning a new DataFrame
@@ -294,56 +782,135 @@ def get_residuals_from_expected_and_observed_motions(
          Abrahamson & Youngs (1992) Eq. 10)
     :param return_mean: boolean (default False) include the predicted values
         (models computed mean) in the dataframe columns
+    :param events: numpy array of integers denoting the event of each row of
+        `expected` (and `observed`). None (the default) means that all rows refer
+        to the same event
+    :param dtype: the numpy float data type of the returned values, or None (the
+        default: float64). Residuals are always computed in double precision
     """
-    residuals: pd.DataFrame = pd.DataFrame(index=expected.index)
     mean_cols = expected.columns[expected.columns.get_level_values(1) == Clabel.mean]
-    for (imtx, label, gsim) in mean_cols:
-        obs = observed.get(imtx)
-        if obs is None:
-            continue
-        mean = expected.get((imtx, Clabel.mean, gsim))
-        if mean is None:
-            continue
-        if return_mean:
-            residuals[(imtx, Clabel.mean, gsim)] = mean
-        # compute total residuals:
-        res_values = obs - mean
-        if normalise:
-            total_stddev = expected.get((imtx, Clabel.total_std, gsim))
-            if total_stddev is None:
-                continue
-            res_values /= total_stddev
-        residuals[(imtx, Clabel.total_res, gsim)] = res_values
-        # compute inter- and intra-event residuals:
-        inter_ev = expected.get((imtx, Clabel.inter_ev_std, gsim))
-        intra_ev = expected.get((imtx, Clabel.intra_ev_std, gsim))
-        if inter_ev is None or intra_ev is None:
-            continue
+    # (imt, model) pairs to process. Imts and models are sorted as in
+    # `harmonize_input_imts` and `harmonize_input_gsims`, respectively:
+    pairs = [(i, g) for (i, _, g) in mean_cols if i in observed.columns]
+    imts = list(harmonize_input_imts({i for i, _ in pairs}))
+    gsims = sorted({g for _, g in pairs})
+    labels = [Clabel.total_res, Clabel.inter_ev_res, Clabel.intra_ev_res]
+    if return_mean:
+        labels += [Clabel.mean]
+    # Allocate the residuals "cube" (records x imts x labels x models) once. The cube
+    # is filled in below, and converted into a DataFrame at the end:
+    cube = np.full(
+        (len(expected), len(imts), len(labels), len(gsims)), np.nan,
+        dtype=dtype or float
+    )
+    computed = np.zeros(cube.shape[1:], dtype=bool)  # which cube column is set
+
+    def fill(label: str, _pairs: list[tuple[str, str]], values: np.ndarray):
+        """Set values (2D array, one column per (imt, gsim) pair) in the cube"""
+        if not _pairs:
+            return
+        i_idx = [imts.index(i) for i, _ in _pairs]
+        g_idx = [gsims.index(g) for _, g in _pairs]
+        cube[:, i_idx, labels.index(label), g_idx] = values
+        computed[i_idx, labels.index(label), g_idx] = True
+
+    def expected_values(label: str, _pairs: list[tuple[str, str]]) -> np.ndarray:
+        """Return the expected values (2D array) of the given label"""
+        return expected[[(i, label, g) for i, g in _pairs]].to_numpy(dtype=float)
+
+    obs_values = observed[[i for i, _ in pairs]].values
+    mean_values = expected_values(Clabel.mean, pairs)
+    if return_mean:
+        fill(Clabel.mean, pairs, mean_values)
+    # compute total residuals:
+    has_total = [
+        not normalise or (i, Clabel.total_std, g) in expected.columns
+        for i, g in pairs
+    ]
+    total_pairs = [p for p, ok in zip(pairs, has_total) if ok]
+    obs_values, mean_values = obs_values[:, has_total], mean_values[:, has_total]
+    res_values = obs_values - mean_values
+    if normalise:
+        res_values /= expected_values(Clabel.total_std, total_pairs)
+    fill(Clabel.total_res, total_pairs, res_values)
+    # compute inter- and intra-event residuals:
+    has_random_effects = [
+        (i, Clabel.inter_ev_std, g) in expected.columns and
+        (i, Clabel.intra_ev_std, g) in expected.columns
+        for i, g in total_pairs
+    ]
+    re_pairs = [p for p, ok in zip(total_pairs, has_random_effects) if ok]
+    if re_pairs:
         inter, intra = _get_random_effects_residuals(
-            obs, mean, inter_ev, intra_ev, normalise
+            obs_values[:, has_random_effects],
+            mean_values[:, has_random_effects],
+            expected_values(Clabel.inter_ev_std, re_pairs),
+            expected_values(Clabel.intra_ev_std, re_pairs),
+            normalise,
+            events
         )
-        residuals[(imtx, Clabel.inter_ev_res, gsim)] = inter
-        residuals[(imtx, Clabel.intra_ev_res, gsim)] = intra
-    return residuals
+        fill(Clabel.inter_ev_res, re_pairs, inter)
+        fill(Clabel.intra_ev_res, re_pairs, intra)
+
+    # build the DataFrame from the computed cube columns only:
+    computed = computed.ravel()
+    columns = [c for c, ok in zip(product(imts, labels, gsims), computed) if ok]
+    return pd.DataFrame(
+        cube.reshape((len(cube), -1))[:, computed],
+        index=expected.index,
+        columns=pd.MultiIndex.from_tuples(columns) if columns else None
+    )
 
 
-def _get_random_effects_residuals(obs, mean, inter, intra, normalise=True):
+def _get_random_effects_residuals(
+    obs: np.ndarray,
+    mean: np.ndarray,
+    inter: np.ndarray,
+    intra: np.ndarray,
+    normalise=True,
+    events: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
     """
     Calculate the random effects residuals using the inter-event
-    residual formula described in Abrahamson & Youngs (1992) Eq. 10
+    residual formula described in Abrahamson & Youngs (1992) Eq. 10.
+    All arrays must have the same shape, either (N, ) or (N, K) (N records and K
+    columns, e.g. the (imt, model) combinations). `events` is an optional array of
+    N integers denoting the event of each record (if None, all records
+    belong to the same event)
     """
-    # TODO this is the only part where grouping by event is relevant: maybe
-    #  move groupby here?
-    nvals = float(len(mean))
-    inter_res = (
-        ((inter ** 2.) * sum(obs - mean)) / (nvals * (inter ** 2.) + (intra ** 2.))
-    )
+    res = obs - mean
+    if events is None:
+        res_sums, nvals = np.sum(res, axis=0), float(len(res))
+    else:
+        res_sums, nvals = _get_event_sums(res, events)
+    inter_res = ((inter ** 2.) * res_sums) / (nvals * (inter ** 2.) + (intra ** 2.))
     intra_res = obs - (mean + inter_res)
     if normalise:
         return inter_res / inter, intra_res / intra
     return inter_res, intra_res
 
 
+def _get_event_sums(
+    values: np.ndarray, events: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the per-event sums of `values` (along the first axis) and the
+    per-event number of records, both broadcast back to each record (row)
+
+    :param values: numpy array of shape (N, ) or (N, K)
+    :param events: numpy array of N integers denoting the event of each row
+    """
+    _, inverse, counts = np.unique(events, return_inverse=True, return_counts=True)
+    # segment sums on rows sorted by event (stable sort keeps the rows order):
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sums = np.add.reduceat(values[order], starts, axis=0)
+    counts = counts.astype(float)
+    if values.ndim > 1:
+        counts = counts.reshape((-1,) + (1,) * (values.ndim - 1))
+    return sums[inverse], counts[inverse]
+
+
 def get_residuals_likelihood(residuals: pd.DataFrame, inplace=True) -> pd.DataFrame:
     """
     Return the likelihood values for the residuals column found in `residuals`
@@ -354,31 +921,50 @@ def get_residuals_likelihood(residuals: pd.DataFrame, inplace=True) -> pd.DataFr
         and return a copy of it. If False, return a new dataframe with the
         likelihoods only
     """
-    if inplace:
-        likelihoods = residuals.copy()
-    else:
-        likelihoods = pd.DataFrame(index=residuals.index.copy())
-    col_list = list(residuals.columns)
     residuals_columns = {
         Clabel.total_res: Clabel.total_lh,
         Clabel.inter_ev_res: Clabel.inter_ev_lh,
         Clabel.intra_ev_res: Clabel.intra_ev_lh
     }
-    for col in col_list:
-        (imtx, label, gsim) = col
+    positions, lh_columns = [], []
+    for pos, (imtx, label, gsim) in enumerate(residuals.columns):
         lh_label = residuals_columns.get(label, None)
         if lh_label is not None:
-            likelihoods[(imtx, lh_label, gsim)] = get_likelihood(residuals[col])
+            positions.append(pos)
+            lh_columns.append((imtx, lh_label, gsim))
+    # compute all likelihoods at once on a 2D block (a copy of the residuals, with
+    # the same float precision):
+    values = residuals.iloc[:, positions].to_numpy(copy=True)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(float)
+    likelihoods = pd.DataFrame(
+        get_likelihood(values, out=values),
+        index=residuals.index.copy(),
+        columns=pd.MultiIndex.from_tuples(lh_columns) if lh_columns else None
+    )
+    if inplace:
+        return pd.concat([residuals, likelihoods], axis=1)
     return likelihoods
 
 
-def get_likelihood(values: np.ndarray | pd.Series) -> np.ndarray | pd.Series:
+def get_likelihood(
+    values: np.ndarray | pd.Series, out: np.ndarray | None = None
+) -> np.ndarray | pd.Series:
     """
     Return the likelihood of the given values according to
     Equation 9 of Scherbaum et al. (2004)
+
+    :param out: numpy array or None (the default) where the likelihood is written,
+        e.g. `values` itself for in-place computation. If given, `values` must be
+        a numpy array with the same shape as `out`
     """
-    zvals = np.fabs(values)
-    return 1.0 - erf(zvals / sqrt(2.))
+    if out is None:
+        zvals = np.fabs(values)
+        return 1.0 - erf(zvals / sqrt(2.))
+    np.fabs(values, out=out)
+    np.divide(out, sqrt(2.), out=out)
+    erf(out, out=out)
+    return np.subtract(1.0, out, out=out)
 
 
 # utilities:
@@ -424,7 +1010,10 @@ def get_station_id_column_names(flatfile: pd.DataFrame) -> list[str]:
 
 
 def get_flatfile_for_residual_analysis(
-    flatfile: pd.DataFrame, gsims: Collection[GMPE], imts: Collection[str]
+    flatfile: pd.DataFrame,
+    gsims: Collection[GMPE],
+    imts: Collection[str],
+    sa_spectrum: SaSpectrum | None = None
 ) -> pd.DataFrame:
     """
     Return a new dataframe with all columns required to compute residuals
@@ -437,7 +1026,7 @@ def get_flatfile_for_residual_analysis(
     # concat all new dataframes in this list, then return a new one from it:
     new_dataframes = []
     # prepare the flatfile for the required imts:
-    imts_flatfile = get_required_imts(flatfile, imts)
+    imts_flatfile = get_required_imts(flatfile, imts, sa_spectrum)
     if not imts_flatfile.empty:
         new_dataframes.append(imts_flatfile)
     # prepare the flatfile for the required ground motion properties:
@@ -451,11 +1040,18 @@ def get_flatfile_for_residual_analysis(
     return pd.concat(new_dataframes, axis=1)
 
 
-def get_required_imts(flatfile: pd.DataFrame, imts: Collection[str]) -> pd.DataFrame:
+def get_required_imts(
+    flatfile: pd.DataFrame,
+    imts: Collection[str],
+    sa_spectrum: SaSpectrum | None = None
+) -> pd.DataFrame:
     """
     Return a new dataframe with all columns required to compute residuals
     for the given intensity measures (`imts`) given with
     periods, when needed (e.g. "SA(0.2)")
+
+    :param sa_spectrum: the SA spectrum of the flatfile records, used to
+        interpolate SA periods not found in the flatfile (see `get_required_sa`)
     """
     # concat all new dataframes in this list, then return a new one from it:
     new_dataframes = []
@@ -471,7 +1067,7 @@ def get_required_imts(flatfile: pd.DataFrame, imts: Collection[str]) -> pd.DataF
         new_dataframes.append(flatfile[sorted(non_sa_imts)])
     # prepare the flatfile for SA (create new columns by interpolation if necessary):
     if sa_imts:
-        sa_dataframe = get_required_sa(flatfile, sa_imts)
+        sa_dataframe = get_required_sa(flatfile, sa_imts, sa_spectrum)
         if not sa_dataframe.empty:
             new_dataframes.append(sa_dataframe)
     if not new_dataframes:
@@ -479,7 +1075,11 @@ def get_required_imts(flatfile: pd.DataFrame, imts: Collection[str]) -> pd.DataF
     return pd.concat(new_dataframes, axis=1)
 
 
-def get_required_sa(flatfile: pd.DataFrame, sa_imts: Iterable[str]) -> pd.DataFrame:
+def get_required_sa(
+    flatfile: pd.DataFrame,
+    sa_imts: Iterable[str],
+    sa_spectrum: SaSpectrum | None = None
+) -> pd.DataFrame:
     """
     Return a new Dataframe with the SA columns defined in `sa_imts`
     The returned DataFrame will have all strings supplied in `sa_imts` as columns,
@@ -487,15 +1087,14 @@ def get_required_sa(flatfile: pd.DataFrame, sa_imts: Iterable[str]) -> pd.DataFr
 
     :param flatfile: the flatfile
     :param sa_imts: Iterable of strings denoting SA (e.g. "SA(0.2)")
+    :param sa_spectrum: the SA spectrum of (at least) all flatfile records, used
+        for interpolation. None (the default) will compute it from `flatfile`, if
+        needed. Passing a precomputed spectrum avoids to compute it on each call
     Return the newly created Sa columns, as tuple of strings
     """
     new_flatfile = pd.DataFrame(index=flatfile.index)
 
-    source_periods: dict[float, str] = {}  # period [float] -> IMT name (str)
-    for c in flatfile.columns:
-        p = sa_period(c)
-        if p is not None:
-            source_periods[p] = c
+    source_periods = get_sa_columns(flatfile)  # period [float] -> IMT name (str)
 
     target_periods: dict[float, str] = {}  # period [float] -> IMT name (str)
     invalid_sa = []
@@ -512,32 +1111,126 @@ def get_required_sa(flatfile: pd.DataFrame, sa_imts: Iterable[str]) -> pd.DataFr
         raise ColumnDataError(*invalid_sa)
 
     if target_periods:  # need to find some SA by interpolation (row-wise)
-
-        # check we can interpolate:
-        if set(target_periods) - set(source_periods):  # interpolation needed
-            if len(source_periods) < 2:
-                raise MissingColumnError(f'SA(period_in_s) '
-                                         f'(columns found: {len(source_periods)}, '
-                                         f'at least two are required)')
-
-        # sort source periods:
-        source_periods = {p: source_periods[p] for p in sorted(source_periods.keys())}
-        # Take the log10 of all SA in the source flatfile:
-        source_spectrum = np.log10(flatfile[list(source_periods.values())])
-        # build the interpolation function:
-        interp = interp1d(list(source_periods), source_spectrum, axis=1)
+        if sa_spectrum is None:
+            sa_spectrum = SaSpectrum.from_flatfile(flatfile)
+        elif not sa_spectrum.index.equals(flatfile.index):
+            sa_spectrum = sa_spectrum.loc(flatfile.index)
         # sort target periods
         target_periods = {p: target_periods[p] for p in sorted(target_periods.keys())}
-        # interpolate using the created function `interp`:
-        values = 10 ** interp(list(target_periods))
-        # values is a matrix where each column represents the values of the
-        # target period. Add it to the dataframe:
+        # interpolate. values is a matrix where each column represents the values
+        # of the target period. Add it to the dataframe:
+        values = sa_spectrum.interpolate(list(target_periods))
         new_flatfile[list(target_periods.values())] = values
 
     # return dataframe with sorted periods (for safety):
     return new_flatfile[sorted(new_flatfile.columns, key=sa_period)]
 
 
+def get_sa_columns(flatfile: pd.DataFrame) -> dict[float, str]:
+    """
+    Return the SA columns of the given flatfile, as dict of periods (float)
+    mapped to the relative column name, sorted by period ascending
+    """
+    source_periods: dict[float, str] = {}  # period [float] -> IMT name (str)
+    for c in flatfile.columns:
+        p = sa_period(c)
+        if p is not None:
+            source_periods[p] = c
+    return {p: source_periods[p] for p in sorted(source_periods)}
+
+
+class SaSpectrum:
+    """
+    The Spectral Acceleration (SA) spectrum of some flatfile records, used to
+    interpolate SA values at any period (linearly on the log10 of the SA).
+    The sorted source periods and the matrix of log10 SA values are computed once,
+    so that a SaSpectrum can be cached and used for several interpolations
+    """
+
+    def __init__(self, periods: np.ndarray, log_values: np.ndarray, index: pd.Index):
+        """
+        Initialize a new SaSpectrum
+
+        :param periods: 1-D array of sorted SA periods (length P)
+        :param log_values: 2-D array of shape (N, P) of log10 SA values, where
+            N is the number of records
+        :param index: the records index (e.g. the source flatfile index)
+        """
+        self.periods = periods
+        self.log_values = log_values
+        self.index = index
+
+    @classmethod
+    def from_flatfile(cls, flatfile: pd.DataFrame) -> SaSpectrum:
+        """
+        Return a new SaSpectrum from the SA columns of the given flatfile,
+        raising `MissingColumnError` if less than two SA columns are found
+        """
+        source_periods = get_sa_columns(flatfile)
+        if len(source_periods) < 2:
+            raise MissingColumnError(f'SA(period_in_s) '
+                                     f'(columns found: {len(source_periods)}, '
+                                     f'at least two are required)')
+        return cls(
+            np.array(list(source_periods), dtype=float),
+            np.log10(flatfile[list(source_periods.values())].to_numpy(dtype=float)),
+            flatfile.index
+        )
+
+    @classmethod
+    def from_dataframe(cls, dataframe: pd.DataFrame) -> SaSpectrum:
+        """
+        Return a new SaSpectrum from the given DataFrame, as output from
+        `self.to_dataframe`
+        """
+        return cls(
+            dataframe.columns.to_numpy(dtype=float),
+            dataframe.to_numpy(dtype=float),
+            dataframe.index
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Return this object as DataFrame with the records as rows, the periods
+        (float) as columns, and the log10 SA values as data (e.g. for storage)
+        """
+        return pd.DataFrame(self.log_values, index=self.index, columns=self.periods)
+
+    @property
+    def nbytes(self) -> int:
+        """Return the size in bytes of this object data"""
+        return self.log_values.nbytes + self.periods.nbytes + self.index.nbytes
+
+    def loc(self, index: pd.Index) -> SaSpectrum:
+        """Return a new SaSpectrum with the records of the given index only"""
+        return SaSpectrum(
+            self.periods, self.log_values[self.index.get_indexer(index)], index
+        )
+
+    def interpolate(self, periods: Sequence[float]) -> np.ndarray:
+        """
+        Interpolate the SA at the given periods and return the SA values in a
+        matrix of shape (N, len(periods)), where N is the number of records.
+        Raise `ColumnDataError` if any period is outside the source periods range
+        """
+        periods = np.asarray(periods, dtype=float)
+        source_periods = self.periods
+        out_of_range = (periods < source_periods[0]) | (periods > source_periods[-1])
+        if out_of_range.any():
+            raise ColumnDataError(*[
+                f'SA({p}) (period outside the flatfile SA periods range '
+                f'[{source_periods[0]}, {source_periods[-1]}])'
+                for p in periods[out_of_range]
+            ])
+        # find the index of the lower source period for each target period:
+        lo = np.searchsorted(source_periods, periods, side='left') - 1
+        lo = np.clip(lo, 0, len(source_periods) - 2)
+        x_lo, x_hi = source_periods[lo], source_periods[lo + 1]
+        y_lo, y_hi = self.log_values[:, lo], self.log_values[:, lo + 1]
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        return 10 ** (y_lo + slope * (periods - x_lo))
+
+
 def get_required_ground_motion_properties(
     flatfile: pd.DataFrame, gsims: Iterable[GMPE]
 ) -> pd.DataFrame:
@@ -547,15 +1240,7 @@ def get_required_ground_motion_properties(
     properties required by the passed models
     """
     required_props_flatfile = pd.DataFrame(index=flatfile.index)
-    required_props = ground_motion_properties_required_by(*gsims)
-
-    # REQUIRES_DISTANCES is empty when gsims = [FromFile]: in this case, add a
-    # default 'rrup' (see openquake,hazardlib.contexts.ContextMaker.__init__):
-    if (
-        'rrup' not in required_props and
-        any(len(g.REQUIRES_DISTANCES) == 0 for g in gsims)
-    ):
-        required_props |= {'rrup'}
+    required_props = get_required_ground_motion_property_names(gsims)
 
     missing_flatfile_columns = set()
     for p in required_props:
@@ -576,6 +1261,23 @@ def get_required_ground_motion_properties(
     return required_props_flatfile
 
 
+def get_required_ground_motion_property_names(gsims: Iterable[GMPE]) -> set[str]:
+    """
+    Return the names of the ground motion properties required to compute residuals
+    from the given models (`gsim`). See `get_required_ground_motion_properties`
+    """
+    gsims = list(gsims)
+    required_props = ground_motion_properties_required_by(*gsims)
+    # REQUIRES_DISTANCES is empty when gsims = [FromFile]: in this case, add a
+    # default 'rrup' (see openquake,hazardlib.contexts.ContextMaker.__init__):
+    if (
+        'rrup' not in required_props and
+        any(len(g.REQUIRES_DISTANCES) == 0 for g in gsims)
+    ):
+        required_props |= {'rrup'}
+    return required_props
+
+
 DEFAULT_MSR = PeerMSR()
 
 
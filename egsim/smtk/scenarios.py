@@ -1,7 +1,7 @@
 """module for computing ground motion values from different scenarios"""
 
 from itertools import product
-from collections.abc import Collection, Iterable
+from collections.abc import Collection, Iterable, Iterator, Sequence
 from dataclasses import dataclass, field, asdict
 from math import sqrt, pi, sin, cos, fabs
 
@@ -12,12 +12,15 @@ from openquake.hazardlib.gsim.base import GMPE
 from openquake.hazardlib.imt import IMT
 from openquake.hazardlib.scalerel.wc1994 import WC1994
 from openquake.hazardlib.geo import Point, Mesh, PlanarSurface
+from openquake.hazardlib.geo.geodetic import point_at
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.source.rupture import BaseRupture
 from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.contexts import ContextMaker, RecordBuilder, get_distances
 
+from .cache import LRUCache
 from .registry import Clabel
-from .flatfile import column_exists, column_type
+from .flatfile import column_exists, column_type, ColumnType
 from .converters import vs30_to_z1pt0_cy14, vs30_to_z2pt5_cb14
 from .validation import (
     validate_inputs,
@@ -25,7 +28,8 @@ from .validation import (
     init_context_maker,
     harmonize_input_imts,
     validate_imt_sa_limits,
-    get_ground_motion_values
+    get_ground_motion_values,
+    get_ground_motion_values_parallel
 )
 
 
@@ -68,7 +72,11 @@ def get_ground_motion_from_scenarios(
     distances: float | Collection[float],
     rupture_properties: RuptureProperties | None = None,
     site_properties: SiteProperties | None = None,
-    header_sep: str | None = Clabel.sep
+    header_sep: str | None = Clabel.sep,
+    dtype: str | np.dtype | None = None,
+    contexts_cache: LRUCache | None = None,
+    workers: int | None = None,
+    use_threads=True
 ) -> pd.DataFrame:
     """
     Calculate the ground motion values from different configured scenarios
@@ -88,9 +96,60 @@ def get_ground_motion_from_scenarios(
         to "" or None to return a multi-level column header composed of the first 3
         dataframe rows (e.g. ("PGA", "median", "BindiEtAl2014Rjb"). See
         "MultiIndex / advanced indexing" in the pandas doc for details)
+    :param dtype: the numpy float data type of the returned medians and standard
+        deviations (e.g. "float32"), or None (the default: float64). Models are
+        always computed in double precision: with "float32", values are only stored
+        in single precision (relative error lower than 1e-7 with respect to float64
+        outputs) and the output memory usage is almost halved. Input columns (e.g.,
+        magnitude, distances) are always returned in double precision
+    :param contexts_cache: optional cache of the context objects built for each
+        magnitude (see `build_contexts`), so that repeated scenarios skip the
+        rupture and sites geometry computation. None (the default): no cache
+    :param workers: the number of threads or processes used to compute the models
+        in parallel. None (the default) or any value lower than 2 computes all
+        models sequentially in this process
+    :param use_threads: whether to compute models in parallel using threads (True,
+        the default) or processes (False). Ignored if `workers` is not greater than
+        1. See `get_ground_motion_values_parallel` for details
 
     :return: pandas DataFrame
     """
+    return next(iter_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances, rupture_properties, site_properties,
+        header_sep, dtype, contexts_cache, workers, use_threads
+    ))
+
+
+def iter_ground_motion_from_scenarios(
+    gsims: Iterable[str | GMPE],
+    imts: Iterable[str | IMT],
+    magnitudes: float | Collection[float],
+    distances: float | Collection[float],
+    rupture_properties: RuptureProperties | None = None,
+    site_properties: SiteProperties | None = None,
+    header_sep: str | None = Clabel.sep,
+    dtype: str | np.dtype | None = None,
+    contexts_cache: LRUCache | None = None,
+    workers: int | None = None,
+    use_threads=True,
+    max_records: int | None = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Same as `get_ground_motion_from_scenarios`, but yield the ground motion values
+    in chunks (pandas DataFrames) of at most `max_records` rows each, so that the
+    contexts and values of all scenarios never need to be stored in memory.
+    Scenarios are grouped by magnitude (i.e., each chunk has all distances of one
+    or more consecutive magnitudes), thus a chunk might have more than
+    `max_records` rows only if the number of distances does. All chunks have the
+    same columns, and their concatenation is equal to the output of
+    `get_ground_motion_from_scenarios`. Note that inputs are validated (and any
+    error raised) before the first chunk is yielded
+
+    :param max_records: int or None (the default): the maximum number of
+        records (rows) per chunk. None or non-positive values yield a single chunk
+
+    For all other parameters, see `get_ground_motion_from_scenarios`
+    """
     gsims = harmonize_input_gsims(gsims)
     imts = harmonize_input_imts(imts)
     validate_inputs(gsims, imts)
@@ -102,52 +161,336 @@ def get_ground_motion_from_scenarios(
     if not distances.shape:   # convert to a 1-length array if scalar:
         distances = distances.reshape(1,)
 
-    # Get the context objects as a numpy recarray
     if rupture_properties is None:
         rupture_properties = RuptureProperties()
     if site_properties is None:
         site_properties = SiteProperties()
+
+    num_mags = max(len(magnitudes), 1)
+    if max_records is not None and max_records > 0:
+        num_mags = max(1, max_records // max(len(distances), 1))
+    if num_mags < len(magnitudes):
+        # validate all magnitudes now (see `init_context_maker`):
+        init_context_maker(
+            gsims, imts, magnitudes, tectonic_region=rupture_properties.tectonic_region
+        )
+    # compute chunks (lazily):
+    return (
+        _get_ground_motion_from_scenarios(
+            gsims, imts, magnitudes[start: start + num_mags], distances,
+            rupture_properties, site_properties, header_sep, dtype, contexts_cache,
+            workers, use_threads, start * len(distances)
+        )
+        for start in range(0, max(len(magnitudes), 1), num_mags)
+    )
+
+
+def _get_ground_motion_from_scenarios(
+    gsims: dict[str, GMPE],
+    imts: dict[str, IMT],
+    magnitudes: np.ndarray,
+    distances: np.ndarray,
+    rupture_properties: RuptureProperties,
+    site_properties: SiteProperties,
+    header_sep: str | None,
+    dtype: str | np.dtype | None,
+    contexts_cache: LRUCache | None,
+    workers: int | None,
+    use_threads: bool,
+    index_start: int
+) -> pd.DataFrame:
+    # Get the context objects as a numpy recarray
     ctxts = build_contexts(
-        gsims, imts, magnitudes, distances, rupture_properties, site_properties
+        gsims, imts, magnitudes, distances, rupture_properties, site_properties,
+        contexts_cache
+    )
+    return _get_ground_motion_from_contexts(
+        gsims, imts, ctxts, header_sep, dtype, workers, use_threads, index_start
     )
 
-    # Get the ground motion values
-    data = []
-    columns = []
+
+def get_ground_motion_from_batch_scenarios(
+    gsims: Iterable[str | GMPE],
+    imts: Iterable[str | IMT],
+    magnitudes: float | Collection[float],
+    distances: float | Collection[float],
+    scenarios: Sequence[tuple[RuptureProperties | None, SiteProperties | None]],
+    header_sep: str | None = Clabel.sep,
+    dtype: str | np.dtype | None = None,
+    contexts_cache: LRUCache | None = None,
+    workers: int | None = None,
+    use_threads=True
+) -> pd.DataFrame:
+    """
+    Same as `get_ground_motion_from_scenarios` for several scenarios, each defined
+    by its own Rupture and Site properties and by the given magnitudes and
+    distances. The context objects of all scenarios are merged into a single
+    recarray, so that models are initialized and computed once for all scenarios.
+    The returned DataFrame has the rows of each scenario, in the same order of
+    `scenarios`, and the additional input column "scenario_id" denoting the
+    scenario position in `scenarios` (0 for the first scenario)
+
+    :param scenarios: sequence of tuples (rupture_properties, site_properties)
+        (see `get_ground_motion_from_scenarios`). None values denote default
+        properties
+
+    For all other parameters, see `get_ground_motion_from_scenarios`
+    """
+    gsims = harmonize_input_gsims(gsims)
+    imts = harmonize_input_imts(imts)
+    validate_inputs(gsims, imts)
+
+    magnitudes = np.asarray(magnitudes)
+    if not magnitudes.shape:  # convert to a 1-length array if scalar:
+        magnitudes = magnitudes.reshape(1,)
+    distances = np.asarray(distances)
+    if not distances.shape:   # convert to a 1-length array if scalar:
+        distances = distances.reshape(1,)
+
+    cmakers = {}  # tectonic region -> ContextMaker (shared across scenarios)
+    ctxts = []
+    for rupture_properties, site_properties in scenarios:
+        if rupture_properties is None:
+            rupture_properties = RuptureProperties()
+        if site_properties is None:
+            site_properties = SiteProperties()
+        trt = rupture_properties.tectonic_region
+        if trt not in cmakers:
+            cmakers[trt] = init_context_maker(
+                gsims, imts, magnitudes, tectonic_region=trt
+            )
+        ctxts.append(build_contexts(
+            gsims, imts, magnitudes, distances, rupture_properties, site_properties,
+            contexts_cache, cmakers[trt]
+        ))
+    scenario_ids = np.repeat(np.arange(len(ctxts)), [len(c) for c in ctxts])
+    return _get_ground_motion_from_contexts(
+        gsims, imts, np.hstack(ctxts).view(np.recarray), header_sep, dtype,
+        workers, use_threads, scenario_ids=scenario_ids
+    )
+
+
+def get_ground_motion_on_grid(
+    gsims: Iterable[str | GMPE],
+    imts: Iterable[str | IMT],
+    magnitudes: float | Collection[float],
+    bbox: tuple[float, float, float, float],
+    resolution: float,
+    rupture_properties: RuptureProperties | None = None,
+    site_properties: SiteProperties | None = None,
+    header_sep: str | None = Clabel.sep,
+    dtype: str | np.dtype | None = None,
+    workers: int | None = None,
+    use_threads=True
+) -> pd.DataFrame:
+    """
+    Calculate the ground motion values on a regular geographic grid of sites
+    (ground motion map) for each given magnitude. Sites are built as arrays (no
+    per-site Python object), their distances from each Rupture are computed for
+    all grid nodes at once, and models are computed once for all magnitudes and
+    grid nodes.
+    The returned DataFrame has one row per magnitude and grid node: rows are
+    sorted by magnitude, then latitude, then longitude, so that the values of each
+    column can be reshaped into an array of shape
+    `(len(magnitudes), len(latitudes), len(longitudes))` (see `grid_coordinates`).
+    The grid nodes coordinates are returned in the input columns
+    "station_longitude" and "station_latitude". Grid nodes farther than the models
+    maximum distance (1000 km) from a Rupture have no predictions (NaN medians and
+    standard deviations, whereas input columns are always set)
+
+    :param magnitudes: list or numpy array of magnitudes. Each magnitude
+        defines a configured Rupture
+    :param bbox: the grid bounding box, as tuple of 4 floats:
+        (min_longitude, min_latitude, max_longitude, max_latitude)
+    :param resolution: the grid step, in degrees (both in longitude and latitude)
+    :param site_properties: the optional Site properties (see class
+        SiteProperties) to be applied to each grid node. Properties defining
+        the location of the Sites (e.g. `line_azimuth`, `distance_type`) are ignored
+
+    For all other parameters, see `get_ground_motion_from_scenarios`
+    """
+    gsims = harmonize_input_gsims(gsims)
+    imts = harmonize_input_imts(imts)
+    validate_inputs(gsims, imts)
+
+    magnitudes = np.asarray(magnitudes)
+    if not magnitudes.shape:  # convert to a 1-length array if scalar:
+        magnitudes = magnitudes.reshape(1,)
+
+    if rupture_properties is None:
+        rupture_properties = RuptureProperties()
+    if site_properties is None:
+        site_properties = SiteProperties()
+
+    lons, lats = grid_coordinates(bbox, resolution)
+    lons, lats = [c.ravel() for c in np.meshgrid(lons, lats)]
+    site_params = get_site_parameters(site_properties)
+
+    cmaker = init_context_maker(
+        gsims, imts, magnitudes, tectonic_region=rupture_properties.tectonic_region
+    )
+    ctxts = np.hstack([
+        build_grid_context(
+            cmaker, i, magnitude, lons, lats, rupture_properties, site_params
+        )
+        for i, magnitude in enumerate(magnitudes)
+    ]).view(np.recarray)
+    # compute models only on the grid nodes within the maximum distance:
+    max_distances = [cmaker.maximum_distance(m) for m in ctxts['mag'][::len(lons)]]
+    computed = ctxts['rrup'] <= np.repeat(max_distances, len(lons))
+    output = _get_ground_motion_from_contexts(
+        gsims, imts, ctxts, None, dtype, workers, use_threads, computed=computed
+    )
+    site_type = str(ColumnType.site.value)
+    for col, values in (('station_longitude', lons), ('station_latitude', lats)):
+        output[(Clabel.input, site_type, col)] = np.tile(values, len(magnitudes))
+    if header_sep:
+        output.columns = [header_sep.join(c) for c in output.columns]
+    return output
+
+
+def grid_coordinates(
+    bbox: tuple[float, float, float, float], resolution: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the coordinates of a regular geographic grid as the tuple of numpy
+    arrays (longitudes, latitudes), both starting from the bounding box lower left
+    corner and spaced by `resolution` (in degrees)
+
+    :param bbox: tuple of 4 floats:
+        (min_longitude, min_latitude, max_longitude, max_latitude)
+    :param resolution: the grid step, in degrees
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if not resolution > 0:
+        raise ValueError('Grid resolution must be positive')
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError('Invalid grid bounding box (min greater than max)')
+    coords = []
+    for min_val, max_val in ((min_lon, max_lon), (min_lat, max_lat)):
+        # (1e-9: avoid discarding the bbox max because of rounding errors)
+        num = int(np.floor((max_val - min_val) / resolution + 1e-9)) + 1
+        coords.append(min_val + resolution * np.arange(num))
+    return coords[0], coords[1]
+
+
+def build_grid_context(
+    cmaker: ContextMaker,
+    index: int,
+    magnitude: float,
+    lons: np.ndarray,
+    lats: np.ndarray,
+    r_props: RuptureProperties,
+    site_params: dict[str, float]
+) -> np.recarray:
+    """
+    Build the context objects of the given magnitude and grid nodes (sites at
+    zero depth) and return them as a numpy recarray of length `len(lons)`. Unlike
+    `build_context`, sites beyond the maximum distance of `cmaker` are not
+    discarded (see `build_context_from_arrays` for details)
+
+    :param site_params: dict of site parameters (e.g. "vs30") mapped to their
+        value (see `get_site_parameters`)
+    """
+    surface, hypocenter = create_planar_surface_and_hypocenter(magnitude, r_props)
+    rupture = create_rupture(
+        index, magnitude, r_props.rake, r_props.tectonic_region, hypocenter, surface
+    )
+    rec_array = build_context_from_arrays(
+        cmaker, rupture, lons, lats, np.zeros(len(lons)), site_params,
+        filter_sites=False
+    )
+    rec_array["occurrence_rate"] = 0.0  # only needed in PSHA calculation
+    return rec_array
+
+
+def _get_ground_motion_from_contexts(
+    gsims: dict[str, GMPE],
+    imts: dict[str, IMT],
+    ctxts: np.recarray,
+    header_sep: str | None,
+    dtype: str | np.dtype | None,
+    workers: int | None,
+    use_threads: bool,
+    index_start: int = 0,
+    scenario_ids: np.ndarray | None = None,
+    computed: np.ndarray | None = None
+) -> pd.DataFrame:
+    """
+    Compute the ground motion values of the given context recarray, returning
+    the output DataFrame of `get_ground_motion_from_scenarios`. If `scenario_ids`
+    is given, it is appended as input column "scenario_id". If `computed` (boolean
+    array) is given, models are computed only on the contexts where it is True:
+    the ground motion values of all other contexts are NaN
+    """
+    gsims_imts = {}
     for gsim_name, gsim in gsims.items():
+        # validate SA periods:
         imts_ok = validate_imt_sa_limits(gsim, imts)
-        if not imts_ok:
-            continue
-        imt_names, imt_vals = list(imts_ok.keys()), list(imts_ok.values())
-        median, sigma, tau, phi = get_ground_motion_values(
-            gsim, imt_vals, ctxts, model_name=gsim_name
-        )
-        data.append(median)
-        columns.extend((i, Clabel.median, gsim_name) for i in imt_names)
-        data.append(sigma)
-        columns.extend((i, Clabel.std, gsim_name) for i in imt_names)
+        if imts_ok:
+            gsims_imts[gsim_name] = imts_ok
 
     # get interesting fields (only those registered in flatfile):
     meta_fields = [c for c in ctxts.dtype.names if column_exists(c)]
+    meta_columns = [(Clabel.input, str(column_type(m).value), m) for m in meta_fields]
 
-    # get the matrix of data (stack the scalar fields into a 2D NumPy array):
-    meta_data = np.column_stack([ctxts[name] for name in meta_fields])
+    # sort columns (maybe we could use reindex but let's be more explicit):
+    computed_cols = {
+        (i, label, g) for g, imts_ok in gsims_imts.items() for i in imts_ok
+        for label in (Clabel.median, Clabel.std)
+    }
+    columns = [
+        c for c in product(imts, [Clabel.median, Clabel.std], gsims)
+        if c in computed_cols
+    ]
+    col_index = {c: i for i, c in enumerate(columns)}
 
-    # build our dataframe data (horizontal concat data + meta_data into data):
-    data.append(meta_data)
-    # build our dataframe columns (append the meta_data columns from meta_columns):
-    meta_columns = [(Clabel.input, str(column_type(m).value), m) for m in meta_fields]
-    columns.extend(meta_columns)
+    # preallocate the output values, filled below column by column (use Fortran
+    # order because pandas stores the columns of a 2D array as rows). Input
+    # columns are not converted to `dtype`:
+    data = np.empty((len(ctxts), len(columns)), dtype=dtype or float, order='F')
+    meta_data = np.empty((len(ctxts), len(meta_columns)), dtype=float, order='F')
+    rows, ctxts_c, gsims_imts_c = slice(None), ctxts, gsims_imts
+    if computed is not None:  # compute only some contexts (rows), the rest is NaN:
+        data[:] = np.nan
+        rows, ctxts_c = computed, ctxts[computed]
+        if not len(ctxts_c):
+            gsims_imts_c = {}
 
-    # compute final DataFrame:
-    output = pd.DataFrame(columns=columns, data=np.hstack(data))
+    # Get the ground motion values
+    if workers is not None and workers > 1 and len(gsims_imts_c) > 1:
+        gm_values = get_ground_motion_values_parallel(
+            {g: (gsims[g], list(i.values())) for g, i in gsims_imts_c.items()},
+            ctxts_c,
+            workers,
+            use_threads
+        )
+    else:
+        gm_values = (
+            get_ground_motion_values(gsims[g], list(i.values()), ctxts_c, model_name=g)
+            for g, i in gsims_imts_c.items()
+        )
+    for (gsim_name, imts_ok), values in zip(gsims_imts_c.items(), gm_values):
+        median, sigma = values[:2]
+        for j, imt_name in enumerate(imts_ok):
+            data[rows, col_index[(imt_name, Clabel.median, gsim_name)]] = median[:, j]
+            data[rows, col_index[(imt_name, Clabel.std, gsim_name)]] = sigma[:, j]
 
-    # sort columns (maybe we could use reindex but let's be more explicit):
-    computed_cols = set(output.columns)
-    expected_cols = (
-        list(product(imts, [Clabel.median, Clabel.std], gsims)) + meta_columns
-    )
-    output = output[[c for c in expected_cols if c in computed_cols]].copy()
+    for j, meta_field in enumerate(meta_fields):
+        meta_data[:, j] = ctxts[meta_field]
+
+    # compute final DataFrame:
+    index = pd.RangeIndex(index_start, index_start + len(data))
+    output = pd.concat([
+        pd.DataFrame(columns=columns, data=data, index=index, copy=False),
+        pd.DataFrame(columns=meta_columns, data=meta_data, index=index, copy=False)
+    ], axis=1)
+    if scenario_ids is not None:
+        output.insert(
+            len(columns) + len(meta_columns),
+            (Clabel.input, Clabel.uncategorized_input, Clabel.scenario_id),
+            scenario_ids
+        )
     if header_sep:
         output.columns = [header_sep.join(c) for c in output.columns]
     else:
@@ -161,7 +504,9 @@ def build_contexts(
     magnitudes: Collection[float],
     distances: Collection[float],
     r_props: RuptureProperties,
-    s_props: SiteProperties
+    s_props: SiteProperties,
+    cache: LRUCache | None = None,
+    cmaker: ContextMaker | None = None
 ) -> np.recarray:
     """
     Build the context objects from the set of magnitudes and distances and
@@ -173,55 +518,232 @@ def build_contexts(
     :param distances: the distances
     :param r_props: a `RuptureContext` object defining the Rupture properties
     :param s_props: a `SiteProperties` object defining the Site properties
+    :param cache: optional cache where the context objects of each magnitude are
+        stored and retrieved (see `contexts_cache_key`). None (the default): no cache
+    :param cmaker: the `ContextMaker` used to build the contexts, or None (the
+        default): build it from the given models, magnitudes and rupture tectonic
+        region
 
     :return: Context objects in the form of a single numpy recarray of length:
-        len(magnitudes) * len(distances)
+        len(magnitudes) * len(distances). The field "rup_id" is the index of the
+        context magnitude in `magnitudes`
     """
-    cmaker = init_context_maker(
-        gsims,
-        imts,
-        magnitudes,
-        tectonic_region=r_props.tectonic_region
-    )
+    if cmaker is None:
+        cmaker = init_context_maker(
+            gsims,
+            imts,
+            magnitudes,
+            tectonic_region=r_props.tectonic_region
+        )
+    key = None
+    if cache is not None:
+        key = contexts_cache_key(cmaker, distances, r_props, s_props)
     ctxts = []
     for i, magnitude in enumerate(magnitudes):
-        area = r_props.msr.get_median_area(magnitude, r_props.rake)
-        surface = create_planar_surface(
-            r_props.initial_point,
-            r_props.strike,
-            r_props.dip,
-            area,
-            r_props.aspect,
-            r_props.ztor
+        rec_array = None if key is None else cache.get((float(magnitude), key))
+        if rec_array is None:
+            rec_array = build_context(
+                cmaker, i, magnitude, distances, r_props, s_props
+            )
+            if key is not None:
+                cache.put((float(magnitude), key), rec_array)
+        elif rec_array['rup_id'][0] != i:
+            # cached with a different magnitude index: copy (the cached value must
+            # not be modified) and set the current index as rupture id:
+            rec_array = rec_array.copy()
+            rec_array['rup_id'] = i
+        ctxts.append(rec_array)
+
+    # Convert to recarray (new array, so cached values are never modified):
+    return np.hstack(ctxts).view(np.recarray)
+
+
+def build_context(
+    cmaker: ContextMaker,
+    index: int,
+    magnitude: float,
+    distances: Collection[float],
+    r_props: RuptureProperties,
+    s_props: SiteProperties
+) -> np.recarray:
+    """
+    Build the context objects of the given magnitude and distances and return
+    them as a numpy recarray of length `len(distances)` (see `build_contexts`)
+    """
+    surface, hypocenter = create_planar_surface_and_hypocenter(magnitude, r_props)
+    rupture = create_rupture(
+        index, magnitude, r_props.rake, r_props.tectonic_region, hypocenter, surface
+    )
+    if fast_context_supported(cmaker, len(distances)):
+        lons, lats, depths = site_locations_at_distance(
+            hypocenter, surface, distances, s_props.line_azimuth,
+            s_props.origin_point, s_props.distance_type
         )
-        hypocenter = get_hypocentre_on_planar_surface(
-            surface, r_props.hypocenter_location
+        rec_array = build_context_from_arrays(
+            cmaker, rupture, lons, lats, depths, get_site_parameters(s_props)
         )
+    else:
         target_sites = get_target_sites(
             hypocenter, surface, distances, **asdict(s_props)
         )
-        rupture = create_rupture(
-            i, magnitude, r_props.rake, r_props.tectonic_region, hypocenter, surface
-        )
-
         # oqp = {'imtls': {k: [] for k in [str(imt)]}, 'mags': mag_str}
         # ctxm = ContextMaker(rup.tectonic_region_type, [gmpe], oqp)
         ctxs = list(cmaker.get_ctx_iter([rupture], target_sites))
         rec_array = cmaker.recarray(ctxs)
 
-        if s_props.distance_type == 'rrup':
-            rec_array.rrup = distances.copy()
-        # ctx = cmaker.get_ctx(
-        #     rupture,
-        #     target_sites,
-        #     distances=distances if s_props.distance_type == 'rrup' else None
-        # )
-        # rec_array = cmaker.recarray([ctx])
-        rec_array["occurrence_rate"] = 0.0  # only needed in PSHA calculation
-        ctxts.append(rec_array)
+    if s_props.distance_type == 'rrup':
+        rec_array.rrup = np.asarray(distances)[rec_array.sids]
+    # ctx = cmaker.get_ctx(
+    #     rupture,
+    #     target_sites,
+    #     distances=distances if s_props.distance_type == 'rrup' else None
+    # )
+    # rec_array = cmaker.recarray([ctx])
+    rec_array["occurrence_rate"] = 0.0  # only needed in PSHA calculation
+    # OpenQuake does not set the rupture id of scenarios (no source), set it here:
+    rec_array["rup_id"] = index
+    return rec_array
 
-    # Convert to recarray:
-    return np.hstack(ctxts).view(np.recarray)
+
+def fast_context_supported(cmaker: ContextMaker, num_sites: int) -> bool:
+    """
+    Return whether the context objects of `num_sites` sites can be built with
+    `build_context_from_arrays` (i.e., equal to those built by `cmaker` from
+    OpenQuake `Site` objects). This is not the case if the models of `cmaker`
+    require equivalent distances, closest point coordinates (which OpenQuake
+    computes also when there are few sites, see `cmaker.max_sites_disagg`) or site
+    parameters not defined in `SiteProperties`
+    """
+    if cmaker.reqv or num_sites <= cmaker.max_sites_disagg:
+        return False
+    if {'clon', 'clat'} & set(cmaker.REQUIRES_DISTANCES):
+        return False
+    return set(cmaker.REQUIRES_SITES_PARAMETERS) <= _site_fields
+
+
+def build_context_from_arrays(
+    cmaker: ContextMaker,
+    rupture: BaseRupture,
+    lons: np.ndarray,
+    lats: np.ndarray,
+    depths: np.ndarray,
+    site_params: dict[str, float],
+    filter_sites=True
+) -> np.recarray:
+    """
+    Build the context objects of the given rupture and site locations, and return
+    them as numpy recarray. Same as `cmaker.recarray(cmaker.get_ctx_iter(...))`
+    but faster: the recarray fields (site parameters, distances and rupture
+    parameters) are filled directly from the given arrays, without creating
+    `Site` objects and a `SiteCollection`. Sites beyond the maximum distance of
+    `cmaker` are discarded (see the recarray field "sids" for the index of each
+    site). See `fast_context_supported` to check whether this function can be used
+
+    :param lons: the site longitudes
+    :param lats: the site latitudes
+    :param depths: the site depths
+    :param site_params: dict of site parameters (e.g. "vs30") mapped to their
+        value (see `get_site_parameters`)
+    :param filter_sites: whether to discard the sites beyond the maximum distance
+        of `cmaker` (True, the default). If False, the returned recarray has one
+        element per site
+    """
+    mesh = Mesh(lons, lats, depths)
+    rrup = get_distances(rupture, mesh, 'rrup')
+    mask = np.ones(len(rrup), dtype=bool)
+    if filter_sites:
+        mask = rrup <= cmaker.maximum_distance(rupture.mag)
+    if not mask.all():
+        mesh = Mesh(lons[mask], lats[mask], depths[mask])
+    dd = cmaker.defaultdict.copy()
+    dd['probs_occur'] = np.zeros(0)
+    rec_array = RecordBuilder(**dd).zeros(len(mesh))
+    for par, val in cmaker.get_rparams(rupture).items():
+        rec_array[par] = val
+    rec_array['rrup'] = rrup[mask]
+    for par in set(cmaker.REQUIRES_DISTANCES) - {'rrup', 'clon', 'clat'}:
+        rec_array[par] = get_distances(rupture, mesh, par)
+    if {'clon', 'clat'} & set(cmaker.REQUIRES_DISTANCES):
+        clon_clat = get_distances(rupture, mesh, 'clon_clat')
+        rec_array['clon'], rec_array['clat'] = clon_clat[:, 0], clon_clat[:, 1]
+    if cmaker.minimum_distance:
+        for par in cmaker.REQUIRES_DISTANCES:
+            rec_array[par] = np.maximum(rec_array[par], cmaker.minimum_distance)
+    site_arrays = site_params | {
+        'lon': mesh.lons, 'lat': mesh.lats, 'depth': mesh.depths
+    }
+    for par, val in site_arrays.items():
+        if par in dd:
+            rec_array[par] = val
+    rec_array['sids'] = np.flatnonzero(mask)
+    rec_array['src_id'] = -1  # as OpenQuake does for ruptures without source
+    return rec_array
+
+
+def get_site_parameters(s_props: SiteProperties) -> dict[str, float]:
+    """
+    Return the site parameters from the given Site properties, as dict (see
+    `get_target_sites`)
+    """
+    z1pt0, z2pt5 = s_props.z1pt0, s_props.z2pt5
+    if z1pt0 is None:
+        z1pt0 = vs30_to_z1pt0_cy14(s_props.vs30)
+    if z2pt5 is None:
+        z2pt5 = vs30_to_z2pt5_cb14(s_props.vs30)
+    return {
+        'vs30': s_props.vs30,
+        'vs30measured': s_props.vs30measured,
+        'z1pt0': z1pt0,
+        'z2pt5': z2pt5,
+        'backarc': s_props.backarc,
+        'xvf': s_props.xvf,
+        'region': s_props.region
+    }
+
+
+# The site parameters that can be set on the context objects from `SiteProperties`
+# and the site locations (see `build_context_from_arrays`):
+_site_fields = frozenset(
+    get_site_parameters(SiteProperties())) | {'lon', 'lat', 'depth'}
+
+
+def contexts_cache_key(
+    cmaker: ContextMaker,
+    distances: Collection[float],
+    r_props: RuptureProperties,
+    s_props: SiteProperties
+) -> tuple:
+    """
+    Return the hashable key identifying the context objects built with the given
+    arguments for any magnitude (see `build_contexts`): the key is composed of the
+    rupture and site properties, the distances and the context parameters required
+    by the models of `cmaker`
+    """
+    r_key = asdict(r_props) | {
+        'msr': repr(r_props.msr),
+        # the depth of the initial point is always set to `ztor`:
+        'initial_point': (
+            r_props.initial_point.longitude, r_props.initial_point.latitude
+        )
+    }
+    distances = np.asarray(distances, dtype=float)
+    return (
+        _hashable_items(r_key),
+        _hashable_items(asdict(s_props)),
+        distances.tobytes(),
+        tuple(tuple(sorted(params)) for params in (
+            cmaker.REQUIRES_RUPTURE_PARAMETERS,
+            cmaker.REQUIRES_DISTANCES,
+            cmaker.REQUIRES_SITES_PARAMETERS
+        ))
+    )
+
+
+def _hashable_items(props: dict) -> tuple:
+    """Return the sorted items of `props`, with list values converted to tuple"""
+    return tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in props.items()
+    ))
 
 
 # utilities:
@@ -237,6 +759,29 @@ def create_rupture(
     return rupture
 
 
+def create_planar_surface_and_hypocenter(
+    magnitude: float, r_props: RuptureProperties
+) -> tuple[PlanarSurface, Point]:
+    """
+    Return the tuple (surface, hypocenter) of the Rupture with the given magnitude
+    and properties (see `create_planar_surface` and
+    `get_hypocentre_on_planar_surface`)
+    """
+    area = r_props.msr.get_median_area(magnitude, r_props.rake)
+    surface = create_planar_surface(
+        r_props.initial_point,
+        r_props.strike,
+        r_props.dip,
+        area,
+        r_props.aspect,
+        r_props.ztor
+    )
+    hypocenter = get_hypocentre_on_planar_surface(
+        surface, r_props.hypocenter_location
+    )
+    return surface, hypocenter
+
+
 def create_planar_surface(
     top_centroid: Point,
     strike: float,
@@ -328,37 +873,71 @@ def sites_at_distance(
     Determine the locations of the target sites according to their specified
     distances and distance configuration
     """
+    return [
+        Point(lon, lat, depth) for lon, lat, depth in zip(
+            *site_locations_at_distance(
+                hypocenter, surface, distances, azimuth, origin_point, dist_type
+            )
+        )
+    ]
+
+
+def site_locations_at_distance(
+    hypocenter: Point,
+    surface: PlanarSurface,
+    distances: Iterable[float],
+    azimuth: float,
+    origin_point: tuple[float, float],
+    dist_type: str = "rrup"
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as `sites_at_distance` but return the target sites locations as the
+    tuple of numpy arrays (longitudes, latitudes, depths), computed for all
+    distances at once
+    """
+    distances = np.asarray(distances, dtype=float).reshape(-1)
     azimuth = (surface.get_strike() + azimuth) % 360.
     origin_location = get_hypocentre_on_planar_surface(
         surface, origin_point
     )
     # origin_depth = deepcopy(origin_location.depth)
     origin_location.depth = 0.0
-    locations = []
-    for dist in distances:
-        if dist_type == "repi":
-            locations.append(hypocenter.point_at(dist, 0.0, azimuth))
-        elif dist_type == "rhypo":
-            if dist < hypocenter.depth:
-                raise ValueError(
-                    "Required hypocentral distance %.1f km less than "
-                    "hypocentral depth (%.1f km)" % (dist, hypocenter.depth)
+    depths = np.zeros(len(distances))
+    if dist_type == "repi":
+        lons, lats = point_at(
+            hypocenter.longitude, hypocenter.latitude, azimuth, distances
+        )
+        depths += hypocenter.depth
+    elif dist_type == "rhypo":
+        invalid = distances < hypocenter.depth
+        if invalid.any():
+            raise ValueError(
+                "Required hypocentral distance %.1f km less than "
+                "hypocentral depth (%.1f km)" % (
+                    distances[invalid][0], hypocenter.depth
                 )
-            xdist = sqrt(dist ** 2. - hypocenter.depth ** 2.)
-            locations.append(hypocenter.point_at(xdist, - hypocenter.depth, azimuth))
-        elif dist_type == "rjb":
-            locations.append(
-                _rup_to_point(dist, surface, origin_location, azimuth, 'rjb')
             )
-        elif dist_type == "rrup":
-            # FIXME temporary hack: distances below 0.0075 are buggy:
-            dist = max(dist, 0.0075)
-            locations.append(
-                _rup_to_point(dist, surface, origin_location, azimuth, 'rrup')
-            )
-        else:
-            raise ValueError(f"Unsupported distance type '{dist_type}'")
-    return locations
+        xdist = np.sqrt(distances ** 2. - hypocenter.depth ** 2.)
+        lons, lats = point_at(
+            hypocenter.longitude, hypocenter.latitude, azimuth, xdist
+        )
+    elif dist_type == "rjb":
+        lons, lats = _rup_to_points(
+            distances, surface, origin_location, azimuth, 'rjb'
+        )
+    elif dist_type == "rrup":
+        # FIXME temporary hack: distances below 0.0075 are buggy:
+        distances = np.maximum(distances, 0.0075)
+        lons, lats = _rup_to_points(
+            distances, surface, origin_location, azimuth, 'rrup'
+        )
+    else:
+        raise ValueError(f"Unsupported distance type '{dist_type}'")
+    return (
+        np.broadcast_to(lons, distances.shape).astype(float),
+        np.broadcast_to(lats, distances.shape).astype(float),
+        depths
+    )
 
 
 def get_hypocentre_on_planar_surface(
@@ -375,7 +954,8 @@ def get_hypocentre_on_planar_surface(
         a hypocentre located in a position 3/4 along the length, and 1/4 of the
         way down dip of the rupture plane would be entered as (0.75, 0.25)
 
-    :return: Hypocentre location as instance of :class:`openquake.hazardlib.geo.point.Point`
+    :return: Hypocentre location as instance of
+        :class:`openquake.hazardlib.geo.point.Point`
     """
     centroid = plane.get_middle_point()
     if hypo_loc is None:
@@ -406,50 +986,51 @@ def get_hypocentre_on_planar_surface(
     )
 
 
-def _rup_to_point(
-    distance: float,
+def _rup_to_points(
+    distances: np.ndarray,
     surface: PlanarSurface,
     origin: Point,
     azimuth: float,
     distance_type: str = 'rjb',
     iter_stop: float = 1E-3,
     maxiter: int = 1000
-) -> Point:
-    """Place a point at a given distance from a rupture along a specified azimuth"""
-
-    pt1 = origin.point_at(distance, 0., azimuth)
-    r_diff = np.inf
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Place points at the given distances from a rupture along a specified azimuth.
+    All points are computed iteratively at once (each point stops iterating
+    independently, when converged) and returned as the tuple of numpy arrays
+    (longitudes, latitudes)
+    """
+    if distance_type not in ('rjb', 'rrup'):
+        raise ValueError('Distance type must be rrup or rjb')
     dip = surface.dip
+    use_rjb = distance_type == 'rjb' or np.fabs(dip - 90.0) < 1.0E-3
     sin_dip = np.sin(np.radians(dip))
-    dist_sin_dip = distance / sin_dip
+    # r_diff for rrup distances is computed differently on hanging / foot wall:
+    hanging_wall = 0.0 <= azimuth <= 180.0
+    lons, lats = point_at(origin.longitude, origin.latitude, azimuth, distances)
+    lons = np.array(lons, dtype=float).reshape(-1)
+    lats = np.array(lats, dtype=float).reshape(-1)
+    # indices of the points still iterating:
+    active = np.arange(len(distances))
     iterval = 0
-    while (np.fabs(r_diff) >= iter_stop) and (iterval <= maxiter):
-        pt1mesh = Mesh(
-            np.array([pt1.longitude]),
-            np.array([pt1.latitude]),
-            None
-        )
-        if distance_type == 'rjb' or np.fabs(dip - 90.0) < 1.0E-3:
-            r_diff = (distance - surface.get_joyner_boore_distance(pt1mesh)).flatten()
-            pt0 = Point(pt1.longitude, pt1.latitude)
-            if r_diff > 0.:
-                pt1 = pt0.point_at(r_diff, 0., azimuth)
-            else:
-                pt1 = pt0.point_at(np.fabs(r_diff), 0., (azimuth + 180.) % 360.)
-        elif distance_type == 'rrup':
-            rrup = surface.get_min_distance(pt1mesh).flatten()
-            if 0.0 <= azimuth <= 180.0:
-                # On hanging wall
-                r_diff = dist_sin_dip - (rrup / sin_dip)
+    while len(active) and iterval <= maxiter:
+        mesh = Mesh(lons[active], lats[active], None)
+        distance = distances[active]
+        if use_rjb:
+            r_diff = distance - surface.get_joyner_boore_distance(mesh)
+        else:
+            rrup = surface.get_min_distance(mesh)
+            if hanging_wall:
+                r_diff = (distance / sin_dip) - (rrup / sin_dip)
             else:
-                # On foot wall
                 r_diff = distance - rrup
-            pt0 = Point(pt1.longitude, pt1.latitude)
-            if r_diff > 0.:
-                pt1 = pt0.point_at(r_diff, 0., azimuth)
-            else:
-                pt1 = pt0.point_at(np.fabs(r_diff), 0., (azimuth + 180.) % 360.)
-        else:
-            raise ValueError('Distance type must be rrup or rjb')
+        lons[active], lats[active] = point_at(
+            lons[active],
+            lats[active],
+            np.where(r_diff > 0., azimuth, (azimuth + 180.) % 360.),
+            np.fabs(r_diff)
+        )
+        active = active[np.fabs(r_diff) >= iter_stop]
         iterval += 1
-    return pt1
+    return lons, lats
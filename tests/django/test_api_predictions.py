@@ -20,7 +20,7 @@ from openquake.hazardlib.gsim.akkar_2014 import AkkarEtAlRjb2014
 from egsim.api.urls import PREDICTIONS_URL_PATH
 from egsim.api.views import (MimeType, read_df_from_hdf_stream,
                              read_df_from_csv_stream, as_querystring)
-from egsim.api.forms.scenarios import PredictionsForm
+from egsim.api.forms.scenarios import PredictionsForm, scenario_contexts
 
 from unittest.mock import patch  # ok in py3.8  # noqa
 
@@ -142,6 +142,145 @@ class Test:
         result_hdf.columns = [Clabel.sep.join(c) for c in result_hdf.columns]  # noqa
         pd.testing.assert_frame_equal(result_hdf, result_hdf_single_header)
 
+    def test_trellis_float32(
+            self,
+            # pytest fixtures:
+            client):
+        """test that predictions can be returned in single precision"""
+        with open(self.request_filepath) as _:
+            inputdic = dict(yaml.safe_load(_))
+        inputdic['format'] = 'hdf'
+        resp = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp.status_code == 200
+        result = read_df_from_hdf_stream(BytesIO(b''.join(resp.streaming_content)))
+        inputdic['dtype'] = 'float32'
+        resp = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp.status_code == 200
+        result_32 = read_df_from_hdf_stream(BytesIO(b''.join(resp.streaming_content)))
+        cols = [c for c in result.columns if c[0] != Clabel.input]
+        assert (result_32[cols].dtypes == np.float32).all()
+        np.testing.assert_allclose(
+            result_32[cols].to_numpy(dtype=float), result[cols].to_numpy(), rtol=1e-7
+        )
+        # input columns are not converted:
+        input_cols = [c for c in result.columns if c not in cols]
+        pd.testing.assert_frame_equal(result_32[input_cols], result[input_cols])
+
+    def test_trellis_chunks(self, client, settings):
+        """test that predictions computed in chunks return the same CSV and HDF"""
+        with open(self.request_filepath) as _:
+            inputdic = dict(yaml.safe_load(_))
+        for format in ['csv', 'hdf']:
+            inputdic['format'] = format
+            settings.EGSIM_PREDICTIONS_CHUNK_SIZE = None
+            resp1 = client.post(self.url, data=inputdic, content_type=MimeType.json)
+            settings.EGSIM_PREDICTIONS_CHUNK_SIZE = 1
+            resp2 = client.post(self.url, data=inputdic, content_type=MimeType.json)
+            assert resp1.status_code == resp2.status_code == 200
+            if format == 'csv':
+                dfr1 = read_df_from_csv_stream(resp1.getvalue(), header=0, index_col=0)
+                dfr2 = read_df_from_csv_stream(resp2.getvalue(), header=0, index_col=0)
+            else:
+                dfr1 = read_df_from_hdf_stream(resp1.getvalue())
+                dfr2 = read_df_from_hdf_stream(resp2.getvalue())
+            assert len(dfr1) > 1
+            pd.testing.assert_frame_equal(dfr1, dfr2)
+
+    def test_trellis_batch_scenarios(
+            self,
+            # pytest fixtures:
+            client):
+        """test predictions of several scenarios in a single request"""
+        with open(self.request_filepath) as _:
+            inputdic = dict(yaml.safe_load(_))
+        inputdic['format'] = 'hdf'
+        scenarios = [{}, {'dip': 30, 'vs30': 300}, {'initial-point': [10, 40]}]
+        resp = client.post(self.url, data=inputdic | {'scenarios': scenarios},
+                           content_type=MimeType.json)
+        assert resp.status_code == 200
+        result = read_df_from_hdf_stream(BytesIO(resp.getvalue()))
+        id_col = (Clabel.input, Clabel.uncategorized_input, Clabel.scenario_id)
+        assert sorted(set(result[id_col])) == [0, 1, 2]
+        for scenario_id, params in enumerate(scenarios):
+            resp = client.post(self.url, data=inputdic | params,
+                               content_type=MimeType.json)
+            expected = read_df_from_hdf_stream(BytesIO(resp.getvalue()))
+            pd.testing.assert_frame_equal(
+                result[result[id_col] == scenario_id].drop(columns=id_col)
+                .reset_index(drop=True),
+                expected
+            )
+        for scenarios in ['a', [{'dip': 100}], [{}, {'mag': 5}]]:
+            resp = client.post(self.url, data=inputdic | {'scenarios': scenarios},
+                               content_type=MimeType.json)
+            assert resp.status_code == 400
+
+    def test_trellis_grid(
+            self,
+            # pytest fixtures:
+            client, settings):
+        """test predictions on a geographic grid of sites (map mode)"""
+        with open(self.request_filepath) as _:
+            inputdic = dict(yaml.safe_load(_))
+        inputdic.pop('distance')
+        inputdic |= {
+            'format': 'hdf',
+            'initial-point': [10, 45],
+            'grid-bbox': [9.5, 44.5, 10.5, 45.5],
+            'grid-resolution': 0.5
+        }
+        resp = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp.status_code == 200
+        result = read_df_from_hdf_stream(BytesIO(resp.getvalue()))
+        assert len(result) == 9 * len(inputdic['magnitude'])
+        lon_col = (Clabel.input, ColumnType.site.value, 'station_longitude')
+        assert sorted(set(result[lon_col])) == [9.5, 10, 10.5]
+        # grid nodes all beyond the models maximum distance (1000 km):
+        resp = client.post(self.url, data=inputdic | {'grid-bbox': [100, 10, 101, 11]},
+                           content_type=MimeType.json)
+        assert resp.status_code == 200
+        result = read_df_from_hdf_stream(BytesIO(resp.getvalue()))
+        assert len(result) == 9 * len(inputdic['magnitude'])
+        assert result[lon_col].notna().all()
+        # the maximum number of grid nodes applies to all magnitudes:
+        settings.EGSIM_PREDICTIONS_MAX_GRID_SITES = 9 * len(inputdic['magnitude']) - 1
+        resp = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp.status_code == 400
+        settings.EGSIM_PREDICTIONS_MAX_GRID_SITES = 9 * len(inputdic['magnitude'])
+        resp = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp.status_code == 200
+        # test errors:
+        for params in [
+            {'grid-resolution': 0},
+            {'grid-resolution': 0.0001},  # too many grid nodes
+            {'grid-bbox': [10.5, 44.5, 9.5, 45.5]},  # min lon > max lon
+            {'grid-bbox': [9.5, 44.5, 10.5]},
+            {'scenarios': [{}, {'dip': 30}]},
+            {'grid-bbox': None}  # missing distance
+        ]:
+            resp = client.post(self.url, data=inputdic | params,
+                               content_type=MimeType.json)
+            assert resp.status_code == 400
+
+    def test_trellis_contexts_cache(
+            self,
+            # pytest fixtures:
+            client):
+        """test that repeated predictions reuse the cached scenario contexts"""
+        with open(self.request_filepath) as _:
+            inputdic = dict(yaml.safe_load(_))
+        inputdic['format'] = 'json'
+        scenario_contexts.clear()
+        resp1 = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp1.status_code == 200
+        num_contexts = len(scenario_contexts)
+        assert num_contexts == scenario_contexts.stats['misses'] > 0
+        assert scenario_contexts.stats['hits'] == 0
+        resp2 = client.post(self.url, data=inputdic, content_type=MimeType.json)
+        assert resp2.json() == resp1.json()
+        assert scenario_contexts.stats['hits'] == num_contexts
+        assert scenario_contexts.stats['misses'] == len(scenario_contexts)
+
     def test_400_invalid_param_names(
             self,
             # pytest fixtures:
@@ -216,7 +355,8 @@ class Test:
         assert self.error_message(resp1) == self.error_message(resp2)
         assert self.error_message(resp1) == 'gsim: invalid model(s) AkkarEtAl2013'
 
-    @patch('egsim.api.views.PredictionsForm.output', side_effect=ValueError())
+    @patch('egsim.api.views.PredictionsForm._predictions_kwargs',
+           side_effect=ValueError())
     def test_500_err(self, mocked_output_method, client):  # noqa
         with open(self.request_filepath) as _:
             inputdic = dict(yaml.safe_load(_))
@@ -5,24 +5,30 @@ Created on 22 Oct 2018
 
 @author: riccardo
 """
-from os.path import dirname, join, abspath
+from os.path import dirname, join, abspath, isfile
 from io import BytesIO
 import yaml
 import numpy as np
 import pandas as pd
 import pytest
 
-from unittest.mock import patch
+from unittest.mock import patch, PropertyMock
+from django.conf import settings
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.http import HttpResponse
 from django.utils.datastructures import MultiValueDict
 
 from egsim.api.urls import RESIDUALS_URL_PATH
+from egsim.api.forms.residuals import prepared_flatfiles
+from egsim.api.models import Flatfile
 from egsim.api.views import (ResidualsView, APIFormView, as_querystring,
                              read_df_from_csv_stream, read_df_from_hdf_stream,
-                             write_df_to_hdf_stream, MimeType)
+                             write_df_to_hdf_stream, write_dfs_to_hdf_file,
+                             write_dfs_to_csv_chunks, MimeType)
 from egsim.smtk import read_flatfile
 from egsim.smtk.converters import dataframe2dict
+from egsim.smtk.residuals import prepare_flatfile, get_expected_motions
 from egsim.smtk.registry import Clabel
 
 
@@ -398,6 +404,144 @@ class Test:
         result_hdf.columns = [Clabel.sep.join(c) for c in result_hdf.columns]  # noqa
         pd.testing.assert_frame_equal(result_hdf, result_hdf_single_header)
 
+    def test_residuals_service_float32(self, client):
+        """test that residuals can be returned in single precision"""
+        with open(self.request_filepath) as _:
+            inputdic = yaml.safe_load(_)
+        inputdic['data-query'] = '(vs30 >= 1000) & (mag>=7)'
+        inputdic['format'] = 'hdf'
+        resp = client.post(self.url, data=inputdic, content_type='application/json')
+        assert resp.status_code == 200
+        result = read_df_from_hdf_stream(BytesIO(b''.join(resp.streaming_content)))
+        inputdic['dtype'] = 'float32'
+        resp = client.post(self.url, data=inputdic, content_type='application/json')
+        assert resp.status_code == 200
+        result_32 = read_df_from_hdf_stream(BytesIO(b''.join(resp.streaming_content)))
+        cols = [c for c in result.columns if c[0] != Clabel.input]
+        assert (result_32[cols].dtypes == np.float32).all()
+        np.testing.assert_allclose(
+            result_32[cols].to_numpy(dtype=float), result[cols].to_numpy(),
+            rtol=0, atol=1e-5
+        )
+        inputdic['dtype'] = 'float16'
+        resp = client.post(self.url, data=inputdic, content_type='application/json')
+        assert resp.status_code == 400
+
+    def test_residuals_service_chunks(self, client, settings):
+        """test that residuals computed in chunks return the same CSV and HDF"""
+        with open(self.request_filepath) as _:
+            inputdic = yaml.safe_load(_)
+        inputdic['data-query'] = '(vs30 >= 800) & (mag>=6)'
+
+        for format in ['csv', 'hdf']:
+            inputdic['format'] = format
+            settings.EGSIM_RESIDUALS_CHUNK_SIZE = None
+            resp1 = client.post(self.url, data=inputdic, content_type='application/json')
+            settings.EGSIM_RESIDUALS_CHUNK_SIZE = 5
+            resp2 = client.post(self.url, data=inputdic, content_type='application/json')
+            assert resp1.status_code == resp2.status_code == 200
+            if format == 'csv':
+                dfr1 = read_df_from_csv_stream(resp1.getvalue(), header=[0, 1, 2])
+                dfr2 = read_df_from_csv_stream(resp2.getvalue(), header=[0, 1, 2])
+            else:
+                dfr1 = read_df_from_hdf_stream(resp1.getvalue())
+                dfr2 = read_df_from_hdf_stream(resp2.getvalue())
+            assert len(dfr1) > 5
+            pd.testing.assert_frame_equal(dfr1, dfr2)
+
+        # HDF chunks are written to a temporary file, deleted when closed:
+        chunks = [dfr1.iloc[:3], dfr1.iloc[3:]]
+        file = write_dfs_to_hdf_file({'egsim': iter(chunks)})
+        assert isfile(file.name)
+        pd.testing.assert_frame_equal(read_df_from_hdf_stream(file), dfr1)
+        file.close()
+        assert not isfile(file.name)
+
+        # CSV chunks errors are written as last line:
+        def chunks_with_error():
+            yield dfr1.iloc[3:]
+            raise ValueError('no "chunk"')
+
+        content = b''.join(write_dfs_to_csv_chunks(dfr1.iloc[:3], chunks_with_error()))
+        lines = content.decode('utf8').splitlines()
+        assert lines[-1] == ('"Server error (ValueError): no \'chunk\'. '
+                             'The data above is incomplete"')
+        content = b''.join(write_dfs_to_csv_chunks(dfr1.iloc[:3], dfr1.iloc[3:]))
+        assert len(content.decode('utf8').splitlines()) == len(lines) - 1
+
+    def test_residuals_prepared_flatfile_cache(self, client):
+        """test that repeated requests skip the flatfile preparation"""
+        with open(self.request_filepath) as _:
+            inputdic = yaml.safe_load(_)
+        inputdic['data-query'] = '(vs30 >= 800) & (mag>=6)'
+        inputdic['format'] = 'hdf'
+
+        prepared_flatfiles.clear()
+        read_flatfile = Flatfile.read_from_filepath
+        with patch('egsim.api.forms.residuals.prepare_flatfile',
+                   side_effect=prepare_flatfile) as prepare, \
+                patch.object(Flatfile, 'read_from_filepath', autospec=True,
+                             side_effect=read_flatfile) as read:
+            resp1 = client.post(self.url, data=inputdic, content_type='application/json')
+            assert prepare.call_count == read.call_count == 1
+            # the flatfile is not even read:
+            resp2 = client.post(self.url, data=inputdic, content_type='application/json')
+            assert prepare.call_count == read.call_count == 1
+            assert prepared_flatfiles.stats['hits'] == 1
+            # (misses: the prepared flatfile and the (not stored) SA spectrum):
+            assert prepared_flatfiles.stats['misses'] == 2
+            pd.testing.assert_frame_equal(
+                read_df_from_hdf_stream(resp1.getvalue()),
+                read_df_from_hdf_stream(resp2.getvalue())
+            )
+            # different selection expression, the flatfile is prepared again:
+            inputdic['data-query'] = '(vs30 >= 800) & (mag>=6.5)'
+            resp3 = client.post(self.url, data=inputdic, content_type='application/json')
+            assert prepare.call_count == read.call_count == 2
+            assert resp1.status_code == resp2.status_code == resp3.status_code == 200
+            assert len(prepared_flatfiles) == 2
+
+    def test_residuals_stored_expected_motions(self, client, tmp_path):
+        """test residuals computed with precomputed expected motions"""
+        with open(self.request_filepath) as _:
+            inputdic = yaml.safe_load(_)
+        inputdic['data-query'] = '(vs30 >= 800) & (mag>=6)'
+        inputdic['format'] = 'hdf'
+        # SA(0.2) is not a flatfile column (it is interpolated and not stored):
+        inputdic['imt'] = ['SA(1.0)', 'PGA', 'PGV']
+
+        resp1 = client.post(self.url, data=inputdic, content_type='application/json')
+        filepath = str(tmp_path / 'esm2018.expected_motions.hdf')
+        sa_filepath = str(tmp_path / 'esm2018.sa_spectrum.hdf')
+        with (patch.object(Flatfile, 'expected_motions_filepath',
+                           new_callable=PropertyMock, return_value=filepath),
+              patch.object(Flatfile, 'sa_spectrum_filepath',
+                           new_callable=PropertyMock, return_value=sa_filepath)):
+            call_command(
+                'egsim-expected-motions', flatfile=['esm2018'], model=inputdic['model']
+            )
+            with patch('egsim.smtk.residuals.get_expected_motions',
+                       side_effect=get_expected_motions) as g_exp:
+                resp2 = client.post(
+                    self.url, data=inputdic, content_type='application/json'
+                )
+                # all models are stored, no computation needed:
+                assert g_exp.call_count == 0
+                # add a model (not stored):
+                resp3 = client.post(
+                    self.url,
+                    data=inputdic | {'model': inputdic['model'] + ['CauzziEtAl2014']},
+                    content_type='application/json'
+                )
+                assert g_exp.call_count == 1
+                assert list(g_exp.call_args[0][0]) == ['CauzziEtAl2014']
+        assert resp1.status_code == resp2.status_code == resp3.status_code == 200
+        dfr1 = read_df_from_hdf_stream(resp1.getvalue())
+        dfr2 = read_df_from_hdf_stream(resp2.getvalue())
+        dfr3 = read_df_from_hdf_stream(resp3.getvalue())
+        pd.testing.assert_frame_equal(dfr1, dfr2)
+        pd.testing.assert_frame_equal(dfr1, dfr3[dfr1.columns])
+
     def test_residuals_invalid_get(self,
                                    # pytest fixtures:
                                    client):
@@ -539,6 +683,63 @@ class Test:
                 assert args[1]['likelihood'] is True
                 assert args[1]['mean'] is True
                 assert args[1]['normalise'] is True
+                assert args[1]['workers'] == settings.EGSIM_RESIDUALS_WORKERS
+
+    def test_residuals_ranking_bootstrap(self,
+                                         # pytest fixtures:
+                                         client):
+        with open(self.request_filepath) as _:
+            inputdic = yaml.safe_load(_)
+        inputdic['data-query'] = '(vs30 >= 1000) & (mag>=7)'
+        inputdic['ranking'] = True
+        inputdic['format'] = 'json'
+        resp_json = client.post(self.url, data=inputdic,
+                                content_type='application/json').json()
+        resp = client.post(self.url, data=inputdic | {'bootstrap': 20},
+                           content_type='application/json')
+        assert resp.status_code == 200
+        resp_json_b = resp.json()
+        assert len(resp_json_b) == 3 * len(resp_json)
+        for k in resp_json:
+            assert resp_json_b[k] == resp_json[k]
+            assert f'{k} ci_lower' in resp_json_b and f'{k} ci_upper' in resp_json_b
+        # fixed seed, same results:
+        assert client.post(self.url, data=inputdic | {'bootstrap': 20},
+                           content_type='application/json').json() == resp_json_b
+        for bootstrap in [-1, 1001]:
+            resp = client.post(self.url, data=inputdic | {'bootstrap': bootstrap},
+                               content_type='application/json')
+            assert resp.status_code == 400
+
+    def test_residuals_ranking_edr_sweep(self,
+                                         # pytest fixtures:
+                                         client):
+        with open(self.request_filepath) as _:
+            inputdic = yaml.safe_load(_)
+        inputdic['data-query'] = '(vs30 >= 1000) & (mag>=7)'
+        inputdic['ranking'] = True
+        inputdic['format'] = 'json'
+        resp_json = client.post(self.url, data=inputdic,
+                                content_type='application/json').json()
+        # single values: same output as default:
+        resp = client.post(
+            self.url, data=inputdic | {'edr_bandwidth': 0.01, 'edr_multiplier': 3},
+            content_type='application/json')
+        assert resp.status_code == 200
+        assert resp.json() == resp_json
+        resp = client.post(
+            self.url,
+            data=inputdic | {'edr_bandwidth': [0.01, 0.1], 'edr_multiplier': 3},
+            content_type='application/json')
+        assert resp.status_code == 200
+        resp_json_s = resp.json()
+        assert 'edr' not in resp_json_s
+        assert resp_json_s['edr bandwidth=0.01 multiplier=3.0'] == resp_json['edr']
+        assert 'edr bandwidth=0.1 multiplier=3.0' in resp_json_s
+        for bandwidth in [0, [0.01, -1]]:
+            resp = client.post(self.url, data=inputdic | {'edr_bandwidth': bandwidth},
+                               content_type='application/json')
+            assert resp.status_code == 400
 
     @patch('egsim.smtk.residuals.get_ground_motion_values', side_effect=ValueError('a'))
     def test_residuals_model_error(self,
@@ -6,7 +6,7 @@ Created on 6 Apr 2019
 @author: riccardo
 """
 import os
-from unittest.mock import patch
+from unittest.mock import patch, PropertyMock
 
 from django.conf import settings
 
@@ -16,7 +16,7 @@ from django.core.management import call_command
 import pandas as pd
 import yaml
 
-from egsim.api.models import Gsim
+from egsim.api.models import Gsim, Flatfile
 from egsim.smtk.flatfile import get_dtype_of
 
 
@@ -73,6 +73,48 @@ def test_egsimdb(mocked_input, capsys):
     assert 'Command terminated' in out_err.out
 
 
+@pytest.mark.django_db
+def test_expected_motions(capsys, tmp_path):
+    """Test the command precomputing the expected motions of predefined flatfiles"""
+    filepath = str(tmp_path / 'esm2018.expected_motions.hdf')
+    sa_filepath = str(tmp_path / 'esm2018.sa_spectrum.hdf')
+    with (patch.object(Flatfile, 'expected_motions_filepath',
+                       new_callable=PropertyMock, return_value=filepath),
+          patch.object(Flatfile, 'sa_spectrum_filepath',
+                       new_callable=PropertyMock, return_value=sa_filepath)):
+        flatfile = Flatfile.objects.get(name='esm2018')
+        assert flatfile.read_expected_motions(['BindiEtAl2014Rjb']) is None
+        assert flatfile.read_sa_spectrum() is None
+        call_command(
+            'egsim-expected-motions',
+            flatfile=['esm2018'],
+            model=['BindiEtAl2014Rjb', 'NGAEastUSGSSammons1']
+        )
+        capout = capsys.readouterr().out
+        assert 'Discarding NGAEastUSGSSammons1' in capout
+        assert 'Models saved: 1, discarded: 1' in capout
+        assert flatfile.read_expected_motions(['NGAEastUSGSSammons1']) is None
+        dfr = flatfile.read_expected_motions(['BindiEtAl2014Rjb', 'CauzziEtAl2014'])
+        assert len(dfr) == len(flatfile.read_from_filepath())
+        assert set(dfr.columns.get_level_values(2)) == {'BindiEtAl2014Rjb'}
+        assert ('PGA', 'mean', 'BindiEtAl2014Rjb') in dfr.columns
+        sa_spectrum = flatfile.read_sa_spectrum()
+        assert sorted(sa_spectrum.index) == sorted(dfr.index)
+        assert len(sa_spectrum.periods) == sa_spectrum.log_values.shape[1] > 1
+        # computing other models does not delete the models stored previously:
+        call_command(
+            'egsim-expected-motions',
+            flatfile=['esm2018'],
+            model=['CauzziEtAl2014']
+        )
+        assert 'Models saved: 1, discarded: 0' in capsys.readouterr().out
+        dfr2 = flatfile.read_expected_motions(['BindiEtAl2014Rjb', 'CauzziEtAl2014'])
+        assert set(dfr2.columns.get_level_values(2)) == {
+            'BindiEtAl2014Rjb', 'CauzziEtAl2014'
+        }
+        pd.testing.assert_frame_equal(dfr2[dfr.columns], dfr)
+
+
 @pytest.mark.django_db
 def test_collectstatic(settings, tmp_path):
     import shutil
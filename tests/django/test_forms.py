@@ -513,7 +513,7 @@ def test_trellis_rupture_site_fields():
 
     # check that we did not misspell any TrellisField. To do this, let's
     # remove the site and rupture fields, and all fields defined in superclasses.
-    # We should be left with 2 fields only: magnitude and distance
+    # We should be left with the fields below only (magnitude, distance, ...)
 
     rem_fields = (set(PredictionsForm.base_fields) -
                   form_rupture_fields - form_site_fields)
@@ -524,7 +524,10 @@ def test_trellis_rupture_site_fields():
                 rem_fields -= set(super_cls.base_fields)  # noqa
             except AttributeError:
                 pass
-    assert sorted(rem_fields) == ['distance', 'magnitude', 'multi_header']
+    assert sorted(rem_fields) == [
+        'distance', 'dtype', 'grid_bbox', 'grid_resolution', 'magnitude',
+        'multi_header', 'scenarios'
+    ]
 
 
 def check_egsim_form(new_class: Type[EgsimBaseForm]):
@@ -2,11 +2,13 @@
 test rankings (measures of fit derived from residuals computations)
 """
 import os
+from unittest.mock import patch
 
 import numpy as np
 import pandas as pd
+import pytest
 
-from egsim.smtk import residuals, get_measures_of_fit
+from egsim.smtk import residuals, ranking, get_measures_of_fit
 from egsim.smtk.flatfile import read_flatfile, ColumnType
 from scipy.constants import g
 
@@ -94,4 +96,209 @@ def test_stats_inf_na():
     for c in imt_cols:
         res_df[c] = np.log(0)
     m_fit = get_measures_of_fit(gsims, imts, res_df)
-    assert m_fit.isna().all().all()
\ No newline at end of file
+    assert m_fit.isna().all().all()
+
+
+def _get_edr_loop(obs, expected, stddev, bandwidth=0.01, multiplier=3.0):
+    """Reference (non-vectorized) EDR implementation, i.e. one iteration per bin"""
+    from math import ceil
+    from scipy.stats import norm
+    nvals = len(obs)
+    min_d = bandwidth / 2.
+    kappa = ranking._get_edr_kappa(obs, expected)  # noqa
+    mu_d = obs - expected
+    d1c = np.fabs(obs - (expected - (multiplier * stddev)))
+    d2c = np.fabs(obs - (expected + (multiplier * stddev)))
+    dc_max = ceil(np.max(np.array([np.max(d1c), np.max(d2c)])))
+    num_d = len(np.arange(min_d, dc_max, bandwidth))
+    mde = np.zeros(nvals)
+    for iloc in range(0, num_d):
+        d_val = (min_d + (float(iloc) * bandwidth)) * np.ones(nvals)
+        d_1 = d_val - min_d
+        d_2 = d_val + min_d
+        p_1 = norm.cdf((d_1 - mu_d) / stddev) - norm.cdf((-d_1 - mu_d) / stddev)
+        p_2 = norm.cdf((d_2 - mu_d) / stddev) - norm.cdf((-d_2 - mu_d) / stddev)
+        mde += (p_2 - p_1) * d_val
+    inv_n = 1.0 / float(nvals)
+    mde_norm = np.sqrt(inv_n * np.sum(mde ** 2.))
+    edr = np.sqrt(kappa * inv_n * np.sum(mde ** 2.))
+    return float(mde_norm), float(np.sqrt(kappa)), float(edr)
+
+
+@pytest.mark.parametrize('bandwidth, multiplier', [(0.01, 3.), (0.1, 1.), (0.005, 5.)])
+def test_edr(bandwidth, multiplier):
+    """test the vectorized EDR computation against the reference implementation"""
+    rng = np.random.default_rng(0)
+    for size in [1, 10, 5000]:
+        expected = rng.normal(-3, 2, size)
+        obs = expected + rng.normal(0, 0.7, size)
+        stddev = rng.uniform(0.3, 1, size)
+        edr = ranking.get_edr(obs, expected, stddev, bandwidth, multiplier)
+        edr_ref = _get_edr_loop(obs, expected, stddev, bandwidth, multiplier)
+        np.testing.assert_allclose(edr, edr_ref, rtol=1e-12, atol=0)
+        # test small blocks:
+        with patch('egsim.smtk.ranking._EDR_BLOCK_SIZE', 7):
+            edr = ranking.get_edr(obs, expected, stddev, bandwidth, multiplier)
+        np.testing.assert_allclose(edr, edr_ref, rtol=1e-12, atol=0)
+
+
+@pytest.mark.skipif(not os.environ.get('EGSIM_BENCHMARK'),
+                    reason='benchmark (set the env. variable EGSIM_BENCHMARK to run)')
+def test_edr_benchmark():
+    """Compare the execution time of the vectorized EDR computation and the
+    reference implementation. Run with `EGSIM_BENCHMARK=1 pytest -s ...`"""
+    from time import perf_counter
+    rng = np.random.default_rng(0)
+    for size in [100, 10000, 100000]:
+        expected = rng.normal(-3, 2, size)
+        obs = expected + rng.normal(0, 0.7, size)
+        stddev = rng.uniform(0.3, 1, size)
+        t0 = perf_counter()
+        edr_ref = _get_edr_loop(obs, expected, stddev)
+        t1 = perf_counter()
+        edr = ranking.get_edr(obs, expected, stddev)
+        t2 = perf_counter()
+        np.testing.assert_allclose(edr, edr_ref, rtol=1e-12, atol=0)
+        print(f'EDR of {size} records: loop {t1 - t0:.4f}s, '
+              f'vectorized {t2 - t1:.4f}s (x{(t1 - t0) / (t2 - t1):.1f})')
+
+
+def test_measures_of_fit_values():
+    """test measures of fit values against straightforward computations"""
+    from scipy.stats import norm
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    res_df = residuals.get_residuals(gsims, imts, flatfile.copy(), likelihood=True,
+                                     mean=True, header_sep=None)
+    # add some non-finite values:
+    col = (imts[0], Clabel.total_res, gsims[0])
+    res_df.loc[res_df.index[::3], col] = np.nan
+    res_df.loc[res_df.index[1::7], col] = np.inf
+    res_df.loc[res_df.index[::5], (imts[1], Clabel.total_lh, gsims[1])] = np.nan
+    m_fit = get_measures_of_fit(gsims, imts, res_df)
+    assert list(m_fit.index) == gsims
+    for gsim in gsims:
+        all_asll = []
+        for imt in imts:
+            for label in (Clabel.total_res, Clabel.inter_ev_res, Clabel.intra_ev_res):
+                values = res_df[(imt, label, gsim)]
+                np.testing.assert_allclose(
+                    m_fit.loc[gsim, f'{imt} {label} mean'], values.mean(),
+                    rtol=1e-12
+                )
+                np.testing.assert_allclose(
+                    m_fit.loc[gsim, f'{imt} {label} stddev'], values.std(ddof=0),
+                    rtol=1e-12
+                )
+            for label in (Clabel.total_lh, Clabel.inter_ev_lh, Clabel.intra_ev_lh):
+                values = res_df[(imt, label, gsim)].dropna()
+                p25, p50, p75 = np.percentile(values, [25, 50, 75])
+                assert m_fit.loc[gsim, f'{imt} {label} median'] == p50
+                assert m_fit.loc[gsim, f'{imt} {label} iqr'] == p75 - p25
+            asll = np.log2(norm.pdf(res_df[(imt, Clabel.total_res, gsim)]))
+            asll = asll[np.isfinite(asll)]
+            all_asll.extend(asll)
+            np.testing.assert_allclose(
+                m_fit.loc[gsim, f'{imt} loglikelihood'], -np.mean(asll), rtol=1e-12
+            )
+        np.testing.assert_allclose(
+            m_fit.loc[gsim, 'All_IMT loglikelihood'], -np.mean(all_asll), rtol=1e-12
+        )
+
+
+def test_measures_of_fit_accumulator():
+    """test measures of fit computed from residuals chunks"""
+    import pickle
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    gsims += ['BindiEtAl2014Rjb']
+    res_df = residuals.get_residuals(gsims, imts, flatfile.copy(), likelihood=True,
+                                     mean=True)
+    # add some non-finite values:
+    col = f'{imts[0]} {Clabel.total_res} {gsims[0]}'
+    res_df.loc[res_df.index[::3], col] = np.nan
+    res_df.loc[res_df.index[1::7], col] = np.inf
+    m_fit = get_measures_of_fit(gsims, imts, res_df)
+    lh_bins = 1000
+    chunks = [res_df.iloc[i: i + 7] for i in range(0, len(res_df), 7)]
+    # accumulate chunks in two accumulators, then merge them:
+    acc1 = ranking.MeasuresOfFitAccumulator(gsims, imts, lh_bins=lh_bins)
+    acc2 = ranking.MeasuresOfFitAccumulator(gsims, imts, lh_bins=lh_bins)
+    for i, chunk in enumerate(chunks):
+        (acc1 if i % 2 else acc2).update(chunk)
+    acc2 = pickle.loads(pickle.dumps(acc2))  # test it can be sent to workers
+    m_fit2 = acc1.merge(acc2).result()
+    pd.testing.assert_frame_equal(
+        m_fit2,
+        ranking.get_measures_of_fit_from_chunks(gsims, imts, chunks, lh_bins=lh_bins)
+    )
+    assert m_fit2.columns.equals(m_fit.columns) and m_fit2.index.equals(m_fit.index)
+    lh_cols = [c for c in m_fit.columns if c.endswith(' median') or
+               c.endswith(' iqr')]
+    other_cols = [c for c in m_fit.columns if c not in lh_cols]
+    pd.testing.assert_frame_equal(m_fit2[other_cols], m_fit[other_cols],
+                                  rtol=1e-10, atol=0)
+    # likelihood quantiles are approximated (IQR error is at most twice the median):
+    np.testing.assert_allclose(m_fit2[lh_cols], m_fit[lh_cols], rtol=0,
+                               atol=2. / lh_bins)
+
+    with pytest.raises(ValueError):
+        acc1.merge(ranking.MeasuresOfFitAccumulator(gsims, imts))
+
+    # test no residuals:
+    acc = ranking.MeasuresOfFitAccumulator(gsims, imts)
+    assert acc.result().isna().all().all()
+
+
+def test_measures_of_fit_bootstrap():
+    """test measures of fit with bootstrap confidence intervals"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    res_df = residuals.get_residuals(gsims, imts, flatfile.copy(), likelihood=True,
+                                     mean=True)
+    m_fit = get_measures_of_fit(gsims, imts, res_df)
+    m_fit_b = ranking.get_measures_of_fit_bootstrap(
+        gsims, imts, res_df, num_samples=50, seed=1)
+    assert len(m_fit_b.columns) == 3 * len(m_fit.columns)
+    pd.testing.assert_frame_equal(m_fit_b[m_fit.columns], m_fit)
+    for col in m_fit.columns:
+        lower, upper = m_fit_b[f'{col} ci_lower'], m_fit_b[f'{col} ci_upper']
+        assert (lower <= upper).all()
+    # results do not depend on the number of workers:
+    pd.testing.assert_frame_equal(
+        m_fit_b,
+        ranking.get_measures_of_fit_bootstrap(
+            gsims, imts, res_df, num_samples=50, seed=1, workers=2)
+    )
+    # the sequential computation does not keep the residuals in memory:
+    assert ranking._worker_bootstrap_args is None  # noqa
+    with pytest.raises(ValueError):
+        ranking.get_measures_of_fit_bootstrap(gsims, imts, res_df, num_samples=0)
+
+
+def test_edr_sweep():
+    """test EDR values computed on a grid of bandwidths and multipliers"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    res_df = residuals.get_residuals(gsims, imts, flatfile.copy(), likelihood=True,
+                                     mean=True)
+    bandwidths, multipliers = [0.01, 0.1], [0, 1.5, 3.0]
+    m_fit = get_measures_of_fit(gsims, imts, res_df, edr_bandwidth=bandwidths,
+                                edr_multiplier=multipliers)
+    assert 'edr' not in m_fit.columns
+    res_df_mi = ranking._with_multiindex_columns(res_df)  # noqa
+    for bandwidth in bandwidths:
+        for multiplier in multipliers:
+            expected = ranking.get_residuals_edr_values(
+                gsims, imts, res_df_mi, bandwidth, multiplier)
+            for name in expected:
+                col = ranking.edr_sweep_measure_name(name, bandwidth, multiplier)
+                np.testing.assert_allclose(
+                    m_fit[col], pd.Series(expected[name]), rtol=1e-12, atol=0)
+    # test the other measures are unchanged:
+    m_fit2 = get_measures_of_fit(gsims, imts, res_df)
+    pd.testing.assert_frame_equal(
+        m_fit[[c for c in m_fit2.columns if c in m_fit.columns]],
+        m_fit2.drop(columns=['mde_norm', 'sqrt_kappa', 'edr'])
+    )
+    # test no finite value:
+    assert np.isnan(
+        ranking.get_edr_sweep(np.array([np.nan]), np.array([1.]), np.array([1.]),
+                              bandwidths, multipliers)
+    ).all()
@@ -11,7 +11,9 @@ import pytest
 from datetime import datetime
 
 from egsim.smtk import residuals
-from egsim.smtk.flatfile import read_flatfile, ColumnType
+from egsim.smtk.flatfile import (
+    read_flatfile, ColumnType, MissingColumnError, ColumnDataError
+)
 from scipy.constants import g
 from egsim.smtk.registry import Clabel
 
@@ -242,3 +244,282 @@ def test_model_error(mock_get_gmv):
     # the expected model is the first among the gsims (sorted), so:
     # expected_model = sorted(gsims)[0]
     # assert f'{expected_model}: (ValueError) a' in str(err.value)
+
+
+def test_models_computed_once_for_all_events():
+    """test that each model is computed once, regardless of the number of events"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    assert flatfile['event_id'].nunique() > 1
+    with patch(
+        'egsim.smtk.residuals.get_ground_motion_values',
+        side_effect=residuals.get_ground_motion_values
+    ) as mock_get_gmv:
+        res_df = residuals.get_residuals(gsims, imts, flatfile)
+    assert mock_get_gmv.call_count == len(gsims)
+    assert all(len(c[0][2]) == len(flatfile) for c in mock_get_gmv.call_args_list)
+    assert len(res_df) == len(flatfile)
+
+
+def test_random_effects_residuals_vectorized():
+    """test inter- and intra-event residuals of several events and columns at once"""
+    rng = np.random.default_rng(seed=0)
+    events = np.array([3, 1, 3, 3, 2, 1, 2, 3])
+    obs, mean, inter, intra = rng.random((4, len(events), 5)) + 0.1
+    for normalise in (True, False):
+        inter_res, intra_res = residuals._get_random_effects_residuals(
+            obs, mean, inter, intra, normalise, events
+        )
+        for ev_id in np.unique(events):
+            rows = events == ev_id
+            for col in range(obs.shape[1]):
+                # compute per-event and per-column (legacy code):
+                _inter_res, _intra_res = residuals._get_random_effects_residuals(
+                    obs[rows, col], mean[rows, col], inter[rows, col],
+                    intra[rows, col], normalise
+                )
+                assert np.allclose(inter_res[rows, col], _inter_res)
+                assert np.allclose(intra_res[rows, col], _intra_res)
+
+
+def test_residuals_from_expected_and_observed_motions():
+    """test residuals computation from synthetic data, with missing columns"""
+    index = pd.Index([4, 7, 9])
+    observed = pd.DataFrame({'SA(1.0)': [0.1, 0.2, 0.3], 'PGA': [0.5, 0.4, 0.3]},
+                            index=index)
+    m1, m2 = 'm1', 'm2'
+    expected = pd.DataFrame({
+        ('PGA', Clabel.mean, m2): [0.2, 0.1, 0.2],
+        ('PGA', Clabel.total_std, m2): [1., 2., 1.],
+        ('SA(1.0)', Clabel.mean, m1): [0.1, 0.1, 0.1],
+        ('SA(1.0)', Clabel.total_std, m1): [1., 1., 1.],
+        ('SA(1.0)', Clabel.inter_ev_std, m1): [.5, .5, .5],
+        ('SA(1.0)', Clabel.intra_ev_std, m1): [.5, .5, .5],
+        ('PGV', Clabel.mean, m1): [0.1, 0.1, 0.1],  # not observed
+    }, index=index)
+    res = residuals.get_residuals_from_expected_and_observed_motions(
+        expected, observed, return_mean=True, events=np.array([1, 1, 2])
+    )
+    assert res.columns.tolist() == [
+        ('PGA', Clabel.total_res, m2),
+        ('PGA', Clabel.mean, m2),
+        ('SA(1.0)', Clabel.total_res, m1),
+        ('SA(1.0)', Clabel.inter_ev_res, m1),
+        ('SA(1.0)', Clabel.intra_ev_res, m1),
+        ('SA(1.0)', Clabel.mean, m1),
+    ]
+    assert (res.index == index).all()
+    assert np.allclose(res[('PGA', Clabel.total_res, m2)], [0.3, 0.15, 0.1])
+    # check inter event residuals of the second event (1 record):
+    assert np.isclose(res[('SA(1.0)', Clabel.inter_ev_res, m1)].iloc[-1], 0.4 / 2)
+
+
+def test_residuals_parallel():
+    """test that computing models in parallel does not change the results"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    gsims += ['BindiEtAl2014Rjb']
+    res_df = residuals.get_residuals(gsims, imts, flatfile, likelihood=True)
+    res_df2 = residuals.get_residuals(
+        gsims, imts, flatfile, likelihood=True, workers=2
+    )
+    pd.testing.assert_frame_equal(res_df, res_df2)
+
+
+@pytest.mark.parametrize('max_records', [None, 0, 1, 10, 50, 10000])
+def test_iter_residuals(max_records):
+    """test that residuals computed in chunks are the same as computed at once"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    res_df = residuals.get_residuals(gsims, imts, flatfile, likelihood=True)
+    chunks = list(residuals.iter_residuals(
+        gsims, imts, flatfile, likelihood=True, max_records=max_records
+    ))
+    ev_col = [c for c in res_df.columns if c.endswith(' event_id')][0]
+    if max_records and max_records < len(flatfile):
+        assert len(chunks) > 1
+        # events are never split across chunks:
+        events = [set(c[ev_col]) for c in chunks]
+        assert not any(e1 & e2 for e1, e2 in zip(events[:-1], events[1:]))
+        # chunks exceed `max_records` only with single events:
+        assert all(len(c) <= max_records or len(e) == 1 for c, e in zip(chunks, events))
+    else:
+        assert len(chunks) == 1
+    pd.testing.assert_frame_equal(pd.concat(chunks), res_df)
+    # string columns are kept as they are if the flatfile is not split:
+    flatfile['event_id'] = flatfile['event_id'].astype(str)
+    res_df = residuals.get_residuals(gsims, imts, flatfile)
+    chunks = list(residuals.iter_residuals(
+        gsims, imts, flatfile, max_records=max_records
+    ))
+    if len(chunks) == 1:
+        pd.testing.assert_frame_equal(chunks[0], res_df)
+    else:
+        assert isinstance(pd.concat(chunks)[ev_col].dtype, pd.CategoricalDtype)
+
+
+@pytest.mark.parametrize('header_sep', [Clabel.sep, None])
+def test_add_residuals(header_sep):
+    """test that adding models to residuals is the same as computing all at once"""
+    _, imts, flatfile = get_gsims_imts_flatfile()
+    gsims = ['AkkarEtAlRjb2014', 'BindiEtAl2014Rjb']
+    kwargs = dict(likelihood=True, mean=True, header_sep=header_sep)
+    res_df = residuals.get_residuals(gsims, imts, flatfile, **kwargs)
+    res_df1 = residuals.get_residuals(gsims[:1], imts, flatfile, **kwargs)
+    # remove the residuals of (imts[1], gsims[0]), keeping the input columns:
+    res_df1 = res_df1[[
+        c for c in res_df1.columns
+        if not (c if header_sep is None else c.split(header_sep))[0] == imts[1]
+    ]]
+    # add new models and imts, with some (imt, model) already computed:
+    with patch('egsim.smtk.residuals.get_expected_motions',
+               side_effect=residuals.get_expected_motions) as g_exp:
+        res_df2 = residuals.add_residuals(res_df1, gsims, imts, **kwargs)
+        # models grouped by the missing IMTs (gsims[0] misses only imts[1]):
+        assert g_exp.call_count == 2
+        computed = {(tuple(c[0][0]), tuple(c[0][1])) for c in g_exp.call_args_list}
+        assert computed == {((gsims[0],), (imts[1],)), ((gsims[1],), tuple(imts))}
+    pd.testing.assert_frame_equal(res_df, res_df2)
+    # nothing to add:
+    with patch('egsim.smtk.residuals.get_expected_motions') as g_exp:
+        res_df3 = residuals.add_residuals(res_df2, gsims, **kwargs)
+        assert g_exp.call_count == 0
+    pd.testing.assert_frame_equal(res_df, res_df3)
+    # model requiring properties not in the residuals input columns:
+    with pytest.raises(MissingColumnError):
+        residuals.add_residuals(res_df1, ['ChiouYoungs2014'], **kwargs)
+
+
+def test_sa_spectrum():
+    """test SA interpolation against the legacy implementation (scipy interp1d)"""
+    from scipy.interpolate import interp1d
+    flatfile = pd.DataFrame({
+        'SA(0.1)': [1., 2., 0.5, np.nan],
+        'SA(1.0)': [0.5, 1., 0.3, 1.],
+        'SA(0.2)': [0.8, 1.5, 0.4, 2.],
+    }, index=[5, 6, 7, 8])
+    target = ['SA(0.15)', 'SA(0.2)', 'SA(0.5)', 'SA(0.99)']
+    interp = interp1d([0.1, 0.2, 1.0], np.log10(
+        flatfile[['SA(0.1)', 'SA(0.2)', 'SA(1.0)']].values
+    ), axis=1)
+    expected = 10 ** interp([0.15, 0.5, 0.99])
+    dfr = residuals.get_required_sa(flatfile, target)
+    assert dfr.columns.tolist() == target
+    np.testing.assert_array_equal(dfr['SA(0.2)'], flatfile['SA(0.2)'])
+    np.testing.assert_array_equal(
+        dfr[['SA(0.15)', 'SA(0.5)', 'SA(0.99)']].values, expected
+    )
+    # precomputed spectrum (with more records, and stored as dataframe):
+    sa_spectrum = residuals.SaSpectrum.from_dataframe(
+        residuals.SaSpectrum.from_flatfile(
+            pd.concat([flatfile, flatfile.set_axis([1, 2, 3, 4])])
+        ).to_dataframe()
+    )
+    dfr2 = residuals.get_required_sa(flatfile, target, sa_spectrum)
+    pd.testing.assert_frame_equal(dfr, dfr2)
+    # out of range periods:
+    with pytest.raises(ColumnDataError) as err:
+        residuals.get_required_sa(flatfile, ['SA(0.05)', 'SA(0.5)'])
+    assert 'SA(0.05)' in str(err.value)
+    with pytest.raises(MissingColumnError):
+        residuals.get_required_sa(flatfile[['SA(0.1)']], ['SA(0.5)'])
+
+
+def test_expected_motions_dedup():
+    """test that models computed on distinct records only give the same results"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    gsims = residuals.harmonize_input_gsims(gsims)
+    imts = residuals.harmonize_input_imts(imts)
+    flatfile = residuals.prepare_flatfile(flatfile, gsims, imts)
+    # duplicate all records (same event, different record id):
+    flatfile = pd.concat([flatfile, flatfile.set_axis(flatfile.index + len(flatfile))])
+    ctxs = list(residuals.yield_event_contexts(flatfile))
+    with patch('egsim.smtk.residuals.get_ground_motion_values',
+               side_effect=residuals.get_ground_motion_values) as gmv:
+        expected = residuals.get_expected_motions(gsims, imts, ctxs)
+        assert all(len(c[0][2]) == len(flatfile) // 2 for c in gmv.call_args_list)
+    assert expected.attrs['dedup_ratio'] == 0.5
+    expected2 = residuals.get_expected_motions(gsims, imts, ctxs, dedup=False)
+    assert expected2.attrs['dedup_ratio'] == 0
+    pd.testing.assert_frame_equal(expected, expected2)
+    # the dedup ratio is also set in the residuals:
+    for likelihood in [True, False]:
+        res_df = residuals.get_residuals(
+            gsims, imts, flatfile, likelihood=likelihood, prepared=True)
+        assert res_df.attrs['dedup_ratio'] == 0.5
+    # (no computed model, no duplicate):
+    res_df = residuals.get_residuals(
+        gsims, imts, flatfile, prepared=True, expected=expected)
+    assert res_df.attrs['dedup_ratio'] == 0
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_flatfile_context(shuffle):
+    """test that the flatfile context recarray equals the recarray of all events"""
+    gsims = ["AkkarEtAlRjb2014", "ChiouYoungs2014", "BindiEtAl2014Rjb",
+             "KothaEtAl2020ESHM20"]
+    imts = ['PGA', 'SA(1.0)']
+    gsims = residuals.harmonize_input_gsims(gsims)
+    imts = residuals.harmonize_input_imts(imts)
+    flatfile = residuals.prepare_flatfile(_flatfile.copy(), gsims, imts)
+    if shuffle:
+        flatfile = flatfile.sample(frac=1, random_state=0)
+    ctxs = list(residuals.yield_event_contexts(flatfile))
+    context = residuals.FlatfileContext(flatfile)
+    assert len(context) == len(flatfile)
+    assert context.num_events == len(ctxs)
+    assert context.sids.equals(ctxs[0].sids.append([c.sids for c in ctxs[1:]]))
+    assert (context.mag == [c.mag for c in ctxs]).all()
+    cmaker = residuals.init_context_maker(gsims, imts, dict.fromkeys(context.mag))
+    ctx_recarray = context.recarray(cmaker)
+    expected_recarray = cmaker.recarray(ctxs)
+    assert ctx_recarray.dtype == expected_recarray.dtype
+    for name in expected_recarray.dtype.names:
+        np.testing.assert_array_equal(ctx_recarray[name], expected_recarray[name])
+    pd.testing.assert_frame_equal(
+        residuals.get_expected_motions(gsims, imts, context),
+        residuals.get_expected_motions(gsims, imts, ctxs)
+    )
+
+
+def test_residuals_likelihood():
+    """test the likelihood computed on all residuals at once"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    gsims = residuals.harmonize_input_gsims(gsims)
+    imts = residuals.harmonize_input_imts(imts)
+    flatfile = residuals.prepare_flatfile(flatfile, gsims, imts)
+    res_df = residuals.get_residuals_from_validated_inputs(gsims, imts, flatfile)
+    lh_df = residuals.get_residuals_likelihood(res_df, inplace=False)
+    lh_labels = {
+        Clabel.total_res: Clabel.total_lh,
+        Clabel.inter_ev_res: Clabel.inter_ev_lh,
+        Clabel.intra_ev_res: Clabel.intra_ev_lh
+    }
+    assert len(lh_df.columns) == 3 * len(imts) * len(gsims)
+    for (imtx, label, gsim) in res_df.columns:
+        lh_col = (imtx, lh_labels[label], gsim)
+        np.testing.assert_array_equal(
+            lh_df[lh_col], residuals.get_likelihood(res_df[(imtx, label, gsim)])
+        )
+    res_lh_df = residuals.get_residuals_likelihood(res_df)
+    assert len(res_df.columns) == len(lh_df.columns)  # res_df not modified
+    pd.testing.assert_frame_equal(res_lh_df, pd.concat([res_df, lh_df], axis=1))
+
+
+def test_residuals_float32():
+    """test residuals returned in single precision and their accuracy"""
+    gsims, imts, flatfile = get_gsims_imts_flatfile()
+    res_64 = residuals.get_residuals(gsims, imts, flatfile, likelihood=True,
+                                     mean=True, header_sep=None)
+    res_32 = residuals.get_residuals(gsims, imts, flatfile, likelihood=True,
+                                     mean=True, header_sep=None, dtype='float32')
+    assert res_32.columns.equals(res_64.columns)
+    cols = [c for c in res_64.columns if c[0] != Clabel.input]
+    assert (res_32[cols].dtypes == np.float32).all()
+    # input columns are not converted:
+    input_cols = [c for c in res_64.columns if c[0] == Clabel.input]
+    pd.testing.assert_frame_equal(res_32[input_cols], res_64[input_cols])
+    # values are computed in double precision and only then converted:
+    pd.testing.assert_frame_equal(res_32[cols], res_64[cols].astype('float32'))
+    # documented accuracy:
+    np.testing.assert_allclose(
+        res_32[cols].to_numpy(dtype=float), res_64[cols].to_numpy(), rtol=0,
+        atol=1e-6
+    )
@@ -343,4 +343,326 @@ def test_model_error(mock_get_gmv):
     assert mock_get_gmv.called
     # the expected model is the first among the gsims (sorted), so:
     # expected_model = sorted(gsims)[0]
-    # assert f'{expected_model}: (ValueError) a' in str(err.value)
\ No newline at end of file
+    # assert f'{expected_model}: (ValueError) a' in str(err.value)
+
+
+def test_predictions_float32():
+    """test predictions returned in single precision and their accuracy"""
+    magnitudes = [4., 5., 6., 7.]
+    distances = [1., 10., 100.]
+    dfr_64 = scenarios.get_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances, header_sep=None
+    )
+    dfr_32 = scenarios.get_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances, header_sep=None, dtype='float32'
+    )
+    assert dfr_32.columns.equals(dfr_64.columns)
+    cols = [c for c in dfr_64.columns if c[0] != Clabel.input]
+    assert (dfr_32[cols].dtypes == np.float32).all()
+    # input columns are not converted:
+    input_cols = [c for c in dfr_64.columns if c[0] == Clabel.input]
+    pd.testing.assert_frame_equal(dfr_32[input_cols], dfr_64[input_cols])
+    # documented accuracy:
+    np.testing.assert_allclose(
+        dfr_32[cols].to_numpy(dtype=float), dfr_64[cols].to_numpy(), rtol=1e-7
+    )
+
+
+def _rup_to_point(distance, surface, origin, azimuth, distance_type='rjb',
+                  iter_stop=1E-3, maxiter=1000):
+    """Legacy (one point at a time) implementation of `scenarios._rup_to_points`"""
+    from openquake.hazardlib.geo import Point, Mesh
+    pt1 = origin.point_at(distance, 0., azimuth)
+    r_diff = np.inf
+    dip = surface.dip
+    sin_dip = np.sin(np.radians(dip))
+    iterval = 0
+    while (np.fabs(r_diff) >= iter_stop) and (iterval <= maxiter):
+        pt1mesh = Mesh(np.array([pt1.longitude]), np.array([pt1.latitude]), None)
+        if distance_type == 'rjb' or np.fabs(dip - 90.0) < 1.0E-3:
+            r_diff = (distance - surface.get_joyner_boore_distance(pt1mesh)).flatten()
+        elif 0.0 <= azimuth <= 180.0:
+            r_diff = (distance / sin_dip) - (
+                surface.get_min_distance(pt1mesh).flatten() / sin_dip)
+        else:
+            r_diff = distance - surface.get_min_distance(pt1mesh).flatten()
+        pt0 = Point(pt1.longitude, pt1.latitude)
+        if r_diff > 0.:
+            pt1 = pt0.point_at(r_diff, 0., azimuth)
+        else:
+            pt1 = pt0.point_at(np.fabs(r_diff), 0., (azimuth + 180.) % 360.)
+        iterval += 1
+    return pt1
+
+
+@pytest.mark.parametrize('dip,azimuth', [(90, 90.), (60, 270.), (30, 45.)])
+def test_sites_at_distance(dip, azimuth):
+    """test the site locations computed at once equal the legacy ones"""
+    from openquake.hazardlib.geo import Point
+    surface = scenarios.create_planar_surface(Point(0, 0, 0), 0., dip, 200., 1.5, 1.)
+    hypocenter = scenarios.get_hypocentre_on_planar_surface(surface, (0.5, 0.5))
+    distances = np.logspace(-1, np.log10(300), 30)
+    for dist_type in ['rjb', 'rrup']:
+        sites = scenarios.sites_at_distance(
+            hypocenter, surface, distances, azimuth, (0.5, 0.), dist_type)
+        origin = scenarios.get_hypocentre_on_planar_surface(surface, (0.5, 0.))
+        origin.depth = 0.
+        for dist, site in zip(distances, sites):
+            if dist_type == 'rrup':
+                dist = max(dist, 0.0075)
+            expected = _rup_to_point(dist, surface, origin,
+                                     (surface.get_strike() + azimuth) % 360.,
+                                     dist_type)
+            assert np.isclose(site.longitude, expected.longitude, rtol=0, atol=1e-9)
+            assert np.isclose(site.latitude, expected.latitude, rtol=0, atol=1e-9)
+            assert site.depth == 0
+    with pytest.raises(ValueError):
+        scenarios.sites_at_distance(
+            hypocenter, surface, [hypocenter.depth / 2], azimuth, (0.5, 0.), 'rhypo')
+
+
+def test_predictions_contexts_cache():
+    """test predictions computed with cached scenario contexts"""
+    from egsim.smtk.cache import LRUCache
+    gsims = ["AkkarEtAlRjb2014", "ChiouYoungs2014"]
+    imts = ['PGA', 'SA(0.2)']
+    magnitudes, distances = [5., 6., 7.], np.array([1., 10., 100.])
+    rup_props = scenarios.RuptureProperties(dip=60, hypocenter_location=[0.5, 0.5])
+    site_props = scenarios.SiteProperties(vs30=500, origin_point=[0.5, 0.])
+    expected = scenarios.get_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances, rup_props, site_props)
+    cache = LRUCache(10 ** 8)
+    for _ in range(2):
+        pd.testing.assert_frame_equal(
+            scenarios.get_ground_motion_from_scenarios(
+                gsims, imts, magnitudes, distances, rup_props, site_props,
+                contexts_cache=cache),
+            expected
+        )
+    assert cache.stats['misses'] == len(cache) == 3
+    assert cache.stats['hits'] == 3
+    # a different magnitude list reuses the cached contexts:
+    pd.testing.assert_frame_equal(
+        scenarios.get_ground_motion_from_scenarios(
+            gsims, imts, magnitudes[::-1], distances, rup_props, site_props,
+            contexts_cache=cache),
+        scenarios.get_ground_motion_from_scenarios(
+            gsims, imts, magnitudes[::-1], distances, rup_props, site_props)
+    )
+    assert cache.stats['hits'] == 6
+    # cached contexts have the rupture id of the current magnitude index:
+    gsims_, imts_ = (scenarios.harmonize_input_gsims(gsims),
+                     scenarios.harmonize_input_imts(imts))
+    ctxts = scenarios.build_contexts(
+        gsims_, imts_, magnitudes[1:], distances, rup_props, site_props, cache)
+    np.testing.assert_array_equal(
+        ctxts, scenarios.build_contexts(
+            gsims_, imts_, magnitudes[1:], distances, rup_props, site_props))
+    assert cache.stats['hits'] == 8
+    # (and the cached contexts are not modified):
+    ctxts = scenarios.build_contexts(
+        gsims_, imts_, magnitudes, distances, rup_props, site_props, cache)
+    np.testing.assert_array_equal(ctxts['rup_id'], np.repeat([0, 1, 2], 3))
+    # models with different required parameters do not reuse the cached contexts:
+    pd.testing.assert_frame_equal(
+        scenarios.get_ground_motion_from_scenarios(
+            ['BindiEtAl2014Rjb'], imts, magnitudes, distances, rup_props, site_props,
+            contexts_cache=cache),
+        scenarios.get_ground_motion_from_scenarios(
+            ['BindiEtAl2014Rjb'], imts, magnitudes, distances, rup_props, site_props)
+    )
+    assert cache.stats['hits'] == 11
+    assert cache.stats['misses'] == len(cache) == 6
+    # same for different geometries:
+    rup_props.dip = 90
+    scenarios.get_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances, rup_props, site_props,
+        contexts_cache=cache)
+    assert cache.stats['hits'] == 11
+
+
+@pytest.mark.parametrize('use_threads', [True, False])
+def test_predictions_parallel(use_threads):
+    """test that computing models in parallel does not change the results"""
+    gsims = ["AkkarEtAlRjb2014", "BindiEtAl2014Rjb", "CauzziEtAl2014"]
+    imts = ['PGA', 'SA(0.2)', 'SA(1.0)']
+    magnitudes, distances = [5., 6., 7.], np.array([1., 10., 100.])
+    expected = scenarios.get_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances)
+    pd.testing.assert_frame_equal(
+        scenarios.get_ground_motion_from_scenarios(
+            gsims, imts, magnitudes, distances, workers=2, use_threads=use_threads),
+        expected
+    )
+    if use_threads:
+        # models modifying the contexts do not affect each other:
+        compute = BindiEtAl2014Rjb.compute
+
+        def compute_and_modify_ctx(self, ctx, *args, **kwargs):
+            compute(self, ctx, *args, **kwargs)
+            ctx.mag[:] = np.nan
+
+        with patch.object(BindiEtAl2014Rjb, 'compute', compute_and_modify_ctx):
+            pd.testing.assert_frame_equal(
+                scenarios.get_ground_motion_from_scenarios(
+                    gsims, imts, magnitudes, distances, workers=2,
+                    use_threads=use_threads),
+                expected
+            )
+
+
+@pytest.mark.parametrize('max_records', [None, 0, 1, 3, 7, 10000])
+def test_iter_predictions(max_records):
+    """test that predictions computed in chunks are the same as computed at once"""
+    gsims = ["AkkarEtAlRjb2014", "BindiEtAl2014Rjb"]
+    imts = ['PGA', 'SA(0.2)']
+    magnitudes, distances = [4., 5., 6., 7.], np.array([1., 10., 100.])
+    expected = scenarios.get_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances)
+    chunks = list(scenarios.iter_ground_motion_from_scenarios(
+        gsims, imts, magnitudes, distances, max_records=max_records))
+    if max_records and max_records < len(expected):
+        assert len(chunks) > 1
+        # chunks exceed `max_records` only with single magnitudes:
+        assert all(len(c) <= max(max_records, len(distances)) for c in chunks)
+    else:
+        assert len(chunks) == 1
+    pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+
+
+def test_batch_predictions():
+    """test predictions of several scenarios computed at once"""
+    gsims = ["AkkarEtAlRjb2014", "BindiEtAl2014Rjb"]
+    imts = ['PGA', 'SA(1.0)']
+    magnitudes, distances = [5., 6.], np.array([1., 10., 100.])
+    batch = [
+        (None, None),
+        (scenarios.RuptureProperties(dip=30, rake=90),
+         scenarios.SiteProperties(vs30=300)),
+        (scenarios.RuptureProperties(dip=60, ztor=0.5,
+                                     tectonic_region='Stable Shallow Crust'), None)
+    ]
+    output = scenarios.get_ground_motion_from_batch_scenarios(
+        gsims, imts, magnitudes, distances, batch)
+    id_col = f'{Clabel.input} {Clabel.uncategorized_input} {Clabel.scenario_id}'
+    assert output.columns[-1] == id_col
+    assert len(output) == len(batch) * len(magnitudes) * len(distances)
+    for scenario_id, (rup_props, site_props) in enumerate(batch):
+        expected = scenarios.get_ground_motion_from_scenarios(
+            gsims, imts, magnitudes, distances, rup_props, site_props)
+        pd.testing.assert_frame_equal(
+            output[output[id_col] == scenario_id].drop(columns=id_col)
+            .reset_index(drop=True),
+            expected
+        )
+
+
+def test_grid_predictions():
+    """test predictions on a geographic grid of sites (map mode)"""
+    gsims = ["AkkarEtAlRjb2014", "BindiEtAl2014Rjb"]
+    imts = ['PGA', 'SA(1.0)']
+    magnitudes = [5., 6.]
+    rup_props = scenarios.RuptureProperties(
+        dip=60, initial_point=scenarios.Point(10, 45, 0))
+    site_props = scenarios.SiteProperties(vs30=300)
+    bbox, resolution = (9.5, 44.5, 10.5, 45.25), 0.25
+    output = scenarios.get_ground_motion_on_grid(
+        gsims, imts, magnitudes, bbox, resolution, rup_props, site_props,
+        header_sep=None)
+    lons, lats = scenarios.grid_coordinates(bbox, resolution)
+    assert np.allclose(lons, [9.5, 9.75, 10, 10.25, 10.5])
+    assert np.allclose(lats, [44.5, 44.75, 45, 45.25])
+    site_type = ColumnType.site.value
+    assert len(output) == len(magnitudes) * len(lons) * len(lats)
+    assert not output.isna().any().any()
+    # rows are sorted by magnitude, latitude, longitude:
+    shape = (len(magnitudes), len(lats), len(lons))
+    out_lons = output[(Clabel.input, site_type, 'station_longitude')]
+    out_lats = output[(Clabel.input, site_type, 'station_latitude')]
+    out_mags = output[(Clabel.input, ColumnType.rupture.value, 'mag')]
+    assert (out_lons.values.reshape(shape) == lons[None, None, :]).all()
+    assert (out_lats.values.reshape(shape) == lats[None, :, None]).all()
+    assert (out_mags.values.reshape(shape) == np.array(magnitudes)[:, None, None]).all()
+
+    # compare with the values computed from OpenQuake Site objects:
+    gsims_, imts_ = (scenarios.harmonize_input_gsims(gsims),
+                     scenarios.harmonize_input_imts(imts))
+    cmaker = scenarios.init_context_maker(gsims_, imts_, magnitudes)
+    sites = scenarios.SiteCollection([
+        scenarios.Site(scenarios.Point(lon, lat), vs30=300,
+                       z1pt0=scenarios.vs30_to_z1pt0_cy14(300),
+                       z2pt5=scenarios.vs30_to_z2pt5_cb14(300),
+                       vs30measured=True, backarc=False, xvf=150.0, region=0)
+        for lon, lat in zip(out_lons[:len(out_lons) // 2],
+                            out_lats[:len(out_lats) // 2])
+    ])
+    ctxts = []
+    for i, m in enumerate(magnitudes):
+        surface, hypocenter = scenarios.create_planar_surface_and_hypocenter(
+            m, rup_props)
+        rupture = scenarios.create_rupture(
+            i, m, rup_props.rake, rup_props.tectonic_region, hypocenter, surface)
+        ctxts.append(cmaker.recarray(list(cmaker.get_ctx_iter([rupture], sites))))
+    ctxts = np.hstack(ctxts).view(np.recarray)
+    ctxts['occurrence_rate'] = 0
+    expected = scenarios._get_ground_motion_from_contexts(
+        gsims_, imts_, ctxts, None, None, None, False)
+    pd.testing.assert_frame_equal(output[expected.columns], expected)
+
+    # grid nodes beyond the maximum distance (1000 km) have no prediction
+    # (but all input columns set):
+    output = scenarios.get_ground_motion_on_grid(
+        gsims, imts, magnitudes, (-10, 44, 30, 46), 1, rup_props)
+    predictions = [c for c in output.columns if not c.startswith(Clabel.input)]
+    inputs = [c for c in output.columns if c.startswith(Clabel.input)]
+    assert output[predictions].isna().any(axis=1).any()
+    assert not output[predictions].isna().all(axis=1).all()
+    assert output[predictions].isna().any(axis=1).equals(
+        output[predictions].isna().all(axis=1))
+    assert not output[inputs].isna().any().any()
+    mag_col = f'{Clabel.input} {ColumnType.rupture.value} mag'
+    assert sorted(set(output[mag_col])) == magnitudes
+    # all grid nodes beyond the maximum distance:
+    output = scenarios.get_ground_motion_on_grid(
+        gsims, imts, magnitudes, (100, 10, 101, 11), 0.5, rup_props)
+    assert len(output) == 2 * 3 * 3
+    assert output[predictions].isna().all().all()
+    assert not output[inputs].isna().any().any()
+    with pytest.raises(ValueError):
+        scenarios.grid_coordinates((10, 44, 9, 46), 1)
+    with pytest.raises(ValueError):
+        scenarios.grid_coordinates(bbox, 0)
+
+
+@pytest.mark.parametrize('distance_type', ['rrup', 'rjb', 'repi', 'rhypo'])
+def test_build_context_from_arrays(distance_type):
+    """test that contexts built from arrays equal those built from OpenQuake Sites"""
+    gsims_ = scenarios.harmonize_input_gsims(gsims)
+    imts_ = scenarios.harmonize_input_imts(['PGA'])
+    magnitudes, distances = [5., 6.5], np.linspace(20, 300, 50)
+    cmaker = scenarios.init_context_maker(gsims_, imts_, magnitudes)
+    assert scenarios.fast_context_supported(cmaker, len(distances))
+    assert not scenarios.fast_context_supported(cmaker, cmaker.max_sites_disagg)
+    rup_props = scenarios.RuptureProperties(
+        dip=45, rake=90, ztor=2, strike=30, hypocenter_location=(0.2, 0.7))
+    site_props = scenarios.SiteProperties(
+        vs30=400, z1pt0=30., distance_type=distance_type, line_azimuth=200,
+        backarc=True, region=2)
+    for index, magnitude in enumerate(magnitudes):
+        surface, hypocenter = scenarios.create_planar_surface_and_hypocenter(
+            magnitude, rup_props)
+        rupture = scenarios.create_rupture(
+            index, magnitude, rup_props.rake, rup_props.tectonic_region,
+            hypocenter, surface)
+        sites = scenarios.get_target_sites(
+            hypocenter, surface, distances, **scenarios.asdict(site_props))
+        expected = cmaker.recarray(list(cmaker.get_ctx_iter([rupture], sites)))
+        if distance_type == 'rrup':
+            expected.rrup = distances
+        expected['occurrence_rate'] = 0.
+        expected['rup_id'] = index
+        ctx = scenarios.build_context(
+            cmaker, index, magnitude, distances, rup_props, site_props)
+        assert ctx.dtype == expected.dtype
+        for name in expected.dtype.names:
+            assert np.array_equal(ctx[name], expected[name], equal_nan=True)
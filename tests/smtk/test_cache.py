@@ -0,0 +1,50 @@
+"""
+Tests the smtk cache module
+"""
+import numpy as np
+import pandas as pd
+
+from egsim.smtk.cache import LRUCache, nbytes
+
+
+def test_lru_cache():
+    """test the LRU cache eviction policy and stats"""
+    arr = np.zeros(10)  # 80 bytes
+    cache = LRUCache(200)
+    assert cache.get('a') is None
+    assert cache.put('a', arr)
+    assert cache.put('b', arr)
+    assert cache.get('a') is arr  # 'a' becomes the most recently used
+    assert cache.put('c', arr)  # evicts 'b' (the least recently used)
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b', 5) == 5
+    # value too big:
+    assert not cache.put('d', np.zeros(30))
+    assert 'd' not in cache
+    assert cache.stats == {
+        'items': 2,
+        'size': 160,
+        'max_size': 200,
+        'hits': 1,
+        'misses': 2,
+        'evictions': 1
+    }
+    # replace value:
+    assert cache.put('a', np.zeros(5))
+    assert cache.size == 120 and len(cache) == 2
+    cache.clear()
+    assert cache.stats['items'] == cache.stats['size'] == cache.stats['misses'] == 0
+
+    # disabled cache:
+    cache = LRUCache(0)
+    assert not cache.put('a', arr)
+    assert not cache.put('b', [])
+    assert len(cache) == 0
+
+
+def test_nbytes():
+    dfr = pd.DataFrame({'a': np.zeros(10), 'b': np.zeros(10, dtype=int)})
+    assert nbytes(dfr) == dfr.memory_usage(deep=True).sum()
+    assert nbytes(dfr['a']) == dfr['a'].memory_usage(deep=True)
+    assert nbytes((dfr, dfr['a'].values)) == nbytes(dfr) + 80
+    assert nbytes(None) == 0